@@ -0,0 +1,130 @@
+import numpy as np
+from photo_pipeline import LANDMARK_KEYS
+
+# حساب محاذاة صورة (أو سلسلة صور) على صورة مرجعية من نقاط الجسم (إحداثيات 0..1000)
+# عبر تحويل تشابه (تكبير + دوران + إزاحة) بأقل مربعات (Umeyama) على كل النقاط المتاحة
+MIN_POINTS = 2 # نقطتان تكفيان لتحديد تحويل التشابه بالضبط
+OUTLIER_MIN = 30.0 # لا تُستبعد نقطة خطؤها أقل من 3% من عرض الصورة
+OUTLIER_FACTOR = 2.5 # ... أو أقل من 2.5 ضعف الوسيط
+OUTLIER_ROUNDS = 2
+
+
+class AlignmentError(ValueError):
+    """The landmarks are not enough to compute a transform."""
+
+
+def to_array(points):
+    """{key: [x, y]} -> مصفوفة (6, 2) و NaN للنقاط المفقودة"""
+    arr = np.full((len(LANDMARK_KEYS), 2), np.nan)
+    for i, key in enumerate(LANDMARK_KEYS):
+        p = (points or {}).get(key)
+        if p is not None:
+            arr[i] = p
+    return arr
+
+
+def _fit(src, dst, mask):
+    """أفضل تحويل تشابه dst ≈ s·R·src + t لكل صف، بصيغة مغلقة (حالة 2D من Umeyama)"""
+    w = mask[..., None].astype(float)
+    n = mask.sum(axis=1)[:, None]
+    src = np.where(w > 0, src, 0.0)
+    dst = np.where(w > 0, dst, 0.0)
+    mu_s = (src * w).sum(axis=1) / n
+    mu_d = (dst * w).sum(axis=1) / n
+    xs = (src - mu_s[:, None]) * w
+    xd = (dst - mu_d[:, None]) * w
+    a = (xs * xd).sum(axis=(1, 2))
+    b = (xs[..., 0] * xd[..., 1] - xs[..., 1] * xd[..., 0]).sum(axis=1)
+    var = (xs ** 2).sum(axis=(1, 2))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(var > 0, np.hypot(a, b) / var, np.nan)
+    theta = np.arctan2(b, a)
+    cos, sin = np.cos(theta), np.sin(theta)
+    rot = np.stack([np.stack([cos, -sin], -1), np.stack([sin, cos], -1)], -2)
+    t = mu_d - scale[:, None] * np.einsum("nij,nj->ni", rot, mu_s)
+    return scale, theta, rot, t
+
+
+def _residuals(src, dst, scale, rot, t):
+    pred = scale[:, None, None] * np.einsum("nij,nkj->nki", rot, src) + t[:, None]
+    return np.linalg.norm(dst - pred, axis=-1)
+
+
+def fit_batch(src, dst, mask):
+    """تحويل لكل صف من src (N, 6, 2) إلى dst، مع استبعاد النقاط الشاذة تدريجياً.
+
+    A point is an outlier when the fit made without it misses it by more
+    than OUTLIER_FACTOR times the median error of the other points (and by
+    at least OUTLIER_MIN), so one bad landmark cannot pull the fit towards
+    itself. Rows need at least MIN_POINTS shared landmarks (callers filter
+    them). Returns scale, theta, rotation matrices, translations, RMS
+    residual and the final inlier mask.
+    """
+    n, k = mask.shape
+    mask = mask.copy()
+    rows = np.arange(n)
+    others = ~np.eye(k, dtype=bool)
+    src_k, dst_k = np.repeat(src, k, axis=0), np.repeat(dst, k, axis=0)
+    for _ in range(OUTLIER_ROUNDS):
+        # k تحويلات لكل صف دفعة واحدة، كل منها بدون نقطة واحدة
+        loo = mask[:, None, :] & others
+        scale, _, rot, t = _fit(src_k, dst_k, loo.reshape(n * k, k))
+        res = np.nan_to_num(_residuals(src_k, dst_k, scale, rot, t)).reshape(n, k, k)
+        held_out = np.diagonal(res, axis1=1, axis2=2)
+        limit = np.maximum(OUTLIER_MIN, OUTLIER_FACTOR * np.nanmedian(np.where(loo, res, np.nan), axis=2))
+        score = np.where(mask, held_out / limit, 0.0)
+        worst = score.argmax(axis=1)
+        # نحذف أسوأ نقطة فقط، ونبقي 3 نقاط على الأقل حتى يبقى للخطأ معنى
+        drop = (mask.sum(axis=1) > 3) & (score[rows, worst] > 1)
+        if not drop.any():
+            break
+        mask[rows[drop], worst[drop]] = False
+    scale, theta, rot, t = _fit(src, dst, mask)
+    res = np.where(mask, np.nan_to_num(_residuals(src, dst, scale, rot, t)), 0.0)
+    rms = np.sqrt((res ** 2).sum(axis=1) / mask.sum(axis=1))
+    return scale, theta, rot, t, rms, mask
+
+
+def _result(scale, theta, rot, t, rms, inliers, shared):
+    if not np.isfinite(scale) or scale <= 0:
+        raise AlignmentError("Could not calculate size")
+    # المصفوفة على إحداثيات مُطبّعة 0..1 (الإزاحة / 1000)
+    matrix = np.hstack([scale * rot, t[:, None] / 1000.0])
+    return {
+        "scale": float(scale),
+        "rotation": float(theta),
+        "dx": float(t[0] / 1000.0),
+        "dy": float(t[1] / 1000.0),
+        "matrix": matrix.round(6).tolist(),
+        "residual": float(rms / 1000.0),
+        "points_used": int(inliers.sum()),
+        "outliers": [k for k, used, ok in zip(LANDMARK_KEYS, shared, inliers) if used and not ok],
+    }
+
+
+def align_timeline(reference, timeline):
+    """محاذاة كل صور السلسلة على المرجع في استدعاء واحد؛ خطأ لكل صورة ينقصها نقاط"""
+    if not timeline:
+        return []
+    dst = np.broadcast_to(to_array(reference), (len(timeline), len(LANDMARK_KEYS), 2))
+    src = np.stack([to_array(points) for points in timeline])
+    shared = ~np.isnan(src).any(-1) & ~np.isnan(dst).any(-1)
+    ok = shared.sum(axis=1) >= MIN_POINTS
+
+    results = [{"error": "Missing key landmarks for alignment"} for _ in timeline]
+    if ok.any():
+        fitted = fit_batch(src[ok], dst[ok], shared[ok])
+        for row, i in enumerate(np.flatnonzero(ok)):
+            try:
+                results[i] = _result(*(v[row] for v in fitted), shared[i])
+            except AlignmentError as e:
+                results[i] = {"error": str(e)}
+    return results
+
+
+def align_pair(points1, points2):
+    """{scale, rotation, dx, dy, matrix, residual} لتحويل الصورة الثانية إلى موضع الأولى"""
+    result = align_timeline(points1, [points2])[0]
+    if "error" in result:
+        raise AlignmentError(result["error"])
+    return result
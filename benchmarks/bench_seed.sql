@@ -0,0 +1,25 @@
+-- Benchmark users with 30 days of meals and water, matching
+-- load_test.bench_user(i) (ids ...-000000000001 to ...-0000000003e8).
+-- daily_totals is filled by the schema.sql triggers as the rows go in.
+INSERT INTO auth.users (id, email)
+SELECT ('00000000-0000-4000-8000-' || lpad(to_hex(i), 12, '0'))::uuid, 'bench' || i || '@example.com'
+FROM generate_series(1, 1000) i;
+
+INSERT INTO public.profiles (id, full_name)
+SELECT id, email FROM auth.users;
+
+WITH new_meals AS (
+    INSERT INTO public.meals (user_id, meal_type, created_at)
+    SELECT p.id, (ARRAY['Breakfast', 'Lunch', 'Dinner', 'Snack'])[1 + d % 4],
+           date_trunc('day', now()) - make_interval(days => d) + interval '13 hours'
+    FROM public.profiles p, generate_series(0, 29) d
+    RETURNING id
+)
+INSERT INTO public.meal_items (meal_id, food_name, calories, protein, carbs, fat, weight_grams)
+SELECT id, 'rice with chicken', 450, 30, 50, 12, 300 FROM new_meals;
+
+INSERT INTO public.water_logs (user_id, amount_ml, created_at)
+SELECT p.id, 500, date_trunc('day', now()) - make_interval(days => d) + interval '13 hours'
+FROM public.profiles p, generate_series(0, 29) d;
+
+ANALYZE;
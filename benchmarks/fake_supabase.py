@@ -0,0 +1,324 @@
+"""In-memory stand-in for the async Supabase client used by main.py.
+
+Implements the slice of the postgrest-py query builder the app uses
+(select/insert/update/upsert/delete, eq/neq/gt/gte/lt/lte/in_, order,
+limit, range, one level of embedded selects) plus the RPCs declared in
+schema.sql. daily_totals is derived from the raw logs on read (recomputed
+after each write), standing in for the triggers; deletes record tombstones
+in deleted_rows like record_deleted_row().
+
+Every execute() sleeps latency_ms (+ up to jitter_ms) to stand in for the
+network round trip, and is counted in `calls` ("select:meals", "rpc:...").
+Used by benchmarks/serve.py; not a substitute for testing against Postgres.
+"""
+import asyncio, copy, itertools, random, re, uuid
+from collections import Counter, defaultdict
+from datetime import datetime, date, timedelta, timezone
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _day(value):
+    return str(value or "")[:10]
+
+
+def _cmp_value(v):
+    if isinstance(v, (int, float)):
+        return v
+    return str(v)
+
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.op = "select"
+        self.columns = "*"
+        self.payload = None
+        self.filters = []
+        self.orders = []
+        self.limit_n = None
+        self.offset = 0
+        self.on_conflict = None
+
+    # -- verbs --
+    def select(self, columns="*", count=None):
+        self.columns = columns
+        return self
+
+    def insert(self, payload, **kw):
+        self.op, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload, on_conflict=None, **kw):
+        self.op, self.payload, self.on_conflict = "upsert", payload, on_conflict
+        return self
+
+    def update(self, payload, **kw):
+        self.op, self.payload = "update", payload
+        return self
+
+    def delete(self, **kw):
+        self.op = "delete"
+        return self
+
+    # -- filters --
+    def _f(self, col, fn):
+        self.filters.append((col, fn))
+        return self
+
+    def eq(self, col, v):
+        return self._f(col, lambda x: x is not None and str(x) == str(v))
+
+    def neq(self, col, v):
+        return self._f(col, lambda x: str(x) != str(v))
+
+    def gt(self, col, v):
+        return self._f(col, lambda x: x is not None and _cmp_value(x) > _cmp_value(v))
+
+    def gte(self, col, v):
+        return self._f(col, lambda x: x is not None and _cmp_value(x) >= _cmp_value(v))
+
+    def lt(self, col, v):
+        return self._f(col, lambda x: x is not None and _cmp_value(x) < _cmp_value(v))
+
+    def lte(self, col, v):
+        return self._f(col, lambda x: x is not None and _cmp_value(x) <= _cmp_value(v))
+
+    def in_(self, col, values):
+        values = {str(v) for v in values}
+        return self._f(col, lambda x: str(x) in values)
+
+    def is_(self, col, v):
+        return self._f(col, lambda x: x is None if v in (None, "null") else x == v)
+
+    def or_(self, expr):
+        # Supports the keyset forms used by the app:
+        # col.lt.X,and(col.eq.X,id.lt.Y)  /  col.gt.X,and(col.eq.X,id.gt.Y)
+        m = re.match(r"(\w+)\.(lt|gt)\.(.+?),and\(\1\.eq\.\3,(\w+)\.\2\.(.+)\)$", expr)
+        if not m:
+            raise NotImplementedError(expr)
+        col, op, v, col2, v2 = m.groups()
+        v = v.strip('"')
+        sign = -1 if op == "lt" else 1
+
+        def key(x):
+            return int(x) if str(x).isdigit() else str(x)
+
+        def fn(row):
+            c = (str(row.get(col)) > v) - (str(row.get(col)) < v)
+            if c:
+                return c == sign
+            a, b = key(row.get(col2)), key(v2)
+            return ((a > b) - (a < b)) == sign
+        return self._f(None, fn)
+
+    def order(self, col, desc=False, **kw):
+        self.orders.append((col, desc))
+        return self
+
+    def limit(self, n, **kw):
+        self.limit_n = n
+        return self
+
+    def range(self, start, end):
+        self.offset, self.limit_n = start, end - start + 1
+        return self
+
+    # -- execution --
+    def _match(self, row):
+        for col, fn in self.filters:
+            if col is None:
+                if not fn(row):
+                    return False
+                continue
+            if "." in col:
+                rel, sub = col.split(".", 1)
+                target = self.db.embed(self.table, rel, row)
+                if target is None or not fn(target.get(sub)):
+                    return False
+            elif not fn(row.get(col)):
+                return False
+        return True
+
+    def _project(self, row):
+        if self.columns.strip() == "*":
+            return dict(row)
+        out = {}
+        for part in re.findall(r"\w+(?:!\w+)?\([^)]*\)|[^,\s]+", self.columns):
+            if "(" in part:
+                rel, cols = part.split("(", 1)
+                rel = rel.split("!")[0]
+                target = self.db.embed(self.table, rel, row)
+                cols = cols.rstrip(")")
+                if target is None:
+                    out[rel] = None
+                elif cols.strip() == "*":
+                    out[rel] = dict(target)
+                else:
+                    out[rel] = {c.strip(): target.get(c.strip()) for c in cols.split(",")}
+            elif part == "*":
+                out.update(row)
+            else:
+                out[part] = row.get(part)
+        return out
+
+    async def execute(self):
+        await self.db.latency()
+        self.db.calls[f"{self.op}:{self.table}"] += 1
+        rows = self.db.rows(self.table)
+        if self.op != "select":
+            self.db.writes += 1
+        if self.op == "insert" or self.op == "upsert":
+            payload = self.payload if isinstance(self.payload, list) else [self.payload]
+            return FakeResponse(self.db.insert(self.table, payload, self.on_conflict if self.op == "upsert" else None))
+        matched = [r for r in rows if self._match(r)]
+        if self.op == "update":
+            for r in matched:
+                r.update(copy.deepcopy(self.payload))
+                r["updated_at"] = self.db.now()
+            return FakeResponse([dict(r) for r in matched])
+        if self.op == "delete":
+            self.db.delete(self.table, matched)
+            return FakeResponse([dict(r) for r in matched])
+        for col, desc in reversed(self.orders):
+            matched.sort(key=lambda r: (r.get(col) is None, _cmp_value(r.get(col))), reverse=desc)
+        if self.offset:
+            matched = matched[self.offset:]
+        if self.limit_n is not None:
+            matched = matched[: self.limit_n]
+        return FakeResponse([self._project(r) for r in matched])
+
+
+class FakeRpc:
+    def __init__(self, db, name, params):
+        self.db, self.name, self.params = db, name, params
+
+    async def execute(self):
+        await self.db.latency()
+        self.db.calls[f"rpc:{self.name}"] += 1
+        return FakeResponse(getattr(self.db, f"rpc_{self.name}")(**self.params))
+
+
+class FakeSupabase:
+    """Drop-in for the PostgREST client main.py uses (table(), rpc(), aclose())."""
+
+    EMBEDS = {("meal_items", "meals"): ("meal_id", "meals")}
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0):
+        self.tables = defaultdict(list)
+        self.ids = defaultdict(lambda: itertools.count(1))
+        self.writes = 0
+        self._totals = (None, [])
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls = Counter()
+
+    async def latency(self):
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        else:
+            await asyncio.sleep(0)
+
+    def now(self):
+        return datetime.now(timezone.utc).isoformat()
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def from_(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return FakeRpc(self, name, params or {})
+
+    async def aclose(self):
+        pass
+
+    def rows(self, table):
+        if table == "daily_totals":
+            if self._totals[0] != self.writes:
+                self._totals = (self.writes, self._daily_totals())
+            return self._totals[1]
+        return self.tables[table]
+
+    def embed(self, table, rel, row):
+        fk, target = self.EMBEDS.get((table, rel), (None, None))
+        if fk is None:
+            return None
+        return next((r for r in self.tables[target] if r["id"] == row.get(fk)), None)
+
+    def insert(self, table, payload, on_conflict=None):
+        out = []
+        for row in payload:
+            row = copy.deepcopy(row)
+            if on_conflict:
+                keys = [k.strip() for k in on_conflict.split(",")]
+                existing = next((r for r in self.tables[table] if all(str(r.get(k)) == str(row.get(k)) for k in keys)), None)
+                if existing is not None:
+                    existing.update(row)
+                    existing["updated_at"] = self.now()
+                    out.append(dict(existing))
+                    continue
+            if "id" not in row:
+                row["id"] = str(uuid.uuid4()) if table in ("sleep_logs", "steps_logs") else next(self.ids[table])
+            row.setdefault("created_at", self.now())
+            row.setdefault("updated_at", self.now())
+            if table == "meal_items":
+                row.setdefault("status", "ready")
+            self.tables[table].append(row)
+            out.append(dict(row))
+        return out
+
+    def delete(self, table, rows):
+        ids = {id(r) for r in rows}
+        self.tables[table] = [r for r in self.tables[table] if id(r) not in ids]
+        for r in rows:
+            # Mirrors record_deleted_row(): meal_items resolve their user through the meal.
+            owner = r.get("user_id")
+            if table == "meal_items":
+                meal = self.embed(table, "meals", r)
+                owner = meal and meal.get("user_id")
+            self.tables["deleted_rows"].append({
+                "id": next(self.ids["deleted_rows"]),
+                "table_name": table, "row_id": str(r.get("id")), "user_id": owner,
+                "deleted_at": self.now(),
+            })
+        if table == "meals":
+            meal_ids = {r["id"] for r in rows}
+            self.tables["meal_items"] = [i for i in self.tables["meal_items"] if i.get("meal_id") not in meal_ids]
+
+    # -- emulation of schema.sql objects --
+    def _daily_totals(self):
+        totals = defaultdict(lambda: dict(cal=0.0, prot=0.0, carb=0.0, fat=0.0, water=0.0, sleep=0.0, steps=0.0))
+        meals = {m["id"]: m for m in self.tables["meals"]}
+        for item in self.tables["meal_items"]:
+            meal = meals.get(item.get("meal_id"))
+            if not meal:
+                continue
+            t = totals[(meal["user_id"], _day(meal["created_at"]))]
+            t["cal"] += float(item.get("calories") or 0)
+            t["prot"] += float(item.get("protein") or 0)
+            t["carb"] += float(item.get("carbs") or 0)
+            t["fat"] += float(item.get("fat") or 0)
+        for table, col, key in (("water_logs", "amount_ml", "water"), ("sleep_logs", "hours", "sleep"), ("steps_logs", "steps", "steps")):
+            for r in self.tables[table]:
+                totals[(r["user_id"], _day(r["created_at"]))][key] += float(r.get(col) or 0)
+        return [{"user_id": u, "day": d, **v} for (u, d), v in totals.items()]
+
+    def rpc_get_daily_stats(self, p_user_id, p_start, p_end):
+        by_day = {r["day"]: r for r in self.rows("daily_totals") if r["user_id"] == p_user_id}
+        start = date.fromisoformat(p_start)
+        end = date.fromisoformat(p_end)
+        out = []
+        while start <= end:
+            r = by_day.get(start.isoformat(), {})
+            out.append({"day": start.isoformat(), "calories": r.get("cal", 0.0), "water": r.get("water", 0.0),
+                        "sleep": r.get("sleep", 0.0), "steps": r.get("steps", 0.0)})
+            start += timedelta(days=1)
+        return out
@@ -0,0 +1,99 @@
+"""Stand-in for the Gemini generateContent API with configurable latency and errors.
+
+Answers POST /v1beta/models/<model>:generateContent with JSON that matches
+the request's responseSchema (numbers, strings and arrays filled with
+plausible values), after sleeping --latency-ms plus up to --jitter-ms. A
+fraction --error-rate of requests gets --error-status (429 by default,
+with Retry-After: 1) so retries and the circuit breaker are exercised.
+
+    python benchmarks/gemini_stub.py --port 8090 --latency-ms 900 --jitter-ms 600 --error-rate 0.02
+    GEMINI_BASE_URL=http://127.0.0.1:8090 GEMINI_API_KEY=bench uvicorn main:app
+
+GET /stats returns call counters; POST /stats/reset clears them.
+"""
+import argparse, asyncio, json, random, time
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+FOODS = ("rice", "chicken breast", "egg", "bread", "lentil soup", "apple", "yogurt", "falafel", "hummus", "dates")
+
+
+def sample(schema, rng):
+    """قيمة عشوائية تطابق responseSchema بصيغة Gemini (OBJECT / ARRAY / NUMBER ...)"""
+    kind = str(schema.get("type", "STRING")).upper()
+    if kind == "OBJECT":
+        return {key: sample(sub, rng) for key, sub in schema.get("properties", {}).items()}
+    if kind == "ARRAY":
+        return [sample(schema.get("items", {}), rng) for _ in range(rng.randint(1, 3))]
+    if kind == "NUMBER":
+        return round(rng.uniform(1, 600), 1)
+    if kind == "INTEGER":
+        return rng.randint(1, 600)
+    if kind == "BOOLEAN":
+        return rng.random() < 0.5
+    return rng.choice(FOODS)
+
+
+def create_app(latency_ms=800.0, jitter_ms=400.0, error_rate=0.0, error_status=429, seed=None):
+    app = FastAPI(title="Gemini stub")
+    rng = random.Random(seed)
+    counters = Counter()
+    state = {"in_flight": 0, "max_in_flight": 0, "started": time.monotonic()}
+
+    @app.post("/v1beta/models/{model_action}")
+    async def generate(model_action: str, request: Request):
+        body = await request.json()
+        counters["requests"] += 1
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        try:
+            await asyncio.sleep((latency_ms + rng.uniform(0, jitter_ms)) / 1000)
+            if rng.random() < error_rate:
+                counters[f"status_{error_status}"] += 1
+                headers = {"Retry-After": "1"} if error_status == 429 else None
+                return JSONResponse(status_code=error_status, content={"error": {"code": error_status, "message": "stub error"}}, headers=headers)
+            schema = body.get("generationConfig", {}).get("responseSchema")
+            text = json.dumps(sample(schema, rng)) if schema else "stub answer"
+            counters["status_200"] += 1
+            return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+        finally:
+            state["in_flight"] -= 1
+
+    @app.get("/stats")
+    async def stats():
+        return {
+            **counters,
+            "in_flight": state["in_flight"],
+            "max_in_flight": state["max_in_flight"],
+            "uptime_s": round(time.monotonic() - state["started"], 1),
+        }
+
+    @app.post("/stats/reset")
+    async def reset():
+        counters.clear()
+        state["max_in_flight"] = state["in_flight"]
+        return {"status": "success"}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--jitter-ms", type=float, default=400.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Drive a mix of /log_meal, /get_daily_intake and /get_stats traffic and report latency.
+
+Each concurrency level runs a closed loop of N workers for --duration
+seconds (after --warmup seconds that are not measured) and prints RPS,
+p50/p95/p99 latency and errors per endpoint. Counters from every
+--stats-url (the serve.py, gemini_stub.py and supabase_proxy.py stats
+endpoints) are read before and after each level, so the report also shows
+upstream calls per request.
+
+    python benchmarks/gemini_stub.py --port 8090 &
+    python benchmarks/serve.py --port 8000 --gemini-url http://127.0.0.1:8090 --db-latency-ms 10 &
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 1,16,64 \
+        --stats-url http://127.0.0.1:8000/__bench/stats --stats-url http://127.0.0.1:8090/stats \
+        --json after.json --compare before.json
+
+With --compare the run exits with status 1 if any endpoint's p95 is more
+than --tolerance (default 20%) slower than in the baseline file.
+"""
+import argparse, asyncio, json, math, random, re, sys, time
+from collections import defaultdict
+from datetime import date, timedelta
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional tool dependency
+    raise SystemExit("load_test.py needs httpx: pip install httpx")
+
+FOODS = (
+    "2 eggs and toast", "rice with chicken", "lentil soup", "falafel sandwich", "greek yogurt with honey",
+    "oatmeal with banana", "tuna salad", "grilled salmon and potatoes", "hummus with bread", "3 dates",
+    "كبسة دجاج", "شوربة عدس", "فول مدمس", "سلطة فتوش", "تمر وحليب",
+)
+MEAL_TYPES = ("Breakfast", "Lunch", "Dinner", "Snack")
+DEFAULT_MIX = "log_meal=1,daily_intake=6,stats=2"
+# قيم لحظية وليست عدادات: لا معنى لطرح قيمتها قبل المرحلة
+NON_COUNTERS = {"in_flight", "max_in_flight", "avg_latency_ms", "uptime_s", "hit_ratio", "memory_entries", "queued"}
+
+
+def bench_user(i):
+    """معرّفات ثابتة للمستخدمين التجريبيين (نفسها في serve.py و bench_seed.sql)"""
+    return f"00000000-0000-4000-8000-{i + 1:012x}"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in BUILDERS:
+            raise SystemExit(f"Unknown endpoint in --mix: {name} (choose from {', '.join(BUILDERS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def build_log_meal(rng, user, args):
+    food = rng.choice(FOODS)
+    if rng.random() < args.unique_meals:
+        # طبق لا يعرفه الكاش ولا جدول الأطعمة المحلي: تقديره يصل إلى Gemini
+        food = f"homemade dish #{rng.randrange(10 ** 9)}"
+    elif rng.random() < 0.5:
+        food = f"{rng.randint(50, 950)}g {food}"
+    return "POST", "/log_meal", {"json": {"user_id": user, "meal_type": rng.choice(MEAL_TYPES), "items_ar": food}}
+
+
+def build_daily_intake(rng, user, args):
+    day = date.today()
+    if rng.random() < args.past_days:
+        day -= timedelta(days=rng.randint(1, 30))
+    return "GET", "/get_daily_intake", {"params": {"user_id": user, "date": day.isoformat()}}
+
+
+def build_stats(rng, user, args):
+    return "GET", "/get_stats", {"params": {"user_id": user, "days": rng.choice((7, 7, 30))}}
+
+
+BUILDERS = {"log_meal": build_log_meal, "daily_intake": build_daily_intake, "stats": build_stats}
+
+
+def failed(response):
+    if response.status_code == 304:
+        return False
+    if response.status_code >= 400:
+        return True
+    try:
+        body = response.json()
+    except ValueError:
+        return True
+    return isinstance(body, dict) and body.get("status") in ("error", "failed")
+
+
+async def worker(client, mix, args, rng, deadline, measure_from, samples, etags):
+    names, weights = list(mix), list(mix.values())
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        user = bench_user(rng.randrange(args.users))
+        method, path, kwargs = BUILDERS[name](rng, user, args)
+        key = (path, json.dumps(kwargs.get("params"), sort_keys=True))
+        headers = {}
+        if args.conditional and method == "GET" and key in etags:
+            headers["If-None-Match"] = etags[key]
+        start = time.monotonic()
+        try:
+            response = await client.request(method, path, headers=headers, **kwargs)
+            error = failed(response)
+            if args.conditional and response.headers.get("etag"):
+                etags[key] = response.headers["etag"]
+        except httpx.HTTPError:
+            error = True
+        end = time.monotonic()
+        if start >= measure_from:
+            samples[name].append((end - start, error))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))]
+
+
+def summarize(samples, seconds):
+    report = {}
+    everything = []
+    for name, rows in sorted(samples.items()):
+        latencies = sorted(t for t, _ in rows)
+        everything.extend(latencies)
+        report[name] = {
+            "requests": len(rows),
+            "errors": sum(1 for _, e in rows if e),
+            "rps": round(len(rows) / seconds, 1),
+            **{f"p{p}_ms": round(percentile(latencies, p) * 1000, 1) for p in (50, 95, 99)},
+            "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        }
+    everything.sort()
+    report["total"] = {
+        "requests": len(everything),
+        "errors": sum(r["errors"] for r in report.values()),
+        "rps": round(len(everything) / seconds, 1),
+        **{f"p{p}_ms": round(percentile(everything, p) * 1000, 1) for p in (50, 95, 99)},
+        "max_ms": round(everything[-1] * 1000, 1) if everything else 0.0,
+    }
+    return report
+
+
+def flatten(data, prefix=""):
+    out = {}
+    for key, value in (data or {}).items():
+        if isinstance(value, dict):
+            out.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[f"{prefix}{key}"] = value
+    return out
+
+
+async def read_stats(urls):
+    counters = {}
+    for url in urls:
+        try:
+            # عميل منفصل: لا ينتظر اتصالاً من مجموعة اتصالات العمال
+            async with httpx.AsyncClient(timeout=5) as client:
+                response = await client.get(url)
+            counters.update(flatten(response.json(), f"{url.split('//')[-1].split('/')[0]}:"))
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"  ! could not read {url}: {e}", file=sys.stderr)
+    return counters
+
+
+async def run_level(args, mix, concurrency):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        samples, etags = defaultdict(list), {}
+        measure_from = time.monotonic() + args.warmup
+        deadline = measure_from + args.duration
+
+        async def snapshot():
+            # عدادات الخدمات بعد انتهاء الإحماء، حتى لا تُحسب طلباته
+            await asyncio.sleep(args.warmup)
+            return await read_stats(args.stats_url)
+
+        before = asyncio.ensure_future(snapshot())
+        rng = random.Random(args.seed)
+        await asyncio.gather(*(
+            worker(client, mix, args, random.Random(rng.random()), deadline, measure_from, samples, etags)
+            for _ in range(concurrency)
+        ))
+        before = await before
+        # العينات التي بدأت قبل نهاية المدة وانتهت بعدها تُحسب، فالمدة الفعلية أطول قليلاً
+        elapsed = time.monotonic() - measure_from
+        after = await read_stats(args.stats_url)
+    report = summarize(samples, elapsed)
+    delta = {k: round(v - before.get(k, 0), 3) for k, v in after.items() if re.split(r"[.:]", k)[-1] not in NON_COUNTERS}
+    report["upstream"] = {k: v for k, v in delta.items() if v}
+    return report
+
+
+def print_report(concurrency, report):
+    print(f"\n== concurrency {concurrency} ==")
+    print(f"{'endpoint':<14}{'reqs':>8}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, r in report.items():
+        if name == "upstream":
+            continue
+        print(f"{name:<14}{r['requests']:>8}{r['errors']:>8}{r['rps']:>9}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['max_ms']:>10}")
+    total = report["total"]["requests"] or 1
+    for key, value in sorted(report["upstream"].items()):
+        print(f"  {key:<60}{value:>10}  ({value / total:.2f}/req)")
+
+
+def compare(baseline, results, tolerance):
+    regressions = []
+    for level, report in results.items():
+        for name, r in report.items():
+            old = baseline.get(level, {}).get(name)
+            if name == "upstream" or not old or not old.get("p95_ms"):
+                continue
+            if r["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+                regressions.append(f"c={level} {name}: p95 {old['p95_ms']} -> {r['p95_ms']} ms")
+    return regressions
+
+
+async def main_async(args):
+    mix = parse_mix(args.mix)
+    results = {}
+    for concurrency in args.concurrency:
+        results[str(concurrency)] = report = await run_level(args, mix, concurrency)
+        print_report(concurrency, report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            return 1
+        print("\nNo p95 regressions against the baseline.")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 16, 64])
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds per level")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted endpoints (default {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--unique-meals", type=float, default=0.3, help="fraction of meals only Gemini can estimate")
+    parser.add_argument("--past-days", type=float, default=0.2, help="fraction of daily_intake reads for past days")
+    parser.add_argument("--conditional", action="store_true", help="send If-None-Match like the app does")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stats-url", action="append", default=[], help="JSON counters to diff per level (repeatable)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="baseline results file from an earlier --json run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against --compare")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
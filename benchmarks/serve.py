@@ -0,0 +1,96 @@
+"""Run main.py against local stand-ins for Supabase and Gemini, for load tests.
+
+    python benchmarks/gemini_stub.py --port 8090 &
+    python benchmarks/serve.py --port 8000 --gemini-url http://127.0.0.1:8090 --db-latency-ms 10 --seed-users 200
+
+--db fake (the default) swaps the Supabase client for the in-memory
+FakeSupabase, with --db-latency-ms (+ --db-jitter-ms) per query standing in
+for the network round trip. --db supabase keeps SUPABASE_URL /
+SUPABASE_ANON_KEY from the environment, e.g. the counting proxy in front of
+the PostgREST from docker-compose.yml.
+
+The nutrition cache and the enrichment journal stay in memory unless
+--disk-caches is given, so every run starts cold.
+
+Rate limits and daily AI budgets are off unless RATE_LIMIT_* / AI_DAILY_*
+are set in the environment, since all load comes from one address.
+
+GET /__bench/stats returns Supabase calls (fake only), Gemini client and
+cache counters; load_test.py diffs it per concurrency level.
+"""
+import argparse, os, sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from load_test import FOODS, MEAL_TYPES, bench_user
+
+
+def seed(fake, users, days):
+    """مستخدمون تجريبيون بسجل وجبات وماء لعدة أيام، حتى لا تكون الإحصائيات فارغة"""
+    today = datetime.now().replace(hour=13, minute=0, second=0, microsecond=0)
+    for i in range(users):
+        user_id = bench_user(i)
+        fake.tables["profiles"].append({"id": user_id, "daily_calorie_target": 2000, "habit_goals": {}})
+        for d in range(days):
+            when = (today - timedelta(days=d)).strftime("%Y-%m-%d %H:%M:%S")
+            meal = fake.insert("meals", [{"user_id": user_id, "meal_type": MEAL_TYPES[d % 4], "created_at": when}])[0]
+            fake.insert("meal_items", [{
+                "meal_id": meal["id"], "food_name": FOODS[(i + d) % len(FOODS)],
+                "calories": 450, "protein": 30, "carbs": 50, "fat": 12, "weight_grams": 300,
+            }])
+            fake.insert("water_logs", [{"user_id": user_id, "amount_ml": 500, "created_at": when}])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--gemini-url", default="http://127.0.0.1:8090", help="gemini_stub.py address")
+    parser.add_argument("--db", choices=("fake", "supabase"), default="fake")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0)
+    parser.add_argument("--db-jitter-ms", type=float, default=5.0)
+    parser.add_argument("--seed-users", type=int, default=200)
+    parser.add_argument("--seed-days", type=int, default=30)
+    parser.add_argument("--disk-caches", action="store_true", help="keep the sqlite nutrition cache and journal")
+    args = parser.parse_args()
+
+    os.environ["GEMINI_BASE_URL"] = args.gemini_url
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    # حدود الطلبات والميزانية اليومية معطلة (0) ما لم تُحدد في البيئة: كل طلبات الحمل من نفس الـ IP
+    for name in ("RATE_LIMIT_USER_PER_MINUTE", "RATE_LIMIT_IP_PER_MINUTE", "AI_DAILY_CALLS", "AI_DAILY_TOKENS"):
+        os.environ.setdefault(name, "0")
+    if not args.disk_caches:
+        os.environ["NUTRITION_CACHE_PATH"] = ""
+        os.environ["ENRICHMENT_JOURNAL_PATH"] = ""
+
+    import uvicorn
+    import main as app_module
+
+    fake = None
+    if args.db == "fake":
+        from fake_supabase import FakeSupabase
+        fake = FakeSupabase(latency_ms=args.db_latency_ms, jitter_ms=args.db_jitter_ms)
+        seed(fake, args.seed_users, args.seed_days)
+
+        async def fake_client(*_args, **_kwargs):
+            return fake
+        app_module.create_db_client = fake_client
+
+    async def bench_stats():
+        return {
+            "supabase": dict(fake.calls) if fake else {},
+            "gemini": app_module.gemini.stats(),
+            "nutrition_cache": app_module.nutrition_cache.stats(),
+            "enrichment": app_module.enrichment.stats(),
+        }
+    # قبل mount الواجهة على "/" إن وُجدت، وإلا لن يصل الطلب إلى هذا المسار
+    app_module.app.add_api_route("/__bench/stats", bench_stats, include_in_schema=False)
+    app_module.app.router.routes.insert(0, app_module.app.router.routes.pop())
+
+    uvicorn.run(app_module.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
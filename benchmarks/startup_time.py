@@ -0,0 +1,116 @@
+"""Measure cold-start cost: module import time and time to the first /health answer.
+
+Imports main.py under `python -X importtime` and prints the slowest
+top-level imports, then (unless --no-serve) starts a fresh server process
+--runs times and reports how long each took to answer GET /health. Each
+run is a new interpreter, as after a scale-to-zero wake-up; the OS file
+cache stays warm, so the first run is usually the slowest.
+
+    python benchmarks/startup_time.py --runs 5
+    python benchmarks/startup_time.py --server gunicorn --json startup.json
+
+--server uvicorn runs a single `uvicorn main:app`; --server gunicorn uses
+gunicorn.conf.py (preload + workers), as the Procfile does.
+"""
+import argparse, json, os, socket, statistics, subprocess, sys, time
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional tool dependency
+    raise SystemExit("startup_time.py needs httpx: pip install httpx")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bench_env(port=None):
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    env.setdefault("GEMINI_API_KEY", "bench")
+    env.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+    env.setdefault("SUPABASE_ANON_KEY", "bench")
+    if port:
+        env["PORT"] = str(port)
+    return env
+
+
+def import_times(top):
+    """(self_us, cumulative_us, module) لأبطأ الوحدات التي يستوردها main.py مباشرة"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=bench_env(), capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise SystemExit(f"import main failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), int(cumulative), name[1:].rstrip()))
+    total = next((c for _, c, n in rows if n.strip() == "main"), 0)
+    # الوحدات ذات مسافتين بالضبط: مستوردة مباشرة من main (أو من site قبله)
+    direct = [r for r in rows if r[2].startswith("  ") and not r[2].startswith("   ")]
+    direct.sort(key=lambda r: -r[1])
+    return total, direct[:top]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_health(server, timeout):
+    port = free_port()
+    if server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=bench_env(port), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise SystemExit(f"server exited with {proc.returncode}:\n{proc.stderr.read().decode()[-2000:]}")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        raise SystemExit(f"no /health answer within {timeout}s")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=12, help="slowest direct imports to list")
+    parser.add_argument("--server", choices=("uvicorn", "gunicorn"), default="uvicorn")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--no-serve", action="store_true", help="only measure imports")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    total, direct = import_times(args.top)
+    print(f"import main: {total / 1000:.0f} ms")
+    for self_us, cumulative, name in direct:
+        print(f"  {name.strip():<28}{cumulative / 1000:>8.1f} ms")
+    results = {"import_ms": round(total / 1000, 1), "imports": {n.strip(): round(c / 1000, 1) for _, c, n in direct}}
+
+    if not args.no_serve:
+        runs = [time_to_health(args.server, args.timeout) * 1000 for _ in range(args.runs)]
+        print(f"first /health ({args.server}): " + ", ".join(f"{r:.0f}" for r in runs) + f" ms (median {statistics.median(runs):.0f})")
+        results["health_ms"] = [round(r, 1) for r in runs]
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
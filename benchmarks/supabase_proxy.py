@@ -0,0 +1,76 @@
+"""Counting reverse proxy that lets main.py talk to a plain PostgREST as if it were Supabase.
+
+Forwards /rest/v1/<path> to --upstream (the PostgREST from
+docker-compose.yml), dropping the Supabase apikey/Authorization headers so
+PostgREST runs every request as its anon role. --latency-ms adds a fixed
+delay per request, standing in for the distance to a hosted project.
+
+    docker compose -f benchmarks/docker-compose.yml up -d
+    python benchmarks/supabase_proxy.py --port 54321 --upstream http://127.0.0.1:3000 --latency-ms 20 &
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_ANON_KEY=bench.bench.bench \
+        python benchmarks/serve.py --db supabase --gemini-url http://127.0.0.1:8090
+
+GET /__stats returns request counts per "METHOD table" and time spent upstream.
+"""
+import argparse, asyncio, time
+from collections import Counter
+from contextlib import asynccontextmanager
+
+import httpx
+from fastapi import FastAPI, Request, Response
+
+DROP_REQUEST_HEADERS = {"host", "authorization", "apikey", "content-length", "connection"}
+DROP_RESPONSE_HEADERS = {"content-length", "content-encoding", "transfer-encoding", "connection"}
+
+
+def create_app(upstream, latency_ms=0.0, pool=50):
+    http = httpx.AsyncClient(base_url=upstream, timeout=30, limits=httpx.Limits(max_connections=pool))
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await http.aclose()
+
+    app = FastAPI(title="Supabase proxy", lifespan=lifespan)
+    counters = Counter()
+    state = {"upstream_ms": 0.0}
+
+    @app.get("/__stats")
+    async def stats():
+        return {**counters, "upstream_ms": round(state["upstream_ms"], 1)}
+
+    @app.api_route("/rest/v1/{path:path}", methods=["GET", "POST", "PATCH", "PUT", "DELETE", "HEAD"])
+    async def forward(path: str, request: Request):
+        counters[f"{request.method} {path}"] += 1
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in DROP_REQUEST_HEADERS}
+        url = f"/{path}?{request.url.query}" if request.url.query else f"/{path}"
+        start = time.perf_counter()
+        upstream_response = await http.request(request.method, url, content=await request.body(), headers=headers)
+        state["upstream_ms"] += (time.perf_counter() - start) * 1000
+        if upstream_response.status_code >= 400:
+            counters[f"status_{upstream_response.status_code}"] += 1
+        return Response(
+            content=upstream_response.content,
+            status_code=upstream_response.status_code,
+            headers={k: v for k, v in upstream_response.headers.items() if k.lower() not in DROP_RESPONSE_HEADERS},
+        )
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--upstream", default="http://127.0.0.1:3000", help="PostgREST address")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(args.upstream, args.latency_ms), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
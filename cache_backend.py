@@ -0,0 +1,139 @@
+import asyncio, json, logging, os, time
+
+logger = logging.getLogger(__name__)
+
+# مخزن مفاتيح مشترك للكاش وأرقام إصدار بيانات كل مستخدم (تُستخدم في ETag)
+
+
+class MemoryBackend:
+    """In-process key/value store with per-key TTL.
+
+    Only correct with a single server process: every worker keeps its own
+    copy, so version bumps made by one worker are invisible to the others.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = asyncio.Lock()
+
+    def _alive(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    async def get(self, key):
+        entry = self._alive(key)
+        return entry[1] if entry else None
+
+    async def set(self, key, value, ttl=None):
+        if len(self._data) >= self.max_entries and key not in self._data:
+            # إزالة الأقدم إدراجاً (القاموس يحفظ الترتيب)
+            self._data.pop(next(iter(self._data)))
+        self._data[key] = (time.monotonic() + ttl if ttl else None, value)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def get_version(self, key):
+        """رقم إصدار يبدأ من وقت أول استخدام، فلا يتكرر رقم قديم بعد إعادة التشغيل"""
+        async with self._lock:
+            entry = self._alive(key)
+            if entry is None:
+                await self.set(key, time.time_ns() // 1000)
+                entry = self._alive(key)
+            return entry[1]
+
+    async def bump_version(self, key):
+        async with self._lock:
+            entry = self._alive(key)
+            version = max(entry[1] + 1 if entry else 0, time.time_ns() // 1000)
+            await self.set(key, version)
+            return version
+
+    async def aclose(self):
+        pass
+
+
+class RedisBackend:
+    """Shared store for several workers/instances (Redis, Valkey, KeyDB...). Needs the redis package.
+
+    Values are stored as JSON. If Redis is unreachable every call degrades
+    to a miss (or a fresh version), so requests go to the database instead
+    of failing.
+    """
+
+    def __init__(self, url, prefix="gym:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("REDIS_URL is set but the redis package is missing: pip install redis")
+        self.prefix = prefix
+        self.client = redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.errors = 0
+
+    def _failed(self, op, e):
+        self.errors += 1
+        logger.warning(f"Redis {op} failed: {e}")
+
+    async def get(self, key):
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except Exception as e:
+            self._failed("get", e)
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key, value, ttl=None):
+        try:
+            await self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=int(ttl) if ttl else None)
+        except Exception as e:
+            self._failed("set", e)
+
+    async def delete(self, *keys):
+        try:
+            await self.client.delete(*(self.prefix + k for k in keys))
+        except Exception as e:
+            self._failed("delete", e)
+
+    async def get_version(self, key):
+        key = self.prefix + key
+        try:
+            await self.client.set(key, time.time_ns() // 1000, nx=True)
+            return int(await self.client.get(key))
+        except Exception as e:
+            # بدون Redis لا يمكن الوثوق بأي ETag سابق: رقم جديد في كل مرة
+            self._failed("version", e)
+            return time.time_ns()
+
+    async def bump_version(self, key):
+        key = self.prefix + key
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.set(key, time.time_ns() // 1000, nx=True)
+                pipe.incr(key)
+                return (await pipe.execute())[1]
+        except Exception as e:
+            self._failed("bump", e)
+            return time.time_ns()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# يرفعه rebuild_daily_totals.py بعد إصلاح daily_totals: يبطل ردود اللوحة المخزنة لكل المستخدمين
+ROLLUP_VERSION = "version:rollup"
+
+
+def backend_from_env():
+    """REDIS_URL يفعّل الكاش المشترك بين العمال؛ وإلا كاش داخل العملية (عامل واحد فقط)"""
+    url = os.getenv("REDIS_URL")
+    if url:
+        return RedisBackend(url)
+    return MemoryBackend()
@@ -0,0 +1,140 @@
+import asyncio, json, logging, os, sqlite3, time
+
+logger = logging.getLogger(__name__)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class EnrichmentQueue:
+    """Write-behind queue for work that should not hold up the HTTP response.
+
+    Jobs are plain dicts handed to `handler` by a small pool of asyncio
+    workers. With `journal_path` set, every job is also written to SQLite
+    until it finishes, and jobs left behind by a dead process (crash,
+    deploy) are picked up again on start().
+    """
+
+    def __init__(self, handler, workers=4, journal_path=None, max_attempts=3, retry_delay=15.0, on_give_up=None):
+        self.handler = handler
+        self.on_give_up = on_give_up
+        self.workers = workers
+        self.journal_path = journal_path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self._retries = set()
+        self._db = None
+        self.processed = 0
+        self.failed = 0
+
+    def _journal(self):
+        if not self.journal_path:
+            return None
+        if self._db is None:
+            self._db = sqlite3.connect(self.journal_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, owner INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+        return self._db
+
+    def _recover(self):
+        """استرجاع المهام التي تركتها عملية متوقفة"""
+        db = self._journal()
+        if db is None:
+            return []
+        pid = os.getpid()
+        owners = [row[0] for row in db.execute("SELECT DISTINCT owner FROM jobs")]
+        dead = [o for o in owners if o != pid and not _pid_alive(o)]
+        for owner in dead:
+            db.execute("UPDATE jobs SET owner = ? WHERE owner = ?", (pid, owner))
+        db.commit()
+        rows = db.execute("SELECT id, payload, attempts FROM jobs WHERE owner = ? ORDER BY id", (pid,)).fetchall()
+        return [(job_id, json.loads(payload), attempts) for job_id, payload, attempts in rows]
+
+    async def start(self):
+        for job_id, payload, attempts in self._recover():
+            self._queue.put_nowait((job_id, payload, attempts))
+        if self._queue.qsize():
+            logger.info(f"Enrichment: resumed {self._queue.qsize()} pending jobs")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # المهام غير المكتملة تبقى في SQLite وتُستأنف عند التشغيل التالي
+        tasks = self._tasks + list(self._retries)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._retries.clear()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def submit(self, payload: dict):
+        job_id = None
+        db = self._journal()
+        if db is not None:
+            cur = db.execute(
+                "INSERT INTO jobs (payload, owner, created_at) VALUES (?, ?, ?)",
+                (json.dumps(payload, ensure_ascii=False), os.getpid(), time.time()),
+            )
+            db.commit()
+            job_id = cur.lastrowid
+        await self._queue.put((job_id, payload, 0))
+
+    def _finish(self, job_id):
+        db = self._journal()
+        if db is not None and job_id is not None:
+            db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            db.commit()
+
+    async def _retry_later(self, job_id, payload, attempts):
+        db = self._journal()
+        if db is not None and job_id is not None:
+            db.execute("UPDATE jobs SET attempts = ? WHERE id = ?", (attempts, job_id))
+            db.commit()
+        await asyncio.sleep(self.retry_delay * attempts)
+        await self._queue.put((job_id, payload, attempts))
+
+    async def _worker(self):
+        while True:
+            job_id, payload, attempts = await self._queue.get()
+            try:
+                await self.handler(payload)
+                self.processed += 1
+                self._finish(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                attempts += 1
+                if attempts < self.max_attempts:
+                    logger.warning(f"Enrichment job failed (attempt {attempts}): {e}")
+                    task = asyncio.create_task(self._retry_later(job_id, payload, attempts))
+                    self._retries.add(task)
+                    task.add_done_callback(self._retries.discard)
+                else:
+                    logger.error(f"Enrichment job gave up after {attempts} attempts: {e}")
+                    self.failed += 1
+                    self._finish(job_id)
+                    if self.on_give_up is not None:
+                        try:
+                            await self.on_give_up(payload, e)
+                        except Exception as cb_error:
+                            logger.error(f"Enrichment give-up handler failed: {cb_error}")
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "processed": self.processed, "failed": self.failed}
@@ -0,0 +1,198 @@
+import asyncio, json, random, time
+from collections import Counter
+import httpx
+
+# عميل Gemini مشترك: اتصالات مُعاد استخدامها، إعادة محاولة مع تأخير عشوائي،
+# قاطع دائرة عند تعطل الخدمة، وحد أقصى للطلبات المتزامنة
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GeminiError(Exception):
+    """Gemini could not produce a usable answer (after retries)."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(GeminiError):
+    """Raised without calling Gemini while the breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets a single
+    probe through once `reset_timeout` seconds have passed."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release(self):
+        """Give up a probe slot without judging Gemini's health."""
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class GeminiClient:
+    def __init__(self, api_key, model="gemini-2.5-flash", base_url=DEFAULT_BASE_URL,
+                 max_in_flight=8, max_retries=3, backoff_base=0.5, backoff_max=8.0,
+                 timeout=20.0, queue_timeout=10.0, failure_threshold=5, reset_timeout=30.0,
+                 transport=None, event_hooks=None, admission=None):
+        self.api_key = api_key
+        self.model = model
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        # admission(parts): يُستدعى قبل كل طلب (مثل ميزانية المستخدم) ويرفع GeminiError لرفضه
+        self.admission = admission
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+            headers={"x-goog-api-key": api_key or ""},
+            transport=transport,
+            event_hooks=event_hooks,
+        )
+        self.in_flight = 0
+        self.counters = Counter()
+        self.latency_total = 0.0
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    def _backoff(self, attempt, response=None):
+        # احترام Retry-After عند 429 وإلا تأخير أسي مع "full jitter"
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _post_once(self, body, timeout):
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counters["queue_timeouts"] += 1
+            raise GeminiError("Gemini is overloaded (too many requests in flight)")
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            return await self._http.post(
+                f"/v1beta/models/{self.model}:generateContent", json=body, timeout=timeout
+            )
+        finally:
+            self.latency_total += time.perf_counter() - start
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def generate(self, parts, schema=None, timeout=None):
+        """إرسال الطلب وإرجاع نص أول إجابة، مع إعادة المحاولة عند 429/5xx وانتهاء المهلة"""
+        if not self.api_key:
+            raise GeminiError("GEMINI_API_KEY is not set")
+        probe = self.breaker.state != "closed"
+        if not self.breaker.allow():
+            self.counters["circuit_rejections"] += 1
+            raise CircuitOpenError("Gemini circuit is open, failing fast")
+        try:
+            return await self._generate(parts, schema, timeout)
+        except BaseException:
+            # إلغاء الطلب (انقطاع العميل، wait_for، إيقاف العامل) أو خطأ غير متوقع أثناء المحاولة
+            # التجريبية: لا حكم على صحة Gemini، لكن يجب تحرير المقعد وإلا يبقى القاطع مغلقاً للأبد
+            if probe:
+                self.breaker.release()
+            raise
+
+    async def _generate(self, parts, schema, timeout):
+        if self.admission is not None:
+            try:
+                await self.admission(parts)
+            except GeminiError:
+                self.counters["admission_rejections"] += 1
+                raise
+
+        body = {"contents": [{"parts": parts}]}
+        if schema is not None:
+            body["generationConfig"] = {"responseMimeType": "application/json", "responseSchema": schema}
+
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.counters["retries"] += 1
+            self.counters["requests"] += 1
+            response = None
+            try:
+                response = await self._post_once(body, timeout or httpx.USE_CLIENT_DEFAULT)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                self.counters["transport_errors"] += 1
+                error = GeminiError(f"{type(e).__name__}: {e}")
+            else:
+                self.counters[f"status_{response.status_code}"] += 1
+                if response.status_code == 200:
+                    try:
+                        text = response.json()["candidates"][0]["content"]["parts"][0]["text"]
+                    except (KeyError, IndexError, ValueError) as e:
+                        self.breaker.record_success()
+                        raise GeminiError(f"Unexpected Gemini response: {e}", 200)
+                    self.breaker.record_success()
+                    return text
+                error = GeminiError(response.text, response.status_code)
+                if response.status_code not in RETRY_STATUSES:
+                    # أخطاء العميل (400/403...) لا تعني أن الخدمة معطلة
+                    self.breaker.record_success()
+                    raise error
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._backoff(attempt, response))
+
+        self.counters["failures"] += 1
+        self.breaker.record_failure()
+        raise error
+
+    async def generate_json(self, parts, schema=None, timeout=None):
+        text = await self.generate(parts, schema=schema, timeout=timeout)
+        try:
+            return json.loads(text)
+        except ValueError as e:
+            raise GeminiError(f"Invalid JSON from Gemini: {e}", 200)
+
+    def stats(self):
+        requests = self.counters["requests"]
+        return {
+            "in_flight": self.in_flight,
+            "circuit": self.breaker.state,
+            "avg_latency_ms": round(self.latency_total / requests * 1000, 1) if requests else 0.0,
+            **dict(self.counters),
+        }
@@ -0,0 +1,52 @@
+# إعدادات تشغيل الإنتاج: gunicorn يدير عدة عمال uvicorn (Procfile: gunicorn -c gunicorn.conf.py main:app)
+# كل عامل يشغّل lifespan الخاص به، فينشئ اتصالاته (PostgREST / Gemini / الصور) وطابور الإثراء داخل حلقته
+import logging, multiprocessing, os
+
+logger = logging.getLogger("gunicorn.error")
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+try:
+    import uvicorn_worker  # noqa: F401
+    worker_class = "uvicorn_worker.UvicornWorker"
+except ImportError:  # uvicorn < 0.30 كان يحمل العامل بنفسه
+    worker_class = "uvicorn.workers.UvicornWorker"
+
+# عدد العمال: WEB_CONCURRENCY إن وُجد، وإلا عاملان لكل نواة بحد أقصى 8 (العمل معظمه انتظار للشبكة)
+# ملاحظة: /metrics يعرض عدادات العامل الذي أجاب على الطلب فقط
+# بدون REDIS_URL يبقى الكاش وأرقام الإصدار (ETag) في ذاكرة كل عامل، فعدة عمال سيعطون نتائج قديمة
+if os.getenv("WEB_CONCURRENCY"):
+    workers = int(os.environ["WEB_CONCURRENCY"])
+elif os.getenv("REDIS_URL"):
+    workers = min(2 * multiprocessing.cpu_count(), 8)
+else:
+    workers = 1
+
+# تحميل main.py مرة واحدة في العملية الأم ثم fork: العمال يبدؤون فوراً ويتشاركون صفحات الذاكرة
+# (الاتصالات تُنشأ لاحقاً في lifespan كل عامل، و SQLite يُفتح لكل pid)
+preload_app = True
+
+# طلب واحد قد ينتظر Gemini بإعادة المحاولة (صور، تحليل وجبة) فلا نقتل العامل قبل دقيقتين
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# عند إعادة النشر: وقت لإكمال الطلبات الجارية وحفظ طابور الإثراء قبل الإيقاف
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "60"))
+# أطول من مهلة الاتصالات الخاملة لموازن الحمل أمامنا (60 ثانية عادة) حتى لا يُغلق اتصال أثناء استخدامه
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+
+# إعادة تشغيل العامل بعد عدد من الطلبات (0 = أبداً) مع تفاوت حتى لا يُعاد تشغيل الجميع معاً
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+# من يُصدَّق في X-Forwarded-For (عنوان العميل الحقيقي لحد الطلبات لكل IP): عنوان بروكسي المنصة فقط
+# (مثلاً FORWARDED_ALLOW_IPS=10.0.0.0/8)؛ "*" فقط إذا كان التطبيق لا يُصل إليه إلا عبر شبكة بروكسي موثوقة،
+# وإلا يستطيع أي عميل تزوير الترويسة وتجاوز حد الـ IP.
+# بدون FORWARDED_ALLOW_IPS يرى التطبيق عنوان البروكسي لكل العملاء، فيتوقف حد الـ IP وتُطلب user_id
+# لمسارات Gemini (rate_limit.limiter_from_env)؛ بدون بروكسي أمام التطبيق اضبط RATE_LIMIT_TRUST_CLIENT_IP=1
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+
+def when_ready(server):
+    if server.cfg.workers > 1 and not os.getenv("REDIS_URL"):
+        logger.warning(f"{server.cfg.workers} workers without REDIS_URL: caches and ETags are per worker and may serve stale data")
+    logger.info(f"Serving with {server.cfg.workers} x {server.cfg.worker_class_str} on {server.cfg.bind}")
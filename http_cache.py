@@ -0,0 +1,30 @@
+import hashlib, json
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+# أدوات ETag / If-None-Match: الرد 304 لا يحمل جسماً، فالتطبيق يعيد استخدام نسخته
+
+
+def make_etag(*parts):
+    """ETag ضعيف من أجزاء المفتاح (المستخدم، رقم الإصدار، معاملات الطلب...)"""
+    digest = hashlib.sha1(json.dumps(parts, default=str, separators=(",", ":")).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # المقارنة الضعيفة: W/"x" و "x" متطابقان
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in header.split(","))
+
+
+def not_modified(etag, cache_control):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def cached_json(content, etag, cache_control, headers=None):
+    return JSONResponse(content=content, headers={"ETag": etag, "Cache-Control": cache_control, **(headers or {})})
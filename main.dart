@@ -94,6 +94,13 @@ class _DashboardScreenState extends State<DashboardScreen> {
 
   // Progress Photos State
   List<dynamic> progressPhotos = [];
+  String? _photosEtag;
+  // مؤشر الصفحة التالية من /get_progress_photos (null = لا صور أقدم)
+  String? _photosCursor;
+  bool _loadingMorePhotos = false;
+  static const String _morePhotosValue = '__more__';
+  // آخر رد لكل رابط مع ETag: السيرفر يرد 304 بدون جسم إذا لم يتغير شيء
+  final Map<String, http.Response> _etagCache = {};
   String selectedPhotoSide = 'Front';
   String? leftPhotoId, rightPhotoId;
   double comparisonValue = 0.5;
@@ -132,32 +139,64 @@ class _DashboardScreenState extends State<DashboardScreen> {
   }
 
   Future<void> _fetchProgressPhotos() async {
-    final url = "$baseUrl/get_progress_photos?user_id=$userId";
     try {
-      final response = await http.get(Uri.parse(url)).timeout(const Duration(seconds: 15));
-      if (response.statusCode == 200) {
-        final data = json.decode(utf8.decode(response.bodyBytes)) as Map<String, dynamic>;
-        if (data['status'] == 'success') {
-          setState(() {
-            progressPhotos = data['data'] ?? [];
-            // Auto-select dates if available
-            if (progressPhotos.isNotEmpty) {
-               final filtered = progressPhotos.where((p) => p['side'].toString().toLowerCase() == selectedPhotoSide.toLowerCase()).toList();
-               if (filtered.length >= 2) {
-                 leftPhotoId = filtered[1]['id'].toString();
-                 rightPhotoId = filtered[0]['id'].toString();
-               } else if (filtered.length == 1) {
-                 rightPhotoId = filtered[0]['id'].toString();
-               }
-            }
-          });
+      // الصفحة الأولى فقط (الأحدث)؛ الأقدم تُحمّل عند الطلب عبر _loadMorePhotos
+      // إذا لم تتغير الصفحة الأولى (304) فالمعرض كما هو
+      final headers = <String, String>{};
+      if (_photosEtag != null) headers["If-None-Match"] = _photosEtag!;
+      final response = await http.get(Uri.parse("$baseUrl/get_progress_photos?user_id=$userId&limit=50"), headers: headers).timeout(const Duration(seconds: 15));
+      if (response.statusCode != 200) return;
+      final data = json.decode(utf8.decode(response.bodyBytes)) as Map<String, dynamic>;
+      if (data['status'] != 'success') return;
+      _photosEtag = response.headers['etag'];
+      setState(() {
+        progressPhotos = List<dynamic>.from(data['data'] ?? []);
+        _photosCursor = data['next_cursor'];
+        // Auto-select dates if available
+        if (progressPhotos.isNotEmpty) {
+           final filtered = progressPhotos.where((p) => p['side'].toString().toLowerCase() == selectedPhotoSide.toLowerCase()).toList();
+           if (filtered.length >= 2) {
+             leftPhotoId = filtered[1]['id'].toString();
+             rightPhotoId = filtered[0]['id'].toString();
+           } else if (filtered.length == 1) {
+             rightPhotoId = filtered[0]['id'].toString();
+           }
         }
-      }
+      });
     } catch (e) {
       debugPrint("Fetch Photos Error: $e");
     }
   }
 
+  Future<void> _loadMorePhotos() async {
+    if (_photosCursor == null || _loadingMorePhotos) return;
+    _loadingMorePhotos = true;
+    try {
+      final url = "$baseUrl/get_progress_photos?user_id=$userId&limit=50&cursor=${Uri.encodeQueryComponent(_photosCursor!)}";
+      final response = await http.get(Uri.parse(url)).timeout(const Duration(seconds: 15));
+      if (response.statusCode != 200) return;
+      final data = json.decode(utf8.decode(response.bodyBytes)) as Map<String, dynamic>;
+      if (data['status'] != 'success') return;
+      setState(() {
+        progressPhotos = [...progressPhotos, ...(data['data'] ?? [])];
+        _photosCursor = data['next_cursor'];
+      });
+    } catch (e) {
+      debugPrint("Load More Photos Error: $e");
+    } finally {
+      _loadingMorePhotos = false;
+    }
+  }
+
+  Future<http.Response> _cachedGet(String url, Duration timeout) async {
+    final cached = _etagCache[url];
+    final etag = cached?.headers['etag'];
+    final response = await http.get(Uri.parse(url), headers: etag != null ? {"If-None-Match": etag} : null).timeout(timeout);
+    if (response.statusCode == 304 && cached != null) return cached;
+    if (response.statusCode == 200 && response.headers['etag'] != null) _etagCache[url] = response;
+    return response;
+  }
+
   Future<void> _fetchData([DateTime? date]) async {
     setState(() => isLoading = true);
     final targetDate = date ?? selectedDate;
@@ -167,7 +206,7 @@ class _DashboardScreenState extends State<DashboardScreen> {
     debugPrint("Attempting fetch from: $url");
 
     try {
-      final response = await http.get(Uri.parse(url)).timeout(const Duration(seconds: 30));
+      final response = await _cachedGet(url, const Duration(seconds: 30));
 
       if (response.statusCode == 200) {
         final data = json.decode(utf8.decode(response.bodyBytes)) as Map<String, dynamic>;
@@ -249,7 +288,7 @@ class _DashboardScreenState extends State<DashboardScreen> {
     final days = _statsView == "Week" ? 7 : 30;
     final url = "$baseUrl/get_stats?user_id=$userId&days=$days";
     try {
-      final response = await http.get(Uri.parse(url)).timeout(const Duration(seconds: 20)); // Increased timeout
+      final response = await _cachedGet(url, const Duration(seconds: 20)); // Increased timeout
       if (response.statusCode == 200) {
         final data = json.decode(utf8.decode(response.bodyBytes)) as Map<String, dynamic>;
         setState(() {
@@ -297,12 +336,23 @@ class _DashboardScreenState extends State<DashboardScreen> {
           "meal_type": mealType,
           "items_ar": query,
           "date": dateStr,
+          "itemized": true,
         }),
       );
 
       if (response.statusCode == 200) {
         await _fetchData(selectedDate); // تحديث البيانات لليوم المختار
-        _showSuccess("AI Analysed: $query");
+        final body = json.decode(utf8.decode(response.bodyBytes)) as Map<String, dynamic>;
+        if (body['status'] == 'accepted') {
+          // التقدير يكتمل في الخلفية على السيرفر
+          _showSuccess("Analysing: $query");
+          _pollMealStatus(body['meal_id']);
+        } else {
+          _showSuccess("AI Analysed: $query");
+        }
+      } else if (response.statusCode == 429) {
+        // حد الطلبات أو ميزانية الذكاء الاصطناعي اليومية
+        _showError(json.decode(utf8.decode(response.bodyBytes))['message'] ?? "Too many requests");
       } else {
         _showError("AI Failed: ${response.statusCode}\nBody: ${response.body}");
       }
@@ -313,6 +363,24 @@ class _DashboardScreenState extends State<DashboardScreen> {
     }
   }
 
+  Future<void> _pollMealStatus(dynamic mealId) async {
+    for (int i = 0; i < 15; i++) {
+      await Future.delayed(const Duration(seconds: 2));
+      try {
+        final res = await http.get(Uri.parse("$baseUrl/meal_status?meal_id=$mealId")).timeout(const Duration(seconds: 10));
+        if (res.statusCode != 200) continue;
+        final data = json.decode(utf8.decode(res.bodyBytes)) as Map<String, dynamic>;
+        if (data['status'] == 'success' && data['pending'] == false) {
+          await _fetchData(selectedDate);
+          return;
+        }
+      } catch (e) {
+        debugPrint("Meal Status Error: $e");
+      }
+    }
+    await _fetchData(selectedDate);
+  }
+
   Future<void> _logWater(int amount) async {
     // FIXED: Removed extra spaces in date format
     final dateStr = DateFormat('yyyy-MM-dd HH:mm:ss').format(selectedDate);
@@ -1737,16 +1805,14 @@ Widget _buildWaterBottle(double progress) {
   }
 
   Future<void> _uploadPhoto(String base64, String side, {String? customDate}) async {
-    final res = await http.post(
-      Uri.parse("$baseUrl/upload_progress_photo"),
-      headers: {"Content-Type": "application/json"},
-      body: json.encode({
-        "user_id": userId, 
-        "photo_url": base64, 
-        "side": side,
-        "created_at": customDate
-      }),
-    );
+    // رفع الصورة كملف multipart (بدون تضخم base64)؛ السيرفر يولّد المصغرات
+    final bytes = base64Decode(base64.contains(",") ? base64.split(",").last : base64);
+    final request = http.MultipartRequest("POST", Uri.parse("$baseUrl/upload_progress_photo"))
+      ..fields["user_id"] = userId
+      ..fields["side"] = side
+      ..files.add(http.MultipartFile.fromBytes("file", bytes, filename: "$side.jpg"));
+    if (customDate != null) request.fields["created_at"] = customDate;
+    final res = await http.Response.fromStream(await request.send());
     if (res.statusCode != 200) {
       debugPrint("Upload failed for $side: ${res.body}");
     }
@@ -1787,7 +1853,7 @@ Widget _buildWaterBottle(double progress) {
             scrollDirection: Axis.horizontal,
             child: Row(
               children: [
-                _buildDropdown("Date 1", leftPhotoId, sidePhotos, (v) => setState(() => leftPhotoId = v)),
+                _buildDropdown("Date 1", leftPhotoId, sidePhotos, (v) => v == _morePhotosValue ? _loadMorePhotos() : setState(() => leftPhotoId = v)),
                 const SizedBox(width: 8),
                 _buildDropdown("Side", selectedPhotoSide, ["Front", "Side", "Back"], (v) {
                    setState(() {
@@ -1804,7 +1870,7 @@ Widget _buildWaterBottle(double progress) {
                    });
                 }),
                 const SizedBox(width: 8),
-                _buildDropdown("Date 2", rightPhotoId, sidePhotos, (v) => setState(() => rightPhotoId = v)),
+                _buildDropdown("Date 2", rightPhotoId, sidePhotos, (v) => v == _morePhotosValue ? _loadMorePhotos() : setState(() => rightPhotoId = v)),
               ],
             ),
           ),
@@ -1848,7 +1914,12 @@ Widget _buildWaterBottle(double progress) {
           style: GoogleFonts.workSans(fontSize: 11, color: Colors.blue, fontWeight: FontWeight.bold),
           items: items is List<String> 
             ? items.map((s) => DropdownMenuItem(value: s, child: Text(s))).toList()
-            : items.map<DropdownMenuItem<String>>((p) => DropdownMenuItem(value: p['id'].toString(), child: Text(DateFormat('MMM dd').format(DateTime.parse(p['created_at']))))).toList(),
+            : [
+                ...items.map<DropdownMenuItem<String>>((p) => DropdownMenuItem(value: p['id'].toString(), child: Text(DateFormat('MMM dd').format(DateTime.parse(p['created_at']))))),
+                // آخر القائمة: صور أقدم تُجلب فقط عند الوصول إليها
+                if (_photosCursor != null)
+                  DropdownMenuItem(value: _morePhotosValue, child: Text("Older...", style: GoogleFonts.workSans(fontSize: 11, color: Colors.grey))),
+              ],
           onChanged: (v) => onChanged(v),
         ),
       ),
@@ -1900,7 +1971,7 @@ Widget _buildWaterBottle(double progress) {
                         ..rotateZ(rightRotation)
                         ..scale(rightScale),
                       alignment: Alignment.center,
-                      child: Image.network(rightPhoto['photo_url'], fit: BoxFit.cover,
+                      child: Image.network(rightPhoto['web_url'] ?? rightPhoto['photo_url'], fit: BoxFit.cover,
                         errorBuilder: (c, e, s) => Container(color: Colors.grey[200])),
                     ),
                   ),
@@ -1908,7 +1979,7 @@ Widget _buildWaterBottle(double progress) {
                   Positioned.fill(
                     child: ClipRect(
                       clipper: _SliderClipper(comparisonValue),
-                      child: Image.network(leftPhoto['photo_url'], fit: BoxFit.cover,
+                      child: Image.network(leftPhoto['web_url'] ?? leftPhoto['photo_url'], fit: BoxFit.cover,
                         errorBuilder: (c, e, s) => Container(color: Colors.grey[100])),
                     ),
                   ),
@@ -2250,11 +2321,15 @@ Widget _buildWaterBottle(double progress) {
         body: json.encode({
           "item_id": itemId.toString(),
           "new_food": newName,
+          "user_id": userId,
         }),
       );
       if (res.statusCode == 200) {
         _fetchData(selectedDate);
         _showSuccess("Updated");
+      } else if (res.statusCode == 429) {
+        // حد الطلبات أو ميزانية الذكاء الاصطناعي اليومية
+        _showError(json.decode(utf8.decode(res.bodyBytes))['message'] ?? "Too many requests");
       }
     } catch (e) {
       _showError("Update failed");
@@ -2621,7 +2696,7 @@ class _FullScreenAlignmentPageState extends State<_FullScreenAlignmentPage> {
         children: [
           // BASE PHOTO (Date 1) — fixed, full screen
           Positioned.fill(
-            child: Image.network(widget.leftPhoto['photo_url'], fit: BoxFit.contain,
+            child: Image.network(widget.leftPhoto['web_url'] ?? widget.leftPhoto['photo_url'], fit: BoxFit.contain,
               errorBuilder: (c, e, s) => const Center(child: Icon(Icons.error, color: Colors.white))),
           ),
           // GHOST PHOTO (Date 2) — draggable + transformable
@@ -2636,7 +2711,7 @@ class _FullScreenAlignmentPageState extends State<_FullScreenAlignmentPage> {
                     ..rotateZ(rotation)
                     ..scale(scale),
                   alignment: Alignment.center,
-                  child: Image.network(widget.rightPhoto['photo_url'], fit: BoxFit.contain,
+                  child: Image.network(widget.rightPhoto['web_url'] ?? widget.rightPhoto['photo_url'], fit: BoxFit.contain,
                     errorBuilder: (c, e, s) => const SizedBox.shrink()),
                 ),
               ),
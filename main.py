@@ -1,20 +1,151 @@
-import os, requests, json, re, logging
-from fastapi import FastAPI, Form, Query, Request, Body
+import os, io, csv, json, time, uuid, base64, asyncio, logging
+import httpx
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Form, Query, Request, Body, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 from fastapi.middleware.cors import CORSMiddleware
-from supabase import create_client, Client
+from postgrest import AsyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+from nutrition_cache import NutritionCache, normalize_query
+import nutrition_service
+from gemini_client import GeminiClient, GeminiError
+from enrichment import EnrichmentQueue
+from photo_pipeline import PhotoPipeline, decode_photo, make_variants
+from photo_storage import STORAGE_REF, DatabaseStorage, LocalStorage, storage_from_env
+from cache_backend import ROLLUP_VERSION, backend_from_env
+from http_cache import make_etag, etag_matches, not_modified, cached_json
+from wearable_import import WearableBuckets, iter_records
+from static_assets import PrecompressedStaticFiles
+from rate_limit import BudgetExceeded, RateLimited, ai_subject, limiter_from_env, seconds_until_reset
+import metrics
 
 # إعدادات التسجيل لمراقبة الأخطاء في Render
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-app = FastAPI(title="Solean AI Fitness")
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+NUTRITION_CACHE_PATH = os.getenv("NUTRITION_CACHE_PATH", "nutrition_cache.sqlite3")
+NUTRITION_CACHE_TTL_DAYS = float(os.getenv("NUTRITION_CACHE_TTL_DAYS", "30"))
+GEMINI_BATCH_CONCURRENCY = int(os.getenv("GEMINI_BATCH_CONCURRENCY", "4"))
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "200"))
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+GEMINI_MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", "8"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+ENRICHMENT_WORKERS = int(os.getenv("ENRICHMENT_WORKERS", "4"))
+ENRICHMENT_JOURNAL_PATH = os.getenv("ENRICHMENT_JOURNAL_PATH", "enrichment_jobs.sqlite3")
+PHOTO_MAX_SIDE = int(os.getenv("PHOTO_MAX_SIDE", "768"))
+MAX_TIMELINE_PHOTOS = int(os.getenv("MAX_TIMELINE_PHOTOS", "100"))
+MAX_PHOTO_BYTES = int(float(os.getenv("MAX_PHOTO_MB", "20")) * 1024 * 1024)
+PHOTO_VARIANTS = {"thumb": 320, "web": 1280} # أقصى طول ضلع بالبكسل
+PHOTO_PAGE_SIZE = int(os.getenv("PHOTO_PAGE_SIZE", "30"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "600"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300")) # ردود اليوم الحالي والإحصائيات
+# الأيام السابقة نادراً ما تتغير، لكن التعديل المباشر في Supabase لا يرفع أرقام الإصدار: ساعة على الأكثر
+CLOSED_DAY_TTL = int(os.getenv("CLOSED_DAY_TTL", "3600"))
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "500")) # لكل جدول في كل طلب
+SYNC_OVERLAP_SECONDS = float(os.getenv("SYNC_OVERLAP_SECONDS", "5"))
+SYNC_RETENTION_DAYS = int(os.getenv("SYNC_RETENTION_DAYS", "30")) # يجب ألا تقل عن مدة prune_deleted_rows
+MAX_IMPORT_BYTES = int(float(os.getenv("MAX_IMPORT_MB", "50")) * 1024 * 1024)
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "500")) # صفوف كل upsert
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600")) # ملفات الواجهة بلا بصمة في الاسم
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") # إن ضُبط: /metrics يتطلب Authorization: Bearer <token>
+
+# عملاء مشتركون بين كل الطلبات، يتم إنشاؤهم مرة واحدة عند تشغيل السيرفر
+supabase: AsyncPostgrestClient = None
+gemini: GeminiClient = None
+enrichment: EnrichmentQueue = None
+photos: PhotoPipeline = None
+
+# كاش تقديرات Gemini: ذاكرة (LRU) + SQLite يبقى بعد إعادة التشغيل
+nutrition_cache = NutritionCache(NUTRITION_CACHE_PATH, ttl_seconds=NUTRITION_CACHE_TTL_DAYS * 86400)
+
+# مكان حفظ صور التقدم (مجلد محلي أو S3 أو قاعدة البيانات حسب PHOTO_STORAGE)
+photo_storage = storage_from_env()
+# المضيفات التي يُسمح بتحميل الصور منها لاكتشاف النقاط: التخزين، Supabase، و PHOTO_URL_HOSTS
+PHOTO_URL_HOSTS = {
+    urlparse(photo_storage.public_url).hostname, urlparse(SUPABASE_URL or "").hostname,
+    *os.getenv("PHOTO_URL_HOSTS", "").split(","),
+}
+
+# كاش مشترك (Redis عند ضبط REDIS_URL) لبيانات المستخدم وأرقام إصدارها (تتغير مع كل كتابة)
+cache_backend = backend_from_env()
+
+# حدود الطلبات لكل مستخدم / IP وميزانية Gemini اليومية (RATE_LIMIT_* و AI_DAILY_*)
+limiter = limiter_from_env()
+
+# مقاييس /metrics وتتبع اختياري (OTEL_EXPORTER_OTLP_ENDPOINT أو TRACE_FILE)
+tracer = metrics.tracer_from_env()
+metrics.install_error_counter()
+metrics.REGISTRY.register_stats("gemini", lambda: gemini.stats() if gemini else {})
+metrics.REGISTRY.register_stats("nutrition_cache", nutrition_cache.stats)
+metrics.REGISTRY.register_stats("enrichment", lambda: enrichment.stats() if enrichment else {})
+metrics.REGISTRY.register_stats("landmarks_cache", lambda: photos.cache.stats() if photos else {})
+metrics.REGISTRY.register_stats("cache_backend", lambda: {"errors": getattr(cache_backend, "errors", 0)})
+metrics.REGISTRY.register_stats("rate_limit", limiter.stats)
+if tracer:
+    metrics.REGISTRY.register_stats("tracing", tracer.stats)
+
+async def create_db_client(url, key):
+    """عميل PostgREST فقط (table / rpc كما في عميل Supabase)، بدون auth / realtime / storage
+    التي لا يستخدمها السيرفر وتضيف ~170ms إلى زمن الإقلاع"""
+    return AsyncPostgrestClient(
+        f"{url.rstrip('/')}/rest/v1",
+        headers={**DEFAULT_POSTGREST_CLIENT_HEADERS, "apikey": key, "Authorization": f"Bearer {key}"},
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """إنشاء عميل Supabase غير المتزامن وعميل Gemini المشترك وعمال التقدير في الخلفية"""
+    global supabase, gemini, enrichment, photos
+    supabase = await create_db_client(SUPABASE_URL, SUPABASE_KEY)
+    # زمن كل استدعاء لـ Supabase وعدد صفوفه وأخطاؤه، بتغليف نقل جلسة httpx الخاصة بـ postgrest
+    metrics.instrument_httpx(getattr(supabase, "session", None), "supabase")
+    gemini = GeminiClient(
+        GEMINI_API_KEY,
+        base_url=GEMINI_BASE_URL,
+        max_in_flight=GEMINI_MAX_IN_FLIGHT,
+        max_retries=GEMINI_MAX_RETRIES,
+        admission=limiter.admit_gemini_call,
+    )
+    metrics.instrument_httpx(gemini._http, "gemini")
+    enrichment = EnrichmentQueue(
+        enrich_meal_item,
+        workers=ENRICHMENT_WORKERS,
+        journal_path=ENRICHMENT_JOURNAL_PATH or None,
+        on_give_up=mark_meal_item_failed,
+    )
+    photo_http = httpx.AsyncClient(timeout=httpx.Timeout(15.0, connect=5.0))
+    # روابط الصور القديمة لا حصر لمساراتها: وسم ثابت بدل اسم الملف
+    metrics.instrument_httpx(photo_http, "photos", target="image")
+    photos = PhotoPipeline(
+        supabase, gemini, photo_http, storage=photo_storage, max_side=PHOTO_MAX_SIDE, allowed_hosts=PHOTO_URL_HOSTS
+    )
+    await enrichment.start()
+    if tracer:
+        await tracer.start()
+    try:
+        yield
+    finally:
+        await enrichment.stop()
+        if tracer:
+            await tracer.stop()
+        await photo_http.aclose()
+        await gemini.aclose()
+        await supabase.aclose()
+        await cache_backend.aclose()
+        await limiter.aclose()
+
+app = FastAPI(title="Solean AI Fitness", lifespan=lifespan)
 
 # تفعيل CORS للسماح لـ Zapp بالاتصال (تجنب خطأ XMLHttpRequest)
 app.add_middleware(
@@ -25,56 +156,156 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# آخر middleware يُضاف هو الخارجي: يقيس زمن الطلب كاملاً
+app.add_middleware(metrics.MetricsMiddleware, tracer=tracer)
+
 @app.get("/health")
 async def health_check():
     """نقطة فحص للتأكد من أن السيرفر يعمل"""
     return {"status": "online", "time": datetime.now().isoformat()}
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    """مقاييس بصيغة Prometheus: زمن كل مسار، زمن وعدد صفوف كل استدعاء لـ Supabase/Gemini، الكاش والأخطاء"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        return JSONResponse(status_code=401, content={"error": "Unauthorized", "status": "failed"})
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/test_gemini")
-async def test_gemini(query: str = "2 boiled eggs"):
+async def test_gemini(request: Request, query: str = "2 boiled eggs", itemized: bool = False, user_id: Optional[str] = None):
     """نقطة فحص لاختبار اتصال Gemini بشكل مباشر"""
-    res, debug = get_ai_nutrition_estimate(query)
-    return {"query": query, "result": res, "debug": debug}
+    limited = admit_ai_request(request, user_id)
+    if limited is not None:
+        return limited
+    if itemized:
+        res, debug = await get_ai_nutrition_items(query)
+    else:
+        res, debug = await get_ai_nutrition_estimate(query)
+    return {"query": query, "result": res, "debug": debug, "cache": nutrition_cache.stats(), "gemini": gemini.stats()}
 
 # --- محرك التحليل الذكي ---
-def get_ai_nutrition_estimate(food_query):
-    """تحليل النص واستخراج البيانات الغذائية عبر Gemini"""
-    if not GEMINI_API_KEY:
-        logger.error("خطأ: GEMINI_API_KEY غير مضبوط!")
-        return {"cal": 0, "prot": 0, "carb": 0, "fat": 0, "weight": 0}, {"error": "Key missing"}
-
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-    
+MACRO_KEYS = ("cal", "prot", "carb", "fat", "weight")
+
+# مخطط JSON يفرضه Gemini على الرد بدلاً من استخراج النص بـ regex
+MACROS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "cal": {"type": "NUMBER"},
+        "prot": {"type": "NUMBER"},
+        "carb": {"type": "NUMBER"},
+        "fat": {"type": "NUMBER"},
+        "weight": {"type": "NUMBER", "description": "Total weight in grams"},
+    },
+    "required": list(MACRO_KEYS),
+}
+ITEMS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "name": {"type": "STRING", "description": "The food as written by the user, one item only"},
+            **MACROS_SCHEMA["properties"],
+        },
+        "required": ["name", *MACRO_KEYS],
+    },
+}
+
+def empty_macros():
+    return {"cal": 0, "prot": 0, "carb": 0, "fat": 0, "weight": 0}
+
+def has_macros(data):
+    return isinstance(data, dict) and all(isinstance(data.get(k), (int, float)) for k in MACRO_KEYS)
+
+def peek_nutrition_estimate(food_query):
+    """التقدير الفوري بدون Gemini (القاعدة المحلية ثم الكاش)، أو None"""
+    local = nutrition_service.estimate(food_query)
+    if local is not None:
+        return local, {"source": "local"}
+    cached = nutrition_cache.get(food_query)
+    if cached is not None:
+        return cached, {"cache": "hit"}
+    return None
+
+def peek_nutrition_items(food_query):
+    local = nutrition_service.resolve_items(food_query)
+    if local is not None:
+        return local, {"source": "local"}
+    cached = nutrition_cache.get(f"items:{food_query}")
+    if cached is not None:
+        return cached["items"], {"cache": "hit"}
+    return None
+
+def fallback_items(food_query):
+    """عند نفاد ميزانية Gemini: العناصر المعروفة محلياً أو في الكاش فقط، و(الأجزاء التي لم تُعرف)"""
+    items, unknown = nutrition_service.resolve_items(food_query, partial=True)
+    missing = []
+    for segment in unknown:
+        cached = nutrition_cache.get(segment)
+        if has_macros(cached):
+            items.append({"name": segment, **{k: cached[k] for k in MACRO_KEYS}})
+        else:
+            missing.append(segment)
+    return items, missing
+
+async def get_ai_nutrition_estimate(food_query):
+    """تحليل النص واستخراج البيانات الغذائية: القاعدة المحلية أولاً ثم الكاش ثم Gemini"""
+    fast = peek_nutrition_estimate(food_query)
+    if fast is not None:
+        return fast
+
     prompt = (
         f"Analyze the nutritional content of: '{food_query}'. "
-        "Return ONLY a pure JSON object with these exact keys: "
-        '{"cal": float, "prot": float, "carb": float, "fat": float, "weight": float}. '
         "Be extremely accurate. If multiple items are mentioned, sum their values. "
     )
-    
+
     try:
-        response = requests.post(url, json={"contents": [{"parts": [{"text": prompt}]}]}, timeout=15)
-        if response.status_code != 200:
-            return {"cal": 0, "prot": 0, "carb": 0, "fat": 0, "weight": 0}, {"error": response.text}
-
-        res_data = response.json()
-        raw_text = res_data['candidates'][0]['content']['parts'][0]['text'].strip()
-        
-        clean_json_match = re.search(r'(\{.*\})', raw_text, re.DOTALL)
-        if clean_json_match:
-            data = json.loads(clean_json_match.group(1))
-            return data, {}
-        return {"cal": 0, "prot": 0, "carb": 0, "fat": 0, "weight": 0}, {"error": "JSON not found"}
-            
+        data = await gemini.generate_json([{"text": prompt}], MACROS_SCHEMA, timeout=15)
+        if not has_macros(data):
+            return empty_macros(), {"error": "Incomplete JSON"}
+        nutrition_cache.set(food_query, data)
+        return data, {}
+    except RateLimited as e:
+        return empty_macros(), {"error": str(e), "retry_after": e.retry_after}
+    except BudgetExceeded as e:
+        items, unknown = fallback_items(food_query)
+        if not items:
+            return empty_macros(), {"error": str(e), "budget": True}
+        return nutrition_service.sum_items(items), {"source": "fallback", "unknown": unknown}
     except Exception as e:
         logger.error(f"Gemini Error: {e}")
-        return {"cal": 0, "prot": 0, "carb": 0, "fat": 0, "weight": 0}, {"error": str(e)}
+        return empty_macros(), {"error": str(e)}
+
+async def get_ai_nutrition_items(food_query):
+    """تقسيم الوجبة إلى عناصر منفصلة، لكل عنصر اسمه ووزنه وقيمه الغذائية (طلب Gemini واحد)"""
+    fast = peek_nutrition_items(food_query)
+    if fast is not None:
+        return fast
+
+    cache_key = f"items:{food_query}"
+
+    prompt = (
+        f"Split this meal into its individual foods and analyze each one: '{food_query}'. "
+        "Return one array entry per food with its own weight in grams and macros. "
+        "Keep each name in the user's language. Be extremely accurate. "
+    )
+
+    try:
+        data = await gemini.generate_json([{"text": prompt}], ITEMS_SCHEMA, timeout=15)
+        items = [i for i in (data if isinstance(data, list) else []) if has_macros(i) and i.get("name")]
+        if not items:
+            return [], {"error": "No items returned"}
+        nutrition_cache.set(cache_key, {"items": items})
+        return items, {}
+    except RateLimited as e:
+        return [], {"error": str(e), "retry_after": e.retry_after}
+    except BudgetExceeded as e:
+        items, unknown = fallback_items(food_query)
+        if not items:
+            return [], {"error": str(e), "budget": True}
+        return items, {"source": "fallback", "unknown": unknown}
+    except Exception as e:
+        logger.error(f"Gemini Items Error: {e}")
+        return [], {"error": str(e)}
 
 # --- Pydantic Models for JSON Requests ---
 class MealLogRequest(BaseModel):
@@ -82,6 +313,7 @@ class MealLogRequest(BaseModel):
     meal_type: str
     items_ar: str
     date: Optional[str] = None
+    itemized: bool = False # صف منفصل في meal_items لكل طعام
 
 class WaterLogRequest(BaseModel):
     user_id: str
@@ -100,12 +332,21 @@ class StepsLogRequest(BaseModel):
 
 class MealUpdateRequest(BaseModel):
     item_id: str
-    updates: dict
+    new_food: str
+    user_id: Optional[str] = None # لحدود الطلبات وميزانية Gemini (وإلا تُحسب على عنوان IP إن كان موثوقاً)
 
 class AlignPhotosRequest(BaseModel):
-    img1_base64: str
-    img2_base64: str
+    photo1_id: Optional[int] = None # معرّفات من progress_photos (الطريقة المفضلة)
+    photo2_id: Optional[int] = None
+    img1_base64: Optional[str] = None
+    img2_base64: Optional[str] = None
     side: str = "front"
+    user_id: Optional[str] = None
+
+class AlignTimelineRequest(BaseModel):
+    reference_id: int
+    photo_ids: List[int]
+    user_id: Optional[str] = None
 
 class GoalsUpdateRequest(BaseModel):
     user_id: str
@@ -134,50 +375,321 @@ class BodyMeasurementsRequest(BaseModel):
     calves_r: Optional[float] = None
     calves_l: Optional[float] = None
 
+class BatchMeal(BaseModel):
+    meal_type: str
+    items: List[str]
+    date: Optional[str] = None
+
+class MealBatchRequest(BaseModel):
+    user_id: str
+    meals: List[BatchMeal]
+
 class ProgressPhoto(BaseModel):
     user_id: str
     photo_url: str
     side: str # 'front', 'side', 'back'
     created_at: Optional[str] = None
 
+# --- أدوات قياس زمن الاستعلامات ---
+async def timed_query(name, query, timings):
+    """تنفيذ استعلام Supabase وتسجيل زمنه بالمللي ثانية في timings[name]"""
+    start = time.perf_counter()
+    try:
+        return await query.execute()
+    finally:
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+def server_timing_header(timings):
+    """تحويل الأزمنة إلى ترويسة Server-Timing تظهر في أدوات المطور بالمتصفح"""
+    return ", ".join(f"{name};dur={ms}" for name, ms in timings.items())
+
+async def cached_row(key, fetch):
+    """صف من الكاش المشترك، أو من fetch() ثم يُحفظ (None = لا يُحفظ، مثل خطأ مؤقت)"""
+    row = await cache_backend.get(key)
+    metrics.cache_lookups.inc(cache="user", result="hit" if row is not None else "miss")
+    if row is not None:
+        return row
+    row = await fetch()
+    if row is not None:
+        await cache_backend.set(key, row, USER_CACHE_TTL)
+    return row
+
+# أرقام الإصدار التي تدخل في ETag (تتغير مع كل كتابة تخص المستخدم):
+#   version:logs:{user}        أي تسجيل أو تعديل للوجبات/المياه/النوم/الخطوات
+#   version:day:{user}:{day}   نفس الشيء لليوم المتأثر فقط
+#   version:profile:{user}     الأهداف والمقاسات
+#   version:rollup             إصلاح daily_totals عبر rebuild_daily_totals.py (كل المستخدمين)
+def log_day(log_time):
+    return str(log_time)[:10]
+
+async def data_changed(user_id, *days, profile=False):
+    """إبطال الردود المخزنة بعد كل كتابة: إحصائيات المستخدم والأيام المتأثرة"""
+    if profile:
+        keys = [f"version:profile:{user_id}"]
+    else:
+        keys = [f"version:logs:{user_id}", *(f"version:day:{user_id}:{day}" for day in set(days) if day)]
+    await asyncio.gather(*(cache_backend.bump_version(key) for key in keys))
+
+async def meal_owner(meal_id):
+    """(user_id, اليوم) لوجبة، لإبطال الكاش بعد تعديل عناصرها"""
+    res = await supabase.table("meals").select("user_id, created_at").eq("id", meal_id).limit(1).execute()
+    if not res.data:
+        return None, None
+    return res.data[0]["user_id"], log_day(res.data[0]["created_at"])
+
+async def conditional_json(request, etag, cache_control, ttl, load):
+    """304 إذا كانت نسخة العميل حديثة، أو الرد المخزن، أو load(timings) ثم تخزينه"""
+    if etag_matches(request, etag):
+        metrics.cache_lookups.inc(cache="response", result="not_modified")
+        return not_modified(etag, cache_control)
+    key = f"response:{etag}"
+    body = await cache_backend.get(key)
+    metrics.cache_lookups.inc(cache="response", result="hit" if body is not None else "miss")
+    if body is not None:
+        return cached_json(body, etag, cache_control, {"Server-Timing": "cache;desc=hit"})
+    timings = {}
+    body = await load(timings)
+    if body.get("error"):
+        return body
+    await cache_backend.set(key, body, ttl)
+    return cached_json(body, etag, cache_control, {"Server-Timing": server_timing_header(timings)})
+
+def admit_ai_request(request, user_id=None):
+    """يحدد من تُخصم منه استدعاءات Gemini لهذا الطلب (المستخدم، وإلا عنوان IP الموثوق): None للمتابعة أو رد 400.
+    حد الطلبات لكل مستخدم و IP يُطبَّق عند أول استدعاء فعلي لـ Gemini فقط (RateLimited)"""
+    if not limiter.start_request(user_id, request.client.host if request.client else None):
+        return JSONResponse(status_code=400, content={"status": "error", "message": "user_id is required"})
+    return None
+
+def too_many_requests(retry_after):
+    """رد 429 عندما يتجاوز الطلب حد المستخدم أو الـ IP ويحتاج Gemini"""
+    return JSONResponse(
+        status_code=429,
+        content={"status": "error", "message": f"Too many requests, retry in {retry_after}s"},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+def budget_exhausted(message):
+    """رد 429 عند نفاد ميزانية Gemini اليومية ولا يوجد تقدير محلي أو مخزن"""
+    return JSONResponse(
+        status_code=429,
+        content={"status": "error", "message": f"{message}. Known foods still work, or enter the values manually."},
+        headers={"Retry-After": str(seconds_until_reset())},
+    )
+
+def estimation_failed(message):
+    """رد 503 عندما يتعذر التقدير (Gemini معطل أو تجاوز الحصة) بدلاً من حفظ أصفار"""
+    return JSONResponse(status_code=503, content={"status": "error", "message": f"Nutrition estimate unavailable: {message}"})
+
+def meal_item_row(meal_id, food_name, nutri):
+    """تحويل تقدير Gemini إلى صف في جدول meal_items"""
+    return {
+        "meal_id": meal_id,
+        "food_name": food_name,
+        "calories": float(nutri.get('cal', 0)),
+        "protein": float(nutri.get('prot', 0)),
+        "carbs": float(nutri.get('carb', 0)),
+        "fat": float(nutri.get('fat', 0)),
+        "weight_grams": float(nutri.get('weight', 0))
+    }
+
+async def estimate_meal_rows(food, itemized):
+    """قائمة (اسم، قيم) لعناصر الوجبة عبر Gemini؛ يرفع GeminiError عند الفشل"""
+    if itemized:
+        items, _ = await get_ai_nutrition_items(food)
+        if items:
+            return [(i["name"], i) for i in items]
+    nutri, debug = await get_ai_nutrition_estimate(food)
+    if debug.get("error"):
+        raise GeminiError(debug["error"])
+    return [(food, nutri)]
+
+async def enrich_meal_item(job):
+    """عامل الخلفية: تقدير العنصر ثم تحديث الصف من 'estimating' إلى 'ready'"""
+    ai_subject.set(job.get("user_id"))
+    rows = await estimate_meal_rows(job["food"], job.get("itemized", False))
+    (first_name, first), rest = rows[0], rows[1:]
+    await supabase.table("meal_items").update(
+        {**meal_item_row(job["meal_id"], first_name, first), "status": "ready"}
+    ).eq("id", job["item_id"]).execute()
+    if rest:
+        await supabase.table("meal_items").insert(
+            [meal_item_row(job["meal_id"], name, nutri) for name, nutri in rest]
+        ).execute()
+    await job_data_changed(job)
+
+async def mark_meal_item_failed(job, error):
+    await supabase.table("meal_items").update({"status": "failed"}).eq("id", job["item_id"]).execute()
+    await job_data_changed(job)
+
+async def job_data_changed(job):
+    # المهام القديمة في السجل لا تحمل user_id
+    user_id, day = job.get("user_id"), job.get("day")
+    if not user_id:
+        user_id, day = await meal_owner(job["meal_id"])
+    if user_id:
+        await data_changed(user_id, day)
+
 # --- 1. تسجيل الوجبات (Log Meal) ---
 @app.post("/log_meal")
-async def log_meal(data: MealLogRequest):
+async def log_meal(data: MealLogRequest, request: Request):
     user_id = data.user_id
     meal_type = data.meal_type
     items_ar = data.items_ar
     log_time = data.date if data.date else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
+    limited = admit_ai_request(request, user_id)
+    if limited is not None:
+        return limited
+
     try:
-        meal_res = supabase.table("meals").insert({
+        # إذا كان التقدير متاحاً فوراً (القاعدة المحلية أو الكاش) نحفظه مباشرة
+        rows = None
+        fast = peek_nutrition_items(items_ar) if data.itemized else None
+        if fast is not None:
+            rows = [(i["name"], i) for i in fast[0]]
+        else:
+            fast = peek_nutrition_estimate(items_ar)
+            if fast is not None:
+                rows = [(items_ar, fast[0])]
+
+        unknown = []
+        if rows is None and await limiter.over_budget(ai_subject.get()):
+            # ميزانية Gemini انتهت: نحفظ ما يُعرف محلياً بدلاً من مهمة خلفية ستفشل
+            items, unknown = fallback_items(items_ar)
+            if not items:
+                return budget_exhausted("Daily AI budget reached")
+            rows = [(i["name"], i) for i in items] if data.itemized else [(items_ar, nutrition_service.sum_items(items))]
+        if rows is None:
+            # التقدير سيحتاج Gemini في الخلفية: الآن فقط يُخصم الطلب من حد المستخدم و IP
+            try:
+                await limiter.charge_request()
+            except RateLimited as e:
+                return too_many_requests(e.retry_after)
+
+        meal_res = await supabase.table("meals").insert({
             "user_id": user_id, 
             "meal_type": meal_type,
             "created_at": log_time
         }).execute()
         meal_id = meal_res.data[0]['id']
-        
-        nutri, _ = get_ai_nutrition_estimate(items_ar)
-        
-        payload = {
-            "meal_id": meal_id,
-            "food_name": items_ar,
-            "calories": float(nutri.get('cal', 0)),
-            "protein": float(nutri.get('prot', 0)),
-            "carbs": float(nutri.get('carb', 0)),
-            "fat": float(nutri.get('fat', 0)),
-            "weight_grams": float(nutri.get('weight', 0))
-        }
-        supabase.table("meal_items").insert(payload).execute()
-        return {"status": "success", "data": payload}
+
+        if rows is not None:
+            payload = [meal_item_row(meal_id, name, nutri) for name, nutri in rows]
+            await supabase.table("meal_items").insert(payload).execute()
+            await data_changed(user_id, log_day(log_time))
+            result = {"status": "success", "data": payload if data.itemized else payload[0]}
+            if unknown:
+                result["unknown"] = unknown # أجزاء لم تُقدَّر لأن ميزانية Gemini انتهت
+            return result
+
+        # وإلا نحفظ العنصر بحالة 'estimating' ونكمل التقدير عبر Gemini في الخلفية
+        placeholder = {**meal_item_row(meal_id, items_ar, empty_macros()), "status": "estimating"}
+        item_res = await supabase.table("meal_items").insert(placeholder).execute()
+        item = item_res.data[0]
+        await data_changed(user_id, log_day(log_time))
+        await enrichment.submit({
+            "item_id": item["id"], "meal_id": meal_id, "food": items_ar, "itemized": data.itemized,
+            "user_id": user_id, "day": log_day(log_time)
+        })
+        return {"status": "accepted", "meal_id": meal_id, "data": item}
     except Exception as e:
         logger.error(f"Log Meal Error: {e}")
         return {"status": "error", "message": str(e)}
 
+# --- 1d. حالة التقدير (Meal Status) ---
+@app.get("/meal_status")
+async def meal_status(meal_id: str = Query(...)):
+    """يستخدمه التطبيق لمعرفة متى اكتمل تقدير الوجبة في الخلفية"""
+    try:
+        res = await supabase.table("meal_items").select("id, food_name, calories, protein, carbs, fat, weight_grams, status").eq("meal_id", meal_id).execute()
+        items = res.data if res.data else []
+        return {
+            "status": "success",
+            "pending": any(i.get("status") == "estimating" for i in items),
+            "items": items
+        }
+    except Exception as e:
+        logger.error(f"Meal Status Error: {e}")
+        return {"status": "error", "message": str(e)}
+
+# --- 1a. تسجيل عدة وجبات دفعة واحدة (Batch Log Meals) ---
+@app.post("/log_meals_batch")
+async def log_meals_batch(data: MealBatchRequest, request: Request):
+    default_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    total_items = sum(len(m.items) for m in data.meals)
+    if not data.meals:
+        return {"status": "error", "message": "No meals provided"}
+    if total_items > MAX_BATCH_ITEMS:
+        return {"status": "error", "message": f"Too many items ({total_items} > {MAX_BATCH_ITEMS})"}
+    limited = admit_ai_request(request, data.user_id)
+    if limited is not None:
+        return limited
+
+    try:
+        # كل نص طعام مختلف يُقدَّر مرة واحدة فقط، وبحد أقصى من الطلبات المتزامنة لـ Gemini
+        unique_foods = {}
+        for meal in data.meals:
+            for item in meal.items:
+                unique_foods.setdefault(normalize_query(item), item)
+
+        semaphore = asyncio.Semaphore(GEMINI_BATCH_CONCURRENCY)
+
+        async def estimate(food):
+            async with semaphore:
+                return await get_ai_nutrition_estimate(food)
+
+        results = await asyncio.gather(*(estimate(food) for food in unique_foods.values()))
+        failed = [food for food, (_, debug) in zip(unique_foods.values(), results) if debug.get("error")]
+        retry_after = max((debug.get("retry_after", 0) for _, debug in results), default=0)
+        if retry_after:
+            return too_many_requests(retry_after)
+        if failed and any(debug.get("budget") for _, debug in results):
+            return budget_exhausted(f"Daily AI budget reached, could not estimate: {', '.join(failed)}")
+        if failed:
+            return estimation_failed(f"Could not estimate: {', '.join(failed)}")
+        estimates = {key: nutri for key, (nutri, _) in zip(unique_foods.keys(), results)}
+        # أجزاء لم تُقدَّر لأن ميزانية Gemini انتهت (القيم من التقدير المحلي لباقي الوجبة)
+        unknown = list(dict.fromkeys(part for _, debug in results for part in debug.get("unknown", [])))
+
+        # طلبان فقط لقاعدة البيانات: كل الوجبات ثم كل العناصر
+        meals_res = await supabase.table("meals").insert([
+            {"user_id": data.user_id, "meal_type": m.meal_type, "created_at": m.date or default_time}
+            for m in data.meals
+        ]).execute()
+
+        # PostgREST يعيد الصفوف المُدرجة بنفس ترتيب الإرسال
+        item_rows = [
+            meal_item_row(meal_row['id'], item, estimates[normalize_query(item)])
+            for meal, meal_row in zip(data.meals, meals_res.data)
+            for item in meal.items
+        ]
+        if item_rows:
+            await supabase.table("meal_items").insert(item_rows).execute()
+        await data_changed(data.user_id, *(log_day(m.date or default_time) for m in data.meals))
+
+        result = {
+            "status": "success",
+            "meals": len(meals_res.data),
+            "items": len(item_rows),
+            "unique_foods": len(unique_foods),
+            "data": item_rows
+        }
+        if unknown:
+            result["unknown"] = unknown
+        return result
+    except Exception as e:
+        logger.error(f"Batch Log Meal Error: {e}")
+        return {"status": "error", "message": str(e)}
+
 # --- 1b. حذف وجبة (Delete Meal Item) ---
 @app.delete("/delete_meal_item")
 async def delete_meal_item(item_id: str = Query(...)):
     try:
-        supabase.table("meal_items").delete().eq("id", item_id).execute()
+        res = await supabase.table("meal_items").delete().eq("id", item_id).execute()
+        if res.data:
+            user_id, day = await meal_owner(res.data[0]["meal_id"])
+            if user_id:
+                await data_changed(user_id, day)
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Delete Error: {e}")
@@ -185,19 +697,35 @@ async def delete_meal_item(item_id: str = Query(...)):
 
 # --- 1c. تحديث وجبة (Update Meal Item) ---
 @app.post("/update_meal_item")
-async def update_meal_item(data: MealUpdateRequest):
+async def update_meal_item(data: MealUpdateRequest, request: Request):
     item_id = data.item_id
     new_food = data.new_food
+    limited = admit_ai_request(request, data.user_id)
+    if limited is not None:
+        return limited
     try:
-        nutri, _ = get_ai_nutrition_estimate(new_food)
-        supabase.table("meal_items").update({
+        nutri, debug = await get_ai_nutrition_estimate(new_food)
+        if debug.get("retry_after"):
+            return too_many_requests(debug["retry_after"])
+        if debug.get("budget"):
+            return budget_exhausted(debug["error"])
+        if debug.get("error"):
+            return estimation_failed(debug["error"])
+        res = await supabase.table("meal_items").update({
             "food_name": new_food,
             "calories": float(nutri.get('cal', 0)),
             "protein": float(nutri.get('prot', 0)),
             "carbs": float(nutri.get('carb', 0)),
             "fat": float(nutri.get('fat', 0)),
             "weight_grams": float(nutri.get('weight', 0)),
+            "status": "ready",
         }).eq("id", item_id).execute()
+        if res.data:
+            user_id, day = await meal_owner(res.data[0]["meal_id"])
+            if user_id:
+                await data_changed(user_id, day)
+        if debug.get("unknown"):
+            return {"status": "success", "unknown": debug["unknown"]} # ميزانية Gemini انتهت: التقدير ناقص
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Update Error: {e}")
@@ -215,7 +743,8 @@ async def log_water(data: WaterLogRequest):
             "amount_ml": int(amount_ml),
             "created_at": log_time
         }
-        res = supabase.table("water_logs").insert(data).execute()
+        res = await supabase.table("water_logs").insert(data).execute()
+        await data_changed(user_id, log_day(log_time))
         return {"status": "success", "data": res.data}
     except Exception as e:
         logger.error(f"Log Water Error: {e}")
@@ -233,7 +762,8 @@ async def log_sleep(data: SleepLogRequest):
             "hours": float(hours),
             "created_at": log_time
         }
-        res = supabase.table("sleep_logs").insert(payload).execute()
+        res = await supabase.table("sleep_logs").insert(payload).execute()
+        await data_changed(user_id, log_day(log_time))
         return {"status": "success", "data": res.data}
     except Exception as e:
         logger.error(f"Log Sleep Error: {e}")
@@ -251,12 +781,83 @@ async def log_steps(data: StepsLogRequest):
             "steps": int(steps),
             "created_at": log_time
         }
-        res = supabase.table("steps_logs").insert(payload).execute()
+        res = await supabase.table("steps_logs").insert(payload).execute()
+        await data_changed(user_id, log_day(log_time))
         return {"status": "success", "data": res.data}
     except Exception as e:
         logger.error(f"Log Steps Error: {e}")
         return {"status": "error", "message": str(e)}
 
+# --- 5a. استيراد بيانات الساعة الذكية (Bulk Wearable Import) ---
+async def limited_stream(request, max_bytes):
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise OverflowError("Import is too large")
+        yield chunk
+
+def limited_request(request, max_bytes):
+    """نفس الطلب لكن جسمه يرفع OverflowError بعد max_bytes أثناء القراءة (حتى بدون Content-Length)"""
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                raise OverflowError("Request body is too large")
+        return message
+
+    return Request(request.scope, receive)
+
+@app.post("/import_wearable")
+async def import_wearable(
+    request: Request,
+    user_id: str = Query(...),
+    source: str = Query(..., min_length=1, max_length=64), # مثلاً health_connect أو apple_health
+    bucket: str = Query("hour", pattern="^(hour|day)$"),
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$")
+):
+    """خطوات ونوم من تصدير NDJSON أو CSV (عمود لكل من type, start, end, value).
+
+    Samples are summed into buckets while the body streams in, then written
+    with upserts on (user_id, source, created_at): importing an overlapping
+    export again replaces those buckets instead of adding duplicates.
+    """
+    try:
+        if int(request.headers.get("content-length") or 0) > MAX_IMPORT_BYTES:
+            return JSONResponse(status_code=413, content={"error": "Import is too large", "status": "failed"})
+        fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+        buckets = WearableBuckets(bucket)
+        try:
+            async for record in iter_records(limited_stream(request, MAX_IMPORT_BYTES), fmt):
+                buckets.add(record)
+        except OverflowError as e:
+            return JSONResponse(status_code=413, content={"error": str(e), "status": "failed"})
+        except (UnicodeDecodeError, csv.Error) as e:
+            return JSONResponse(status_code=400, content={"error": f"Unreadable {fmt}: {e}", "status": "failed"})
+
+        written = {}
+        for table, rows in buckets.rows(user_id, source).items():
+            for i in range(0, len(rows), IMPORT_CHUNK_ROWS):
+                await supabase.table(table).upsert(rows[i:i + IMPORT_CHUNK_ROWS], on_conflict="user_id,source,created_at").execute()
+            written[table] = len(rows)
+        days = buckets.days()
+        if days:
+            await data_changed(user_id, *days)
+        return {
+            "status": "success",
+            "samples": buckets.samples,
+            "skipped": buckets.skipped,
+            "rows": written,
+            "days": days
+        }
+    except Exception as e:
+        logger.error(f"Wearable Import Error: {e}")
+        return {"status": "error", "message": str(e)}
+
 # --- 2b. تحديث الأهداف (Update Goals) ---
 @app.post("/update_goals")
 async def update_goals(data: GoalsUpdateRequest):
@@ -273,7 +874,9 @@ async def update_goals(data: GoalsUpdateRequest):
         if data.fat_target is not None:
             payload["daily_fat_target"] = data.fat_target
             
-        supabase.table("profiles").update(payload).eq("id", data.user_id).execute()
+        await supabase.table("profiles").update(payload).eq("id", data.user_id).execute()
+        await cache_backend.delete(f"profile:{data.user_id}")
+        await data_changed(data.user_id, profile=True)
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Update Goals Error: {e}")
@@ -285,29 +888,56 @@ async def update_measurements(data: BodyMeasurementsRequest):
     try:
         payload = data.dict(exclude={"user_id"})
         # إدراج سجل جديد لتتبع التاريخ
-        supabase.table("body_measurements").insert({
+        await supabase.table("body_measurements").insert({
             "user_id": data.user_id,
             **payload
         }).execute()
+        await cache_backend.delete(f"measurements:{data.user_id}")
+        await data_changed(data.user_id, profile=True)
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Update Measurements Error: {e}")
         return {"status": "error", "message": str(e)}
 
 # --- 3. جلب البيانات اليومية (Daily Intake) ---
-@app.get("/get_daily_intake")
-async def get_daily_intake(user_id: str = Query(...), date: str = Query(None)):
+async def load_daily_intake(user_id, target_date, timings):
     try:
-        target_date = date if date else datetime.now().strftime("%Y-%m-%d")
         current_dt = datetime.strptime(target_date, "%Y-%m-%d")
         next_day = (current_dt + timedelta(days=1)).strftime("%Y-%m-%d")
-        
-        # جلب أهداف المستخدم
-        profile = {}
-        prof_res = supabase.table("profiles").select("*").eq("id", user_id).execute()
-        if prof_res.data:
-            profile = prof_res.data[0]
 
+        # الملف الشخصي والمقاسات لا تتغير إلا عبر update_goals / update_measurements فتُقرأ من الكاش
+        async def fetch_profile():
+            res = await timed_query("profiles", supabase.table("profiles").select("*").eq("id", user_id), timings)
+            return res.data[0] if res.data else {}
+
+        async def fetch_measurements():
+            # جلب أحدث مقاسات الجسم
+            try:
+                res = await timed_query("body_measurements", supabase.table("body_measurements").select("*").eq("user_id", user_id).order("created_at", desc=True).limit(1), timings)
+                return res.data[0] if res.data else {}
+            except Exception as e:
+                logger.warning(f"Body Measurements error (possibly table missing): {e}")
+                return None
+
+        async def fetch_meal_items():
+            # جلب الوجبات ثم عناصرها (الاستعلام الوحيد الذي ينتظر غيره)
+            meals = await timed_query("meals", supabase.table("meals").select("id").eq("user_id", user_id).gte("created_at", target_date).lt("created_at", next_day), timings)
+            meal_ids = [m['id'] for m in (meals.data if meals.data else [])]
+            if not meal_ids:
+                return []
+            items_res = await timed_query("meal_items", supabase.table("meal_items").select("*, meals(meal_type)").in_("meal_id", meal_ids), timings)
+            return items_res.data if items_res.data else []
+
+        # كل الاستعلامات المستقلة تُرسل في نفس الوقت
+        profile, body_measurements, items_data, totals_res = await asyncio.gather(
+            cached_row(f"profile:{user_id}", fetch_profile),
+            cached_row(f"measurements:{user_id}", fetch_measurements),
+            fetch_meal_items(),
+            timed_query("daily_totals", supabase.table("daily_totals").select("*").eq("user_id", user_id).eq("day", target_date), timings),
+        )
+        logger.info(f"get_daily_intake timings (ms): {timings}")
+
+        # أهداف المستخدم
         targets = {
             "cal": profile.get("daily_calorie_target", 2000),
             "prot": profile.get("daily_protein_target", 150),
@@ -316,48 +946,19 @@ async def get_daily_intake(user_id: str = Query(...), date: str = Query(None)):
             "water": profile.get("daily_water_target_ml", 2000),
             "habit_goals": profile.get("habit_goals", {})
         }
-        
-        # جلب أحدث مقاسات الجسم
-        body_measurements = {}
-        try:
-            meas_res = supabase.table("body_measurements").select("*").eq("user_id", user_id).order("created_at", desc=True).limit(1).execute()
-            if meas_res.data:
-                body_measurements = meas_res.data[0]
-        except Exception as e:
-            logger.warning(f"Body Measurements error (possibly table missing): {e}")
-        
-        # جلب الوجبات
-        meals = supabase.table("meals").select("id").eq("user_id", user_id).gte("created_at", target_date).lt("created_at", next_day).execute()
-        meal_ids = [m['id'] for m in (meals.data if meals.data else [])]
-        
-        items_data = []
-        if meal_ids:
-            items_res = supabase.table("meal_items").select("*, meals(meal_type)").in_("meal_id", meal_ids).execute()
-            items_data = items_res.data if items_res.data else []
-        
-        # جلب سجلات المياه
-        water_res = supabase.table("water_logs").select("amount_ml").eq("user_id", user_id).gte("created_at", target_date).lt("created_at", next_day).execute()
-        water_data = water_res.data if water_res.data else []
-        water_total = sum(w['amount_ml'] for w in water_data)
-
-        # جلب سجلات النوم
-        sleep_res = supabase.table("sleep_logs").select("hours").eq("user_id", user_id).gte("created_at", target_date).lt("created_at", next_day).execute()
-        sleep_data = sleep_res.data if sleep_res.data else []
-        sleep_total = sum(s['hours'] for s in sleep_data)
-
-        # جلب سجلات الخطوات
-        steps_res = supabase.table("steps_logs").select("steps").eq("user_id", user_id).gte("created_at", target_date).lt("created_at", next_day).execute()
-        steps_data = steps_res.data if steps_res.data else []
-        steps_total = sum(s['steps'] for s in steps_data)
-        
+
+        body_measurements = body_measurements or {}
+
+        # المجاميع تأتي جاهزة من جدول daily_totals (تحدّثه الـ triggers عند كل كتابة)
+        day_totals = totals_res.data[0] if totals_res.data else {}
         totals = {
-            "cal": sum((i.get('calories') or 0) for i in items_data),
-            "prot": sum((i.get('protein') or 0) for i in items_data),
-            "carb": sum((i.get('carbs') or 0) for i in items_data),
-            "fat": sum((i.get('fat') or 0) for i in items_data),
-            "water": water_total,
-            "sleep": sleep_total,
-            "steps": steps_total
+            "cal": day_totals.get("cal", 0),
+            "prot": day_totals.get("prot", 0),
+            "carb": day_totals.get("carb", 0),
+            "fat": day_totals.get("fat", 0),
+            "water": day_totals.get("water", 0),
+            "sleep": day_totals.get("sleep", 0),
+            "steps": day_totals.get("steps", 0)
         }
 
         items_list = [
@@ -368,9 +969,10 @@ async def get_daily_intake(user_id: str = Query(...), date: str = Query(None)):
                 "protein": i.get("protein") or 0,
                 "carbs": i.get("carbs") or 0,
                 "fat": i.get("fat") or 0,
-                "meal_type": i.get("meals", {}).get("meal_type", "Snack") if i.get("meals") else "Snack"
+                "meal_type": i.get("meals", {}).get("meal_type", "Snack") if i.get("meals") else "Snack",
+                "status": i.get("status", "ready")
             }
-            for i in items_data if (i.get("calories") or 0) > 0
+            for i in items_data if (i.get("calories") or 0) > 0 or i.get("status") in ("estimating", "failed")
         ]
 
         return {"totals": totals, "targets": targets, "profile": profile, "items": items_list, "body_measurements": body_measurements}
@@ -378,78 +980,127 @@ async def get_daily_intake(user_id: str = Query(...), date: str = Query(None)):
         logger.error(f"Global Intake Error: {str(e)}")
         return {"error": str(e), "status": "failed"}
 
+@app.get("/get_daily_intake")
+async def get_daily_intake(request: Request, user_id: str = Query(...), date: str = Query(None)):
+    """الرد مخزن حسب (المستخدم، اليوم) ويتغير ETag مع أي كتابة لذلك اليوم أو للأهداف"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    target_date = date if date else today
+    day_version, profile_version, rollup_version = await asyncio.gather(
+        cache_backend.get_version(f"version:day:{user_id}:{target_date}"),
+        cache_backend.get_version(f"version:profile:{user_id}"),
+        cache_backend.get_version(ROLLUP_VERSION),
+    )
+    # الأيام المنتهية تبقى في الكاش أطول؛ والعميل يتحقق دائماً عبر If-None-Match.
+    # ETag يتغير أيضاً كل CLOSED_DAY_TTL، فالتعديلات التي لا تمر عبر الـ API تظهر بعد ذلك على الأكثر
+    closed = target_date < today
+    ttl = CLOSED_DAY_TTL if closed else RESPONSE_CACHE_TTL
+    epoch = int(time.time() // CLOSED_DAY_TTL) if closed else None
+    etag = make_etag("intake", user_id, target_date, day_version, profile_version, rollup_version, epoch)
+    return await conditional_json(request, etag, "private, no-cache", ttl,
+                                  lambda timings: load_daily_intake(user_id, target_date, timings))
+
 # --- 4. جلب إحصائيات السعرات والمياه (Stats) ---
-@app.get("/get_stats")
-async def get_stats(user_id: str = Query(...), days: int = Query(7)):
+async def load_stats(user_id, days, end_date, timings):
     try:
-        end_date = datetime.now()
         start_date = end_date - timedelta(days=days - 1)
         start_str = start_date.strftime("%Y-%m-%d")
-        
-        # 1. جلب إحصائيات السعرات
-        meals_res = supabase.table("meals").select("id, created_at").eq("user_id", user_id).gte("created_at", start_str).execute()
-        meals_data = meals_res.data if meals_res.data else []
-        meal_ids = [m['id'] for m in meals_data]
-        
-        cal_map = { (start_date + timedelta(days=i)).strftime("%Y-%m-%d"): 0.0 for i in range(days) }
-
-        if meal_ids:
-            items_res = supabase.table("meal_items").select("calories, meal_id").in_("meal_id", meal_ids).execute()
-            items_data = items_res.data if items_res.data else []
-            meal_id_to_date = {m['id']: (m.get('created_at') or "")[:10] for m in meals_data}
-            for item in items_data:
-                date_key = meal_id_to_date.get(item['meal_id'])
-                if date_key in cal_map:
-                    cal_map[date_key] += float(item.get('calories') or 0)
-
-        # 2. جلب إحصائيات المياه
-        water_res = supabase.table("water_logs").select("amount_ml, created_at").eq("user_id", user_id).gte("created_at", start_str).execute()
-        water_data_list = water_res.data if water_res.data else []
-        
-        water_map = { (start_date + timedelta(days=i)).strftime("%Y-%m-%d"): 0.0 for i in range(days) }
-        for w in water_data_list:
-            date_key = (w.get('created_at') or "")[:10]
-            if date_key in water_map:
-                water_map[date_key] += float(w['amount_ml'] or 0)
-
-        # 3. جلب إحصائيات النوم
-        sleep_res = supabase.table("sleep_logs").select("hours, created_at").eq("user_id", user_id).gte("created_at", start_str).execute()
-        sleep_data_list = sleep_res.data if sleep_res.data else []
-        sleep_map = { (start_date + timedelta(days=i)).strftime("%Y-%m-%d"): 0.0 for i in range(days) }
-        for s in sleep_data_list:
-            date_key = (s.get('created_at') or "")[:10]
-            if date_key in sleep_map:
-                sleep_map[date_key] += float(s['hours'] or 0)
-
-        # 4. جلب إحصائيات الخطوات
-        steps_res = supabase.table("steps_logs").select("steps, created_at").eq("user_id", user_id).gte("created_at", start_str).execute()
-        steps_data_list = steps_res.data if steps_res.data else []
-        steps_map = { (start_date + timedelta(days=i)).strftime("%Y-%m-%d"): 0.0 for i in range(days) }
-        for st in steps_data_list:
-            date_key = (st.get('created_at') or "")[:10]
-            if date_key in steps_map:
-                steps_map[date_key] += float(st['steps'] or 0)
-
-        cal_result = [{"date": k, "value": v} for k, v in sorted(cal_map.items())]
-        water_result = [{"date": k, "value": v} for k, v in sorted(water_map.items())]
-        sleep_result = [{"date": k, "value": v} for k, v in sorted(sleep_map.items())]
-        steps_result = [{"date": k, "value": v} for k, v in sorted(steps_map.items())]
-        
+        end_str = end_date.strftime("%Y-%m-%d")
+
+        # التجميع اليومي يتم داخل Postgres (get_daily_stats في schema.sql) بطلب واحد
+        res = await timed_query("get_daily_stats", supabase.rpc("get_daily_stats", {
+            "p_user_id": user_id,
+            "p_start": start_str,
+            "p_end": end_str
+        }), timings)
+        rows = res.data if res.data else []
+
+        def series(column):
+            return [{"date": r["day"], "value": float(r.get(column) or 0)} for r in rows]
+
         return {
             "status": "success", 
-            "calories": cal_result,
-            "water": water_result,
-            "sleep": sleep_result,
-            "steps": steps_result
+            "calories": series("calories"),
+            "water": series("water"),
+            "sleep": series("sleep"),
+            "steps": series("steps")
         }
     except Exception as e:
         logger.error(f"Stats Error: {str(e)}")
         return {"error": str(e), "status": "failed"}
 
+@app.get("/get_stats")
+async def get_stats(request: Request, user_id: str = Query(...), days: int = Query(7)):
+    end_date = datetime.now()
+    version, rollup_version = await asyncio.gather(
+        cache_backend.get_version(f"version:logs:{user_id}"), cache_backend.get_version(ROLLUP_VERSION)
+    )
+    etag = make_etag("stats", user_id, days, end_date.strftime("%Y-%m-%d"), version, rollup_version)
+    return await conditional_json(request, etag, "private, no-cache", RESPONSE_CACHE_TTL,
+                                  lambda timings: load_stats(user_id, days, end_date, timings))
+
+
+def absolute_url(request, url):
+    """مراجع التخزين وروابط التخزين المحلي نسبية، والتطبيق يحتاج رابطاً كاملاً (يُبنى عند القراءة فقط)"""
+    url = photo_storage.resolve(url)
+    if url.startswith("/"):
+        return str(request.base_url).rstrip("/") + url
+    return url
+
+async def store_photo_upload(request: Request):
+    """حفظ صورة multipart: الملف يصل مجزأً إلى ملف مؤقت على القرص ثم تُولَّد منه النسخ المصغرة"""
+    # الحد يُطبَّق أثناء القراءة: طلب chunked بدون Content-Length لا يملأ القرص قبل رد 413
+    form = await limited_request(request, MAX_PHOTO_BYTES + 64 * 1024).form(max_files=1, max_fields=10)
+    try:
+        upload = form.get("file")
+        user_id, side = form.get("user_id"), form.get("side")
+        if not user_id or not side or upload is None or isinstance(upload, str):
+            return {"error": "Send user_id, side and file as multipart/form-data", "status": "failed"}
+        if upload.size is not None and upload.size > MAX_PHOTO_BYTES:
+            return JSONResponse(status_code=413, content={"error": "Photo is too large", "status": "failed"})
+
+        try:
+            fmt, variants = await asyncio.to_thread(make_variants, upload.file, PHOTO_VARIANTS)
+        except ValueError as e:
+            return {"error": str(e), "status": "failed"}
+
+        if isinstance(photo_storage, DatabaseStorage):
+            # لا تخزين دائم للملفات: الأصل base64 في الصف كما كان، والنسخ المصغرة تُولَّد عند الطلب
+            upload.file.seek(0)
+            original_url = base64.b64encode(await asyncio.to_thread(upload.file.read)).decode()
+            thumb_url = web_url = None
+        else:
+            key = f"{user_id}/{uuid.uuid4().hex}"
+            original_url, thumb_url, web_url = await asyncio.gather(
+                photo_storage.put(f"{key}/original.{fmt}", upload.file, upload.content_type or f"image/{fmt}"),
+                photo_storage.put(f"{key}/thumb.jpg", variants["thumb"]),
+                photo_storage.put(f"{key}/web.jpg", variants["web"]),
+            )
+    finally:
+        await form.close()
+
+    payload = {
+        "user_id": user_id,
+        "photo_url": original_url,
+        "thumb_url": thumb_url,
+        "web_url": web_url,
+        "side": side
+    }
+    if form.get("created_at"):
+        payload["created_at"] = form.get("created_at")
+    res = await supabase.table("progress_photos").insert(payload).execute()
+    await cache_backend.bump_version(f"version:photos:{user_id}")
+    return {"status": "success", "data": with_photo_urls(request, res.data[0], user_id) if res.data else None}
 
 @app.post("/upload_progress_photo")
-async def upload_progress_photo(data: ProgressPhoto):
+async def upload_progress_photo(request: Request):
+    """رفع صورة تقدم: multipart (الطريقة الحالية) أو JSON مع base64 في photo_url (التطبيقات القديمة)"""
     try:
+        if int(request.headers.get("content-length") or 0) > MAX_PHOTO_BYTES + 64 * 1024:
+            return JSONResponse(status_code=413, content={"error": "Photo is too large", "status": "failed"})
+        if request.headers.get("content-type", "").startswith(("multipart/form-data", "application/x-www-form-urlencoded")):
+            return await store_photo_upload(request)
+
+        data = ProgressPhoto(**await limited_request(request, MAX_PHOTO_BYTES + 64 * 1024).json())
         payload = {
             "user_id": data.user_id,
             "photo_url": data.photo_url,
@@ -458,142 +1109,272 @@ async def upload_progress_photo(data: ProgressPhoto):
         if data.created_at:
             payload["created_at"] = data.created_at
             
-        res = supabase.table("progress_photos").insert(payload).execute()
+        res = await supabase.table("progress_photos").insert(payload).execute()
+        await cache_backend.bump_version(f"version:photos:{data.user_id}")
         return {"status": "success", "data": res.data[0] if res.data else None}
+    except OverflowError:
+        return JSONResponse(status_code=413, content={"error": "Photo is too large", "status": "failed"})
     except Exception as e:
         logger.error(f"Upload Photo Error: {str(e)}")
         return {"error": str(e), "status": "failed"}
 
+def encode_token(value):
+    return base64.urlsafe_b64encode(json.dumps(value, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_token(token):
+    return json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+
+def encode_cursor(row):
+    return encode_token([row["created_at"], row["id"]])
+
+def decode_cursor(cursor):
+    created_at, photo_id = decode_token(cursor)
+    return str(created_at), int(photo_id)
+
+def with_photo_urls(request, row, user_id):
+    """مراجع التخزين تصبح روابط كاملة؛ الصور القديمة (base64 داخل الجدول) تُقدَّم كصورة منفصلة قابلة للتخزين المؤقت"""
+    for column in ("photo_url", "thumb_url", "web_url"):
+        if (row.get(column) or "").startswith(STORAGE_REF):
+            row[column] = absolute_url(request, row[column])
+    if not row.get("web_url"):
+        row["web_url"] = absolute_url(request, f"/progress_photo_image?id={row['id']}&user_id={user_id}&size=web")
+        row["thumb_url"] = absolute_url(request, f"/progress_photo_image?id={row['id']}&user_id={user_id}&size=thumb")
+    return row
+
 @app.get("/get_progress_photos")
-async def get_progress_photos(user_id: str = Query(...)):
+async def get_progress_photos(request: Request, user_id: str = Query(...), side: Optional[str] = Query(None),
+                              limit: int = Query(PHOTO_PAGE_SIZE, ge=1, le=100), cursor: Optional[str] = Query(None)):
+    """صفحة من صور المستخدم (الأحدث أولاً) بالروابط المصغرة فقط، مع ETag يعيد 304 بدون استعلام"""
     try:
-        res = supabase.table("progress_photos").select("*").eq("user_id", user_id).order("created_at", desc=True).execute()
-        return {"status": "success", "data": res.data}
+        version = await cache_backend.get_version(f"version:photos:{user_id}")
+        etag = make_etag("photos", user_id, version, side, limit, cursor)
+        cache_control = "private, no-cache"
+        if etag_matches(request, etag):
+            return not_modified(etag, cache_control)
+
+        # ترقيم بالمفتاح (created_at, id) بدلاً من OFFSET: كل صفحة تكلف نفس الشيء مهما كان عمقها
+        query = supabase.table("progress_photos").select("id, side, created_at, thumb_url, web_url").eq("user_id", user_id)
+        if side:
+            query = query.eq("side", side)
+        if cursor:
+            try:
+                created_at, last_id = decode_cursor(cursor)
+            except Exception:
+                return JSONResponse(status_code=400, content={"error": "Invalid cursor", "status": "failed"})
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{last_id})')
+        res = await query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute()
+        rows = res.data or []
+
+        page = [with_photo_urls(request, row, user_id) for row in rows[:limit]]
+        return cached_json({
+            "status": "success",
+            "data": page,
+            "next_cursor": encode_cursor(page[-1]) if len(rows) > limit else None
+        }, etag, cache_control)
     except Exception as e:
         logger.error(f"Get Photos Error: {str(e)}")
         return {"error": str(e), "status": "failed"}
-@app.post("/align_photos")
-async def align_photos(data: AlignPhotosRequest):
-    """استخدام Gemini لمحاذاة صورتين بناءً على ملامح الجسم"""
-    if not GEMINI_API_KEY:
-        return {"error": "API Key missing", "status": "failed"}
 
-    # تنظيف الـ Base64 (إزالة البادئة إن وجدت)
-    def clean_b64(b64):
-        if "," in b64: return b64.split(",")[1]
-        return b64
+@app.get("/progress_photo_image")
+async def progress_photo_image(request: Request, id: int = Query(...), user_id: str = Query(...), size: str = Query("web")):
+    """صورة تقدم واحدة كملف (للصفوف القديمة المخزنة كـ base64)؛ الصور لا تتغير فتُخزَّن مؤقتاً لمدة طويلة
+    في المتصفح فقط (private): المعرّفات متسلسلة، فالصورة تُقدَّم لصاحبها فقط ولا تحفظها الكاشات المشتركة"""
+    if size not in PHOTO_VARIANTS:
+        return JSONResponse(status_code=400, content={"error": f"size must be one of {list(PHOTO_VARIANTS)}", "status": "failed"})
+    etag = make_etag("photo", id, user_id, size)
+    cache_control = "private, max-age=31536000, immutable"
+    if etag_matches(request, etag):
+        return not_modified(etag, cache_control)
+    try:
+        res = await supabase.table("progress_photos").select("photo_url, thumb_url, web_url").eq("id", id).eq("user_id", user_id).limit(1).execute()
+        if not res.data:
+            return JSONResponse(status_code=404, content={"error": "Photo not found", "status": "failed"})
+        row = res.data[0]
+        if row.get(f"{size}_url"):
+            return RedirectResponse(absolute_url(request, row[f"{size}_url"]), status_code=301)
+        raw = decode_photo(row["photo_url"])
+        if raw is None:
+            return RedirectResponse(absolute_url(request, row["photo_url"]), status_code=301)
+        _, variants = await asyncio.to_thread(make_variants, io.BytesIO(raw), {size: PHOTO_VARIANTS[size]})
+        return Response(content=variants[size].getvalue(), media_type="image/jpeg",
+                        headers={"ETag": etag, "Cache-Control": cache_control})
+    except Exception as e:
+        logger.error(f"Photo Image Error: {str(e)}")
+        return {"error": str(e), "status": "failed"}
 
-    img1 = clean_b64(data.img1_base64)
-    img2 = clean_b64(data.img2_base64)
+# --- 8. المزامنة التدريجية (Incremental Sync) ---
+# الأعمدة التي يحتاجها التطبيق من كل جدول (بدون photo_url الذي قد يكون base64 كبيراً)
+SYNC_TABLES = {
+    "meals": "id, meal_type, created_at, updated_at",
+    "meal_items": "id, meal_id, food_name, calories, protein, carbs, fat, weight_grams, status, created_at, updated_at",
+    "water_logs": "id, amount_ml, created_at, updated_at",
+    "sleep_logs": "id, hours, source, created_at, updated_at",
+    "steps_logs": "id, steps, source, created_at, updated_at",
+    "body_measurements": "*",
+    "progress_photos": "id, side, thumb_url, web_url, created_at, updated_at",
+    "deleted_rows": "id, table_name, row_id, deleted_at",
+}
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-    
-    prompt = (
-        f"Analyze these two {data.side} progress photos. Detect the precise [x, y] coordinates for: "
-        "1. Left Eye (or Ear if side), 2. Right Eye (or Head Center if side), 3. Nose, 4. Left Shoulder, 5. Right Shoulder, 6. Navel. "
-        "Coordinates must be normalized from 0 to 1000 (where 0,0 is top-left). "
-        "Return ONLY a JSON object: "
-        '{"img1": {"l_eye": [x,y], "r_eye": [x,y], "nose": [x,y], "l_sh": [x,y], "r_sh": [x,y], "navel": [x,y]}, '
-        '"img2": {"l_eye": [x,y], "r_eye": [x,y], "nose": [x,y], "l_sh": [x,y], "r_sh": [x,y], "navel": [x,y]}}'
-    )
+def sync_column(table):
+    return "deleted_at" if table == "deleted_rows" else "updated_at"
 
-    payload = {
-        "contents": [{
-            "parts": [
-                {"text": prompt},
-                {"inline_data": {"mime_type": "image/jpeg", "data": img1}},
-                {"inline_data": {"mime_type": "image/jpeg", "data": img2}}
-            ]
-        }]
-    }
+def later_position(a, b):
+    """الموضع الأحدث من موضعين [timestamp, id] في مؤشر المزامنة"""
+    if a is None:
+        return b
+    return a if datetime.fromisoformat(a[0]) >= datetime.fromisoformat(b[0]) else b
+
+async def sync_table(table, user_id, position, timings):
+    """صفوف الجدول بعد الموضع (updated_at, id) مرتبة، بحد SYNC_PAGE_SIZE + 1 لمعرفة إن بقي المزيد"""
+    column = sync_column(table)
+    if table == "meal_items":
+        # meal_items لا يحمل user_id: الربط مع الوجبة
+        query = supabase.table(table).select(f"{SYNC_TABLES[table]}, meals!inner(user_id)").eq("meals.user_id", user_id)
+    else:
+        query = supabase.table(table).select(SYNC_TABLES[table]).eq("user_id", user_id)
+    if position:
+        ts, last_id = position
+        if last_id is None:
+            query = query.gt(column, ts)
+        else:
+            query = query.or_(f'{column}.gt."{ts}",and({column}.eq."{ts}",id.gt.{last_id})')
+    res = await timed_query(table, query.order(column).order("id").limit(SYNC_PAGE_SIZE + 1), timings)
+    return res.data or []
+
+@app.get("/sync")
+async def sync(request: Request, user_id: str = Query(...), since: Optional[str] = Query(None)):
+    """كل ما أُضيف أو تغيّر أو حُذف منذ المؤشر السابق؛ بدون since ترجع كل البيانات (مزامنة كاملة)"""
+    try:
+        now = datetime.now(timezone.utc)
+        # لا يتقدم المؤشر بعد (الآن - هامش): معاملة بدأت قبله ولم تُنهِ الكتابة بعد ستظهر في المزامنة التالية
+        horizon = [(now - timedelta(seconds=SYNC_OVERLAP_SECONDS)).isoformat(), None]
+        if since:
+            try:
+                state = decode_token(since)
+                positions, synced_at = state["pos"], datetime.fromisoformat(state["at"])
+            except Exception:
+                return JSONResponse(status_code=400, content={"error": "Invalid cursor", "status": "failed"})
+            if now - synced_at > timedelta(days=SYNC_RETENTION_DAYS):
+                # شواهد الحذف الأقدم ربما حُذفت: على التطبيق مسح نسخته والبدء من جديد
+                return {"status": "reset", "message": "Cursor expired, sync again without since"}
+        else:
+            # المزامنة الكاملة لا تحتاج شواهد الحذف السابقة
+            positions = {"deleted_rows": horizon}
+
+        timings = {}
+        tables = list(SYNC_TABLES)
+        results = await asyncio.gather(*(sync_table(t, user_id, positions.get(t), timings) for t in tables))
+
+        changes, deleted, new_positions, has_more = {}, [], {}, False
+        for table, rows in zip(tables, results):
+            column = sync_column(table)
+            if len(rows) > SYNC_PAGE_SIZE:
+                rows = rows[:SYNC_PAGE_SIZE]
+                has_more = True
+                new_positions[table] = [rows[-1][column], rows[-1]["id"]]
+            else:
+                # الصفوف الأحدث من horizon قد تتكرر في المزامنة التالية، والتطبيق يحدّثها بالمعرّف
+                new_positions[table] = later_position(positions.get(table), horizon)
+            if table == "deleted_rows":
+                deleted = [{"table": r["table_name"], "id": r["row_id"], "deleted_at": r["deleted_at"]} for r in rows]
+            elif table == "meal_items":
+                changes[table] = [{k: v for k, v in r.items() if k != "meals"} for r in rows]
+            elif table == "progress_photos":
+                changes[table] = [with_photo_urls(request, r, user_id) for r in rows]
+            else:
+                changes[table] = rows
+
+        return JSONResponse(content={
+            "status": "success",
+            "cursor": encode_token({"at": now.isoformat(), "pos": new_positions}),
+            "has_more": has_more,
+            "changes": changes,
+            "deleted": deleted
+        }, headers={"Server-Timing": server_timing_header(timings)})
+    except Exception as e:
+        logger.error(f"Sync Error: {str(e)}")
+        return {"error": str(e), "status": "failed"}
 
+@app.post("/align_photos")
+async def align_photos(data: AlignPhotosRequest, request: Request):
+    """محاذاة صورتين بناءً على ملامح الجسم؛ النقاط تُكتشف مرة واحدة لكل صورة ثم تُحفظ"""
+    # numpy يُحمّل عند أول طلب محاذاة فقط، لا عند إقلاع السيرفر
+    from alignment import align_pair, AlignmentError
+    limited = admit_ai_request(request, data.user_id)
+    if limited is not None:
+        return limited
     try:
-        response = requests.post(url, json=payload, timeout=20)
-        res_data = response.json()
-        
-        if 'candidates' not in res_data:
-            error_msg = res_data.get('error', {}).get('message', 'Unknown Gemini Error')
-            logger.error(f"Gemini API Error: {res_data}")
-            return {"error": f"Gemini Error: {error_msg}", "status": "failed"}
-
-        raw_text = res_data['candidates'][0]['content']['parts'][0]['text'].strip()
-        
-        match = re.search(r'(\{.*\})', raw_text, re.DOTALL)
-        if not match: 
-            logger.error(f"No JSON in AI response: {raw_text}")
-            return {"error": "AI failed to return valid coordinates", "status": "failed"}
-        
-        pts = json.loads(match.group(1))
-        
-        # math for alignment (Align img2 to img1)
-        import math
-        
-        def get_dist(p1, p2):
-            return ((p1[0]-p2[0])**2 + (p1[1]-p2[1])**2)**0.5
-
-        def get_angle(p1, p2):
-            return math.atan2(p2[1]-p1[1], p2[0]-p1[0])
-
-        i1, i2 = pts.get('img1', {}), pts.get('img2', {})
-        if not i1 or not i2:
-            return {"error": "AI could not identify body parts", "status": "failed"}
-
-        # helper to get best available points
-        def get_ref_points(img_pts):
-            # Prefer shoulders, fallback to eyes/ears
-            p_l = img_pts.get('l_sh') or img_pts.get('l_eye')
-            p_r = img_pts.get('r_sh') or img_pts.get('r_eye')
-            center = img_pts.get('nose') or img_pts.get('l_eye') or img_pts.get('l_sh')
-            return p_l, p_r, center
-
-        l1, r1, c1 = get_ref_points(i1)
-        l2, r2, c2 = get_ref_points(i2)
-
-        if not all([l1, r1, c1, l2, r2, c2]):
-            return {"error": "Missing key landmarks for alignment", "status": "failed"}
-        
-        # 1. Rotation
-        ang1 = get_angle(l1, r1)
-        ang2 = get_angle(l2, r2)
-        rotation = ang1 - ang2
-        
-        # 2. Scale
-        w1 = get_dist(l1, r1)
-        w2 = get_dist(l2, r2)
-        
-        if w2 == 0: return {"error": "Could not calculate size", "status": "failed"}
-        scale = w1 / w2
-        
-        # 3. Translation
-        dx = c1[0] - (c2[0] * scale)
-        dy = c1[1] - (c2[1] * scale)
-        if w2 == 0: return {"error": "Landmarks not found", "status": "failed"}
-        scale = w1 / w2
-        
-        # 3. Translation (align nose/center)
-        # Apply scale and rotation to img2 nose to see where it would land
-        # For simplicity in Flutter, we return center-based relative shift
-        # img2_nose_scaled = img2_nose * scale
-        dx = i1['nose'][0] - (i2['nose'][0] * scale)
-        dy = i1['nose'][1] - (i2['nose'][1] * scale)
+        if data.photo1_id is not None and data.photo2_id is not None:
+            if not data.user_id:
+                return {"error": "user_id is required with photo1_id and photo2_id", "status": "failed"}
+            points1, points2 = await photos.landmarks_for_ids([data.photo1_id, data.photo2_id], data.user_id)
+        elif data.img1_base64 and data.img2_base64:
+            raw1, raw2 = decode_photo(data.img1_base64), decode_photo(data.img2_base64)
+            if raw1 is None or raw2 is None:
+                return {"error": "img1_base64/img2_base64 must be base64 images", "status": "failed"}
+            points1, points2 = await asyncio.gather(
+                photos.landmarks(raw1, data.side),
+                photos.landmarks(raw2, data.side),
+            )
+        else:
+            return {"error": "Send photo1_id and photo2_id (or img1_base64 and img2_base64)", "status": "failed"}
+
+        return {"status": "success", "alignment": align_pair(points1, points2)}
+    except RateLimited as e:
+        return too_many_requests(e.retry_after)
+    except BudgetExceeded as e:
+        # النقاط المحفوظة مسبقاً لا تحتاج Gemini؛ هذه صورة جديدة والميزانية انتهت
+        return budget_exhausted(str(e))
+    except GeminiError as e:
+        logger.error(f"Gemini API Error: {e}")
+        return {"error": f"Gemini Error: {e}", "status": "failed"}
+    except (AlignmentError, LookupError) as e:
+        return {"error": str(e), "status": "failed"}
+    except Exception as e:
+        logger.error(f"Align Error: {e}")
+        return {"error": str(e), "status": "failed"}
 
+@app.post("/align_timeline")
+async def align_timeline_photos(data: AlignTimelineRequest, request: Request):
+    """محاذاة سلسلة صور كاملة على صورة مرجعية واحدة بحساب واحد"""
+    if len(data.photo_ids) > MAX_TIMELINE_PHOTOS:
+        return {"error": f"Too many photos ({len(data.photo_ids)} > {MAX_TIMELINE_PHOTOS})", "status": "failed"}
+    from alignment import align_timeline
+    limited = admit_ai_request(request, data.user_id)
+    if limited is not None:
+        return limited
+    if not data.user_id:
+        return {"error": "user_id is required", "status": "failed"}
+    try:
+        points = await photos.landmarks_for_ids([data.reference_id, *data.photo_ids], data.user_id)
+        results = align_timeline(points[0], points[1:])
         return {
             "status": "success",
-            "alignment": {
-                "scale": scale,
-                "rotation": rotation,
-                "dx": dx / 1000.0,
-                "dy": dy / 1000.0
-            }
+            "reference_id": data.reference_id,
+            "alignments": [{"photo_id": pid, **r} for pid, r in zip(data.photo_ids, results)]
         }
+    except RateLimited as e:
+        return too_many_requests(e.retry_after)
+    except BudgetExceeded as e:
+        return budget_exhausted(str(e))
+    except GeminiError as e:
+        logger.error(f"Gemini API Error: {e}")
+        return {"error": f"Gemini Error: {e}", "status": "failed"}
+    except LookupError as e:
+        return {"error": str(e), "status": "failed"}
     except Exception as e:
-        logger.error(f"Align Error: {e}")
+        logger.error(f"Align Timeline Error: {e}")
         return {"error": str(e), "status": "failed"}
 
+# --- 6b. صور التقدم المحفوظة محلياً ---
+if isinstance(photo_storage, LocalStorage):
+    app.mount("/media", StaticFiles(directory=photo_storage.root), name="media")
+
 # --- 7. Serve Flutter Web Frontend ---
 # This mounts the Flutter build folder to the root URL (/)
+# نسخ .br / .gz من precompress_web.py، وكاش طويل للملفات ذات البصمة وقصير لـ index.html
 if os.path.exists("build/web"):
-    app.mount("/", StaticFiles(directory="build/web", html=True), name="flutter_web")
+    app.mount("/", PrecompressedStaticFiles(directory="build/web", html=True, max_age=STATIC_MAX_AGE), name="flutter_web")
 else:
     @app.get("/")
     async def root():
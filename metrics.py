@@ -0,0 +1,416 @@
+import asyncio, contextvars, json, logging, os, random, time
+from collections import defaultdict
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# مقاييس بصيغة Prometheus (بدون مكتبات إضافية) وتتبع اختياري بصيغة OpenTelemetry (OTLP/JSON)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        self.values[tuple((k, labels[k]) for k in self.labels)] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in list(self.values.items()):
+            yield f"{self.name}{_format_labels(labels)} {value:g}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help_text, tuple(labels), buckets
+        # لكل مجموعة تسميات: عدد القيم في كل خانة + المجموع + العدد
+        self.values = defaultdict(lambda: [[0] * len(self.buckets), 0.0, 0])
+
+    def observe(self, value, **labels):
+        entry = self.values[tuple((k, labels[k]) for k in self.labels)]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in list(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield f"{self.name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}"
+            yield f"{self.name}_sum{_format_labels(labels)} {total:.6f}"
+            yield f"{self.name}_count{_format_labels(labels)} {count}"
+
+
+class Registry:
+    """Metrics of this process. With several workers each one has its own
+    registry, so a scrape sees only the worker that answered it."""
+
+    def __init__(self):
+        self.metrics = []
+        self.stats = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix, fn):
+        """كل قيمة رقمية في fn() (مثل gemini.stats()) تظهر كـ gauge باسم prefix_key"""
+        self.stats.append((prefix, fn))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, fn in self.stats:
+            try:
+                values = fn() or {}
+            except Exception as e:
+                logger.warning(f"Metrics stats for {prefix} failed: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+http_requests = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to serve a request, by route template", ("route", "method", "status"))
+_in_flight = {"requests_in_flight": 0}
+REGISTRY.register_stats("http", lambda: _in_flight)
+upstream_requests = REGISTRY.histogram(
+    "upstream_request_duration_seconds", "Time to response headers from Supabase, Gemini...",
+    ("upstream", "target", "method", "status"))
+upstream_rows = REGISTRY.counter("upstream_rows_total", "Rows returned by Supabase (Content-Range)", ("upstream", "target"))
+upstream_errors = REGISTRY.counter(
+    "upstream_errors_total", "Upstream calls with no response (timeouts, connection errors)", ("upstream", "target", "error"))
+app_errors = REGISTRY.counter("app_errors_total", "ERROR log records, by the route that was running", ("route", "logger"))
+cache_lookups = REGISTRY.counter("cache_lookups_total", "Cache lookups by result (hit, miss, not_modified)", ("cache", "result"))
+
+
+# --- التتبع (Spans) ---
+_current_span = contextvars.ContextVar("current_span", default=None)
+_current_scope = contextvars.ContextVar("current_scope", default=None)
+
+
+class Span:
+    __slots__ = ("exporter", "trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, exporter, name, kind, trace_id=None, parent_id=None):
+        self.exporter = exporter
+        self.trace_id = trace_id or f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind # 2 = SERVER, 3 = CLIENT
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.error = None
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        self.exporter.add(self)
+
+    def child(self, name):
+        return Span(self.exporter, name, 3, trace_id=self.trace_id, parent_id=self.span_id)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class SpanExporter:
+    """Batches finished spans and sends them as OTLP/HTTP JSON to a collector
+    (endpoint + /v1/traces) and/or appends them to a JSON-lines file.
+
+    Export runs in a background task every `interval` seconds; if the
+    collector is down the batch is dropped (and counted) rather than held.
+    """
+
+    def __init__(self, endpoint=None, path=None, service="solean-api", sample_rate=1.0,
+                 interval=5.0, max_pending=10000):
+        self.endpoint = endpoint.rstrip("/") + "/v1/traces" if endpoint else None
+        self.path = path
+        self.service = service
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = []
+        self.exported = 0
+        self.dropped = 0
+        self._http = None
+        self._task = None
+
+    def add(self, span):
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append(span)
+
+    def start_span(self, name, traceparent=None):
+        """Span للطلب؛ يكمل trace القادم في ترويسة traceparent إن وُجدت"""
+        trace_id = parent_id = None
+        if traceparent:
+            parts = traceparent.split("-")
+            if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+                trace_id, parent_id = parts[1], parts[2]
+        if trace_id is None and random.random() >= self.sample_rate:
+            return None
+        return Span(self, name, 2, trace_id=trace_id, parent_id=parent_id)
+
+    def _payload(self, spans):
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", self.service)]},
+            "scopeSpans": [{"scope": {"name": "solean.metrics"}, "spans": [s.to_otlp() for s in spans]}],
+        }]}
+
+    def _append(self, payload):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+
+    async def flush(self):
+        spans, self.pending = self.pending, []
+        if not spans:
+            return
+        payload = self._payload(spans)
+        try:
+            if self.path:
+                await asyncio.to_thread(self._append, payload)
+            if self.endpoint:
+                res = await self._http.post(self.endpoint, json=payload)
+                res.raise_for_status()
+            self.exported += len(spans)
+        except Exception as e:
+            self.dropped += len(spans)
+            logger.warning(f"Span export failed ({len(spans)} spans dropped): {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def start(self):
+        if self.endpoint:
+            self._http = httpx.AsyncClient(timeout=5.0)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+        if self._http:
+            await self._http.aclose()
+
+    def stats(self):
+        return {"pending": len(self.pending), "exported": self.exported, "dropped": self.dropped}
+
+
+def tracer_from_env():
+    """OTEL_EXPORTER_OTLP_ENDPOINT (مثلاً http://localhost:4318) و/أو TRACE_FILE تفعّل التتبع"""
+    endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+    path = os.getenv("TRACE_FILE")
+    if not endpoint and not path:
+        return None
+    return SpanExporter(
+        endpoint=endpoint,
+        path=path,
+        service=os.getenv("OTEL_SERVICE_NAME", "solean-api"),
+        sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "1.0")),
+    )
+
+
+# --- Middleware و httpx ---
+def _route(scope):
+    route = scope.get("route") if scope else None
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Latency histogram per route template and status, plus a SERVER span
+    per request when a tracer is configured."""
+
+    def __init__(self, app, tracer=None):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        span = None
+        if self.tracer:
+            headers = dict(scope.get("headers") or [])
+            span = self.tracer.start_span(scope["method"], (headers.get(b"traceparent") or b"").decode() or None)
+        scope_token = _current_scope.set(scope)
+        span_token = _current_span.set(span)
+        _in_flight["requests_in_flight"] += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _in_flight["requests_in_flight"] -= 1
+            route = _route(scope)
+            http_requests.observe(time.perf_counter() - start, route=route, method=scope["method"], status=status["code"])
+            _current_span.reset(span_token)
+            _current_scope.reset(scope_token)
+            if span:
+                span.name = f"{scope['method']} {route}"
+                span.attributes.update({"http.route": route, "http.method": scope["method"], "http.status_code": status["code"]})
+                if status["code"] >= 500:
+                    span.error = span.error or f"HTTP {status['code']}"
+                span.end()
+
+
+def _content_range_rows(value):
+    # "0-24/*" -> 25 صفاً، "*/0" -> لا صفوف
+    if not value or "-" not in value.split("/")[0]:
+        return 0
+    first, last = value.split("/")[0].split("-")
+    return int(last) - int(first) + 1
+
+
+def _upstream_target(path):
+    # /rest/v1/meals -> meals ، /rest/v1/rpc/get_daily_stats -> rpc/get_daily_stats
+    return path.split("/rest/v1/", 1)[1] if "/rest/v1/" in path else path.rsplit("/", 1)[-1]
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Wraps an httpx transport: latency to response headers, status and rows
+    per upstream call, plus a CLIENT span inside the request's span.
+
+    Timeouts and connection errors never produce a response, so they are
+    counted here (upstream_errors_total) and their span is ended with the
+    error. `target` fixes the label for upstreams whose paths are unbounded.
+    """
+
+    def __init__(self, transport, upstream, target=None):
+        self.transport = transport
+        self.upstream = upstream
+        self.target = target
+
+    async def handle_async_request(self, request):
+        target = self.target or _upstream_target(request.url.path)
+        parent = _current_span.get()
+        span = parent.child(f"{self.upstream} {request.method} {target}") if parent is not None else None
+        status, rows = "cancelled", 0
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = response.status_code
+            rows = _content_range_rows(response.headers.get("content-range"))
+            return response
+        except Exception as e:
+            status = "error"
+            upstream_errors.inc(upstream=self.upstream, target=target, error=type(e).__name__)
+            if span is not None:
+                span.error = f"{type(e).__name__}: {e}"[:300]
+            raise
+        finally:
+            upstream_requests.observe(time.perf_counter() - start, upstream=self.upstream, target=target,
+                                      method=request.method, status=status)
+            if rows:
+                upstream_rows.inc(rows, upstream=self.upstream, target=target)
+            if span is not None:
+                span.attributes.update({"peer.service": self.upstream, "http.status_code": status})
+                if rows:
+                    span.attributes["db.rows"] = rows
+                if isinstance(status, int) and status >= 400:
+                    span.error = f"HTTP {status}"
+                elif status == "cancelled":
+                    span.error = span.error or "cancelled"
+                span.end()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def instrument_httpx(client, upstream, target=None):
+    """تغليف نقل عميل httpx موجود (جلسة postgrest، Gemini، الصور) بـ InstrumentedTransport"""
+    if not isinstance(client, httpx.AsyncClient):
+        return False
+    client._transport = InstrumentedTransport(client._transport, upstream, target)
+    client._mounts = {
+        pattern: InstrumentedTransport(transport, upstream, target) if transport is not None else None
+        for pattern, transport in client._mounts.items()
+    }
+    return True
+
+
+class ErrorCounter(logging.Handler):
+    """Counts ERROR log records by the route that was running (handlers log
+    their exceptions and return an error body, so status codes miss them)."""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+
+    def emit(self, record):
+        scope = _current_scope.get()
+        app_errors.inc(route=_route(scope) if scope else "background", logger=record.name)
+        span = _current_span.get()
+        if span is not None and span.error is None:
+            span.error = record.getMessage()[:300]
+
+
+def install_error_counter():
+    root = logging.getLogger()
+    if not any(isinstance(h, ErrorCounter) for h in root.handlers):
+        root.addHandler(ErrorCounter())
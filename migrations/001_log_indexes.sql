@@ -0,0 +1,31 @@
+-- Composite indexes and primary keys for the log tables.
+--
+-- Safe to re-run. CREATE INDEX CONCURRENTLY cannot run inside a transaction,
+-- so apply with psql (each statement autocommits), not as a single block:
+--     psql "$DATABASE_URL" -f migrations/001_log_indexes.sql
+
+-- sleep_logs / steps_logs were created without primary keys or NOT NULL timestamps
+UPDATE public.sleep_logs SET created_at = now() WHERE created_at IS NULL;
+UPDATE public.steps_logs SET created_at = now() WHERE created_at IS NULL;
+ALTER TABLE public.sleep_logs ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE public.steps_logs ALTER COLUMN created_at SET NOT NULL;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'public.sleep_logs'::regclass AND contype = 'p') THEN
+        ALTER TABLE public.sleep_logs ADD PRIMARY KEY (id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'public.steps_logs'::regclass AND contype = 'p') THEN
+        ALTER TABLE public.steps_logs ADD PRIMARY KEY (id);
+    END IF;
+END $$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS meals_user_created_idx ON public.meals (user_id, created_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS meal_items_meal_id_idx ON public.meal_items (meal_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS water_logs_user_created_idx ON public.water_logs (user_id, created_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS sleep_logs_user_created_idx ON public.sleep_logs (user_id, created_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS steps_logs_user_created_idx ON public.steps_logs (user_id, created_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS body_measurements_user_created_idx ON public.body_measurements (user_id, created_at DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS progress_photos_user_created_idx ON public.progress_photos (user_id, created_at DESC);
+
+ANALYZE public.meals, public.meal_items, public.water_logs, public.sleep_logs, public.steps_logs;
@@ -0,0 +1,106 @@
+-- OPTIONAL: monthly range partitioning of water_logs, sleep_logs and steps_logs.
+--
+-- Only worth it once these tables reach tens of millions of rows; below that
+-- the (user_id, created_at) indexes from 001 are enough. Run
+-- benchmarks/index_benchmark.py --partitioned against a copy first.
+--
+-- meals is deliberately not partitioned: meal_items.meal_id references
+-- meals(id), and a partitioned table's primary key must include the
+-- partition key.
+--
+-- Each table is rebuilt as <name>_partitioned, filled, and swapped in inside
+-- one transaction (writes block for the duration of the copy).
+
+-- Creates monthly partitions for [from_month, from_month + months) if missing.
+-- Partitions are named after the final table (water_logs_2026_01) even while
+-- the parent is still called water_logs_partitioned.
+CREATE OR REPLACE FUNCTION public.ensure_monthly_partitions(p_table TEXT, p_from DATE, p_months INTEGER)
+RETURNS void
+LANGUAGE plpgsql AS $$
+DECLARE
+    m DATE;
+    base TEXT := regexp_replace(p_table, '_partitioned$', '');
+BEGIN
+    FOR i IN 0..p_months - 1 LOOP
+        m := (date_trunc('month', p_from) + make_interval(months => i))::date;
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS public.%I PARTITION OF public.%I FOR VALUES FROM (%L) TO (%L)',
+            base || '_' || to_char(m, 'YYYY_MM'), p_table, m, (m + interval '1 month')::date
+        );
+    END LOOP;
+END $$;
+
+BEGIN;
+
+CREATE TABLE public.water_logs_partitioned (
+    id BIGINT NOT NULL DEFAULT nextval('public.water_logs_id_seq'),
+    user_id UUID REFERENCES public.profiles(id) ON DELETE CASCADE,
+    amount_ml INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now()) NOT NULL,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE public.sleep_logs_partitioned (
+    id uuid NOT NULL DEFAULT uuid_generate_v4(),
+    user_id uuid NOT NULL,
+    hours numeric NOT NULL,
+    created_at timestamp without time zone DEFAULT now() NOT NULL,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE public.steps_logs_partitioned (
+    id uuid NOT NULL DEFAULT uuid_generate_v4(),
+    user_id uuid NOT NULL,
+    steps integer NOT NULL,
+    created_at timestamp without time zone DEFAULT now() NOT NULL,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Catch-all for rows far outside the monthly window
+CREATE TABLE public.water_logs_partitioned_default PARTITION OF public.water_logs_partitioned DEFAULT;
+CREATE TABLE public.sleep_logs_partitioned_default PARTITION OF public.sleep_logs_partitioned DEFAULT;
+CREATE TABLE public.steps_logs_partitioned_default PARTITION OF public.steps_logs_partitioned DEFAULT;
+
+-- Three years back, one year ahead
+SELECT public.ensure_monthly_partitions('water_logs_partitioned', (now() - interval '3 years')::date, 48);
+SELECT public.ensure_monthly_partitions('sleep_logs_partitioned', (now() - interval '3 years')::date, 48);
+SELECT public.ensure_monthly_partitions('steps_logs_partitioned', (now() - interval '3 years')::date, 48);
+
+-- Indexes on the parent cascade to every partition
+CREATE INDEX ON public.water_logs_partitioned (user_id, created_at);
+CREATE INDEX ON public.sleep_logs_partitioned (user_id, created_at);
+CREATE INDEX ON public.steps_logs_partitioned (user_id, created_at);
+
+INSERT INTO public.water_logs_partitioned SELECT id, user_id, amount_ml, created_at FROM public.water_logs;
+INSERT INTO public.sleep_logs_partitioned SELECT id, user_id, hours, created_at FROM public.sleep_logs;
+INSERT INTO public.steps_logs_partitioned SELECT id, user_id, steps, created_at FROM public.steps_logs;
+
+ALTER SEQUENCE public.water_logs_id_seq OWNED BY NONE;
+ALTER TABLE public.water_logs RENAME TO water_logs_unpartitioned;
+ALTER TABLE public.sleep_logs RENAME TO sleep_logs_unpartitioned;
+ALTER TABLE public.steps_logs RENAME TO steps_logs_unpartitioned;
+ALTER TABLE public.water_logs_partitioned RENAME TO water_logs;
+ALTER TABLE public.sleep_logs_partitioned RENAME TO sleep_logs;
+ALTER TABLE public.steps_logs_partitioned RENAME TO steps_logs;
+ALTER SEQUENCE public.water_logs_id_seq OWNED BY public.water_logs.id;
+
+-- The daily_totals triggers were attached to the old tables
+DROP TRIGGER IF EXISTS daily_totals_water_logs ON public.water_logs_unpartitioned;
+DROP TRIGGER IF EXISTS daily_totals_sleep_logs ON public.sleep_logs_unpartitioned;
+DROP TRIGGER IF EXISTS daily_totals_steps_logs ON public.steps_logs_unpartitioned;
+CREATE TRIGGER daily_totals_water_logs AFTER INSERT OR UPDATE OR DELETE ON public.water_logs
+    FOR EACH ROW EXECUTE FUNCTION public.daily_totals_water_logs();
+CREATE TRIGGER daily_totals_sleep_logs AFTER INSERT OR UPDATE OR DELETE ON public.sleep_logs
+    FOR EACH ROW EXECUTE FUNCTION public.daily_totals_sleep_logs();
+CREATE TRIGGER daily_totals_steps_logs AFTER INSERT OR UPDATE OR DELETE ON public.steps_logs
+    FOR EACH ROW EXECUTE FUNCTION public.daily_totals_steps_logs();
+
+COMMIT;
+
+-- Keep a year of partitions ahead, e.g. monthly with pg_cron:
+--   SELECT cron.schedule('log-partitions', '0 3 1 * *', $$
+--       SELECT public.ensure_monthly_partitions('water_logs', now()::date, 12);
+--       SELECT public.ensure_monthly_partitions('sleep_logs', now()::date, 12);
+--       SELECT public.ensure_monthly_partitions('steps_logs', now()::date, 12);
+--   $$);
+-- Drop the *_unpartitioned tables once the new ones are verified.
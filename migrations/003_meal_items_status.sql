@@ -0,0 +1,3 @@
+-- Background nutrition estimates: /log_meal stores the item right away with
+-- status 'estimating' and a worker fills in the macros ('ready' or 'failed').
+ALTER TABLE public.meal_items ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'ready';
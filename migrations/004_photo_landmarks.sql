@@ -0,0 +1,10 @@
+-- Cached body landmarks for /align_photos: Gemini is asked once per photo and
+-- every later comparison reuses the stored points.
+CREATE TABLE IF NOT EXISTS public.photo_landmarks (
+    content_hash TEXT PRIMARY KEY,
+    photo_id BIGINT REFERENCES public.progress_photos(id) ON DELETE CASCADE,
+    side TEXT,
+    landmarks JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+CREATE INDEX IF NOT EXISTS photo_landmarks_photo_id_idx ON public.photo_landmarks (photo_id);
@@ -0,0 +1,4 @@
+-- Multipart /upload_progress_photo stores the original plus two resized
+-- copies; rows uploaded as base64 JSON keep NULL here.
+ALTER TABLE public.progress_photos ADD COLUMN IF NOT EXISTS thumb_url TEXT;
+ALTER TABLE public.progress_photos ADD COLUMN IF NOT EXISTS web_url TEXT;
@@ -0,0 +1,9 @@
+-- Keyset pagination for /get_progress_photos: (created_at, id) newest first,
+-- with or without a side filter. Run with psql (CONCURRENTLY needs autocommit):
+--     psql "$DATABASE_URL" -f migrations/006_progress_photos_keyset.sql
+CREATE INDEX CONCURRENTLY IF NOT EXISTS progress_photos_user_created_id_idx
+    ON public.progress_photos (user_id, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS progress_photos_user_side_created_id_idx
+    ON public.progress_photos (user_id, side, created_at DESC, id DESC);
+-- Superseded by progress_photos_user_created_id_idx
+DROP INDEX CONCURRENTLY IF EXISTS public.progress_photos_user_created_idx;
@@ -0,0 +1,82 @@
+-- Incremental sync for /sync: updated_at columns + triggers, deleted_rows
+-- tombstones and the indexes behind the per-table (updated_at, id) cursors.
+-- Existing rows get updated_at = now(), so the first sync after this
+-- migration returns everything once.
+--
+-- The trigger/table part is transactional; the CONCURRENTLY indexes at the
+-- end are not, so apply with psql:
+--     psql "$DATABASE_URL" -f migrations/007_sync.sql
+-- If 002 partitioned water/sleep/steps_logs, drop CONCURRENTLY from their three
+-- index statements (Postgres cannot build partitioned indexes concurrently).
+
+-- updated_at on every table the app syncs (kept current by a BEFORE UPDATE trigger)
+ALTER TABLE public.meals ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.meal_items ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.water_logs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.sleep_logs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.steps_logs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.body_measurements ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.progress_photos ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION public.touch_updated_at() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END $$;
+
+-- Tombstones: one row per deleted record so clients can drop it from their local copy.
+-- Deleting a meal also removes its items locally (their own tombstones cannot
+-- be attributed once the meal row is gone).
+CREATE TABLE IF NOT EXISTS public.deleted_rows (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_id TEXT NOT NULL,
+    user_id UUID NOT NULL,
+    deleted_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION public.record_deleted_row() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+DECLARE
+    uid UUID;
+BEGIN
+    IF TG_TABLE_NAME = 'meal_items' THEN
+        SELECT user_id INTO uid FROM public.meals WHERE id = OLD.meal_id;
+    ELSE
+        uid := OLD.user_id;
+    END IF;
+    IF uid IS NOT NULL THEN
+        INSERT INTO public.deleted_rows (table_name, row_id, user_id) VALUES (TG_TABLE_NAME, OLD.id::text, uid);
+    END IF;
+    RETURN OLD;
+END $$;
+
+DO $$
+DECLARE t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['meals', 'meal_items', 'water_logs', 'sleep_logs', 'steps_logs', 'body_measurements', 'progress_photos'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS touch_updated_at ON public.%I', t);
+        EXECUTE format('CREATE TRIGGER touch_updated_at BEFORE UPDATE ON public.%I FOR EACH ROW EXECUTE FUNCTION public.touch_updated_at()', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS record_deleted_row ON public.%I', t);
+        EXECUTE format('CREATE TRIGGER record_deleted_row AFTER DELETE ON public.%I FOR EACH ROW EXECUTE FUNCTION public.record_deleted_row()', t);
+    END LOOP;
+END $$;
+
+-- Tombstones older than the sync retention (SYNC_RETENTION_DAYS, 30 by default)
+-- can go; clients that have not synced for that long get a "reset" and start over.
+CREATE OR REPLACE FUNCTION public.prune_deleted_rows(p_keep INTERVAL DEFAULT interval '30 days')
+RETURNS BIGINT LANGUAGE sql SECURITY DEFINER SET search_path = public AS $$
+    WITH gone AS (DELETE FROM public.deleted_rows WHERE deleted_at < now() - p_keep RETURNING 1)
+    SELECT count(*) FROM gone;
+$$;
+REVOKE EXECUTE ON FUNCTION public.prune_deleted_rows(INTERVAL) FROM PUBLIC, anon, authenticated;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS meals_user_updated_idx ON public.meals (user_id, updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS meal_items_updated_idx ON public.meal_items (updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS water_logs_user_updated_idx ON public.water_logs (user_id, updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS sleep_logs_user_updated_idx ON public.sleep_logs (user_id, updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS steps_logs_user_updated_idx ON public.steps_logs (user_id, updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS body_measurements_user_updated_idx ON public.body_measurements (user_id, updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS progress_photos_user_updated_idx ON public.progress_photos (user_id, updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS deleted_rows_user_deleted_idx ON public.deleted_rows (user_id, deleted_at, id);
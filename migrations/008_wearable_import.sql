@@ -0,0 +1,11 @@
+-- Bulk wearable import: /import_wearable writes one row per (user, source,
+-- hour or day bucket) and re-imports upsert onto the same rows.
+--
+-- Manual /log_sleep and /log_steps rows keep source NULL; NULLs are distinct
+-- in a unique index, so they are unaffected. The index includes created_at,
+-- so it is also valid on the partitioned tables from 002.
+ALTER TABLE public.sleep_logs ADD COLUMN IF NOT EXISTS source TEXT;
+ALTER TABLE public.steps_logs ADD COLUMN IF NOT EXISTS source TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS sleep_logs_user_source_created_key ON public.sleep_logs (user_id, source, created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS steps_logs_user_source_created_key ON public.steps_logs (user_id, source, created_at);
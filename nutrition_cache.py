@@ -0,0 +1,110 @@
+import json, os, re, sqlite3, threading, time, unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+# تشكيل الحروف العربية (الفتحة، الضمة، الشدة...) والتطويل
+_ARABIC_MARKS = re.compile(r'[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')
+_WHITESPACE = re.compile(r'\s+')
+_DIGITS = str.maketrans(
+    '\u0660\u0661\u0662\u0663\u0664\u0665\u0666\u0667\u0668\u0669'
+    '\u06F0\u06F1\u06F2\u06F3\u06F4\u06F5\u06F6\u06F7\u06F8\u06F9',
+    '01234567890123456789',
+)
+_LETTERS = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي'})
+
+
+def normalize_query(text: str) -> str:
+    """توحيد نص الطعام حتى تُعامل "2 بيض مسلوق" و "٢ بَيض  مسلوق" كنفس المفتاح"""
+    text = unicodedata.normalize('NFKC', text or '')
+    text = _ARABIC_MARKS.sub('', text)
+    text = text.translate(_DIGITS).translate(_LETTERS)
+    return _WHITESPACE.sub(' ', text).strip().casefold()
+
+
+class NutritionCache:
+    """Two-tier cache for nutrition estimates: an in-process LRU in front of SQLite.
+
+    Keys are normalized food queries, values are the macro dicts returned by
+    Gemini. Both tiers honour the same TTL.
+    """
+
+    def __init__(self, path: Optional[str], max_entries: int = 2048, ttl_seconds: float = 30 * 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    def _db(self):
+        # الاتصال يُفتح عند أول استخدام ولكل عملية على حدة (آمن مع gunicorn --preload)
+        if not self.path:
+            return None
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS nutrition_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _remember(self, key, value, expires_at):
+        self._lru[key] = (expires_at, value)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get(self, query: str) -> Optional[dict]:
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._lru.move_to_end(key)
+                    self.hits["memory"] += 1
+                    return dict(entry[1])
+                del self._lru[key]
+
+            db = self._db()
+            if db is not None:
+                row = db.execute(
+                    "SELECT value, expires_at FROM nutrition_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.hits["disk"] += 1
+                    return dict(value)
+
+            self.misses += 1
+            return None
+
+    def set(self, query: str, value: dict):
+        key = normalize_query(query)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, dict(value), expires_at)
+            db = self._db()
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO nutrition_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at),
+                )
+                db.commit()
+
+    def stats(self) -> dict:
+        hits = self.hits["memory"] + self.hits["disk"]
+        total = hits + self.misses
+        return {
+            "memory_hits": self.hits["memory"],
+            "disk_hits": self.hits["disk"],
+            "misses": self.misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "memory_entries": len(self._lru),
+        }
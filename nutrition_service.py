@@ -1,12 +1,213 @@
-from deep_translator import GoogleTranslator
-import requests
+import csv, os, re
+from collections import defaultdict
+from nutrition_cache import normalize_query
+
+# قاعدة بيانات غذائية محلية (لكل 100 غرام) مع بحث تقريبي بالأحرف الثلاثية (trigrams)
+# حتى لا نحتاج Gemini للأطعمة الشائعة
+FOODS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "foods.csv")
+MIN_SCORE = 0.7
+TOKEN_SCORE = 0.5 # تشابه كل كلمة من الطلب مع كلمة من الاسم (أخطاء إملائية وجمع)
+
+# وحدات القياس -> غرامات (None = حبة/حصة من الطعام نفسه)
+UNITS = {
+    "g": 1, "gr": 1, "gm": 1, "gram": 1, "grams": 1,
+    "غ": 1, "غم": 1, "غرام": 1, "غرامات": 1, "جم": 1, "جرام": 1, "جرامات": 1,
+    "kg": 1000, "كيلو": 1000, "كغ": 1000, "كجم": 1000,
+    "ml": 1, "مل": 1, "ملي": 1, "مليلتر": 1,
+    "l": 1000, "liter": 1000, "litre": 1000, "لتر": 1000,
+    "cup": 240, "cups": 240, "كوب": 240, "اكواب": 240, "كاس": 240, "كاسه": 240,
+    "tbsp": 15, "tablespoon": 15, "tablespoons": 15, "ملعقه كبيره": 15, "ملعقه": 15, "ملاعق": 15,
+    "tsp": 5, "teaspoon": 5, "teaspoons": 5, "ملعقه صغيره": 5,
+    "piece": None, "pieces": None, "pc": None, "pcs": None, "slice": None, "slices": None,
+    "scoop": None, "scoops": None, "serving": None, "servings": None, "plate": None, "bowl": None,
+    "حبه": None, "حبات": None, "قطعه": None, "قطع": None, "شريحه": None, "شرائح": None,
+    "صحن": None, "طبق": None, "سكوب": None, "حصه": None,
+}
+NUMBER_WORDS = {
+    "half": 0.5, "quarter": 0.25, "a": 1, "an": 1, "one": 1, "two": 2, "three": 3,
+    "نص": 0.5, "نصف": 0.5, "ربع": 0.25, "واحد": 1, "واحده": 1, "اثنين": 2, "ثلاث": 3, "ثلاثه": 3,
+}
+FILLER = {"of", "من"}
+SPLIT = re.compile(r"\s*(?:,|،|\+|&|\band\b|\bwith\b|\s+و\s+|\s+مع\s+)\s*")
+NUMBER = re.compile(r"^(\d+(?:\.\d+)?|\d+/\d+)$")
+
+
+def _fold(text):
+    """توحيد إضافي للمطابقة فقط: التاء المربوطة وأداة التعريف"""
+    text = normalize_query(text).replace("ة", "ه").replace("٫", ".")
+    text = re.sub(r"(\d)([^\d\s./])", r"\1 \2", text)
+    tokens = [t[2:] if t.startswith("ال") and len(t) >= 4 else t for t in text.split()]
+    return " ".join(tokens)
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _dice(a, b):
+    ga, gb = _trigrams(a), _trigrams(b)
+    return 2 * len(ga & gb) / (len(ga) + len(gb))
+
+
+def _covers(alias, query):
+    """كل كلمة في الطلب لها كلمة مقابلة في الاسم"""
+    words = alias.split()
+    return all(any(w == t or _dice(w, t) >= TOKEN_SCORE for w in words) for t in query.split())
+
+
+class FoodIndex:
+    """Per-100 g food table held in parallel lists, with a trigram index over all aliases."""
+
+    def __init__(self, path=FOODS_PATH):
+        self.names, self.macros, self.unit_grams = [], [], []
+        self.alias_food, self.alias_grams, self.alias_keys = [], [], []
+        self.exact = {}
+        self.first_words = set()
+        self.postings = defaultdict(list)
+        with open(path, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                idx = len(self.names)
+                self.names.append(row["name"])
+                self.macros.append(tuple(float(row[k]) for k in ("kcal", "protein", "carbs", "fat")))
+                self.unit_grams.append(float(row["unit_grams"]))
+                for alias in [row["name"], *row["aliases"].split("|")]:
+                    key = _fold(alias)
+                    if not key or key in self.exact:
+                        continue
+                    self.exact[key] = idx
+                    self.first_words.add(key.split()[0])
+                    grams = _trigrams(key)
+                    alias_id = len(self.alias_food)
+                    self.alias_food.append(idx)
+                    self.alias_grams.append(len(grams))
+                    self.alias_keys.append(key)
+                    for g in grams:
+                        self.postings[g].append(alias_id)
+
+    def match(self, name):
+        """أقرب طعام للاسم مع درجة التشابه (Dice)، أو None إذا كانت الدرجة أقل من MIN_SCORE
+
+        المطابقة التقريبية تتطلب أن تقابل كل كلمة في الطلب كلمة في الاسم، حتى لا يصبح
+        "chocolate cake" شوكولاتة أو "chicken soup" صدر دجاج (يتولاها الكاش و Gemini)
+        """
+        key = _fold(name)
+        if key in self.exact:
+            return self.exact[key], 1.0
+        grams = _trigrams(key)
+        overlap = defaultdict(int)
+        for g in grams:
+            for alias_id in self.postings.get(g, ()):
+                overlap[alias_id] += 1
+        best, best_score = None, 0.0
+        for alias_id, shared in overlap.items():
+            score = 2 * shared / (len(grams) + self.alias_grams[alias_id])
+            if score > best_score and _covers(self.alias_keys[alias_id], key):
+                best, best_score = self.alias_food[alias_id], score
+        return (best, best_score) if best_score >= MIN_SCORE else (None, best_score)
+
+
+def parse_quantity(text):
+    """'2 eggs' -> (2, None, 'eggs') ، '200 غ رز' -> (200, 1, 'رز') ، 'كوب حليب' -> (1, 240, 'حليب')"""
+    tokens = _fold(text).split()
+    qty, unit, rest = None, None, []
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        if qty is None and (NUMBER.match(tok) or tok in NUMBER_WORDS):
+            if "/" in tok:
+                num, den = tok.split("/")
+                qty = float(num) / float(den) if float(den) else None
+            else:
+                qty = float(tok) if NUMBER.match(tok) else NUMBER_WORDS[tok]
+            i += 1
+            continue
+        two = " ".join(tokens[i:i + 2])
+        if unit is None and two in UNITS:
+            unit = ("unit", UNITS[two])
+            i += 2
+            continue
+        if unit is None and tok in UNITS and (qty is not None or i == 0):
+            unit = ("unit", UNITS[tok])
+            i += 1
+            continue
+        if tok not in FILLER:
+            rest.append(tok)
+        i += 1
+    return (qty if qty is not None else 1.0), (unit[1] if unit else None), " ".join(rest)
+
+
+_index = None
+
+
+def get_index():
+    global _index
+    if _index is None:
+        _index = FoodIndex()
+    return _index
+
+
+def _split_attached_waw(segment, index):
+    """'خبز وحمص' -> ['خبز', 'حمص'] عندما تكون الواو المتصلة بداية طعام جديد"""
+    parts, current = [], []
+    for word in segment.split():
+        folded = _fold(word)
+        if (current and folded.startswith("و") and folded not in index.first_words
+                and _fold(word[1:]) in index.first_words):
+            parts.append(" ".join(current))
+            current = [word[1:]]
+        else:
+            current.append(word)
+    parts.append(" ".join(current))
+    return parts
+
+
+def resolve_items(food_query, partial=False):
+    """تحليل النص محلياً إلى عناصر. يرجع None إذا لم يُعرف أي عنصر (ليتولاه Gemini)
+
+    partial=True: يتخطى الأجزاء غير المعروفة ويرجع (العناصر، الأجزاء غير المعروفة)
+    """
+    index = get_index()
+    items, unknown = [], []
+    segments = [p for s in SPLIT.split(food_query or "") if s for p in _split_attached_waw(s, index)]
+    for segment in segments:
+        qty, unit_factor, name = parse_quantity(segment)
+        idx = index.match(name)[0] if name else None
+        if idx is None:
+            if not partial:
+                return None
+            unknown.append(segment.strip())
+            continue
+        grams = qty * (unit_factor if unit_factor is not None else index.unit_grams[idx])
+        kcal, prot, carb, fat = (v * grams / 100 for v in index.macros[idx])
+        items.append({
+            "name": segment.strip(),
+            "cal": round(kcal, 1),
+            "prot": round(prot, 1),
+            "carb": round(carb, 1),
+            "fat": round(fat, 1),
+            "weight": round(grams, 1),
+        })
+    if partial:
+        return items, unknown
+    return items or None
+
+
+def sum_items(items):
+    return {k: round(sum(i[k] for i in items), 1) for k in ("cal", "prot", "carb", "fat", "weight")}
+
+
+def estimate(food_query):
+    """مجموع القيم الغذائية لكل العناصر، بنفس شكل رد get_ai_nutrition_estimate"""
+    items = resolve_items(food_query)
+    return sum_items(items) if items else None
+
 
 def get_nutrition_data(food_name_ar):
-    # 1. الترجمة من العربي للانجليزي
-    translated = GoogleTranslator(source='ar', target='en').translate(food_name_ar)
-    
-    # 2. طلب البيانات من API Ninjas (سنحتاج مفتاحهم لاحقاً)
-    api_url = f'https://api.api-ninjas.com/v1/nutrition?query={translated}'
-    # ملاحظة: سنحتاج لـ API Key من موقعهم، سأخبرك كيف تجلبه مجاناً
-    
-    return {"original": food_name_ar, "english": translated}
+    """البحث المحلي مع الاسم الإنجليزي لكل عنصر (بدون ترجمة عبر الشبكة)"""
+    items = resolve_items(food_name_ar)
+    if not items:
+        return None
+    index = get_index()
+    english = [index.names[index.match(parse_quantity(i["name"])[2])[0]] for i in items]
+    return {"original": food_name_ar, "english": english, **sum_items(items)}
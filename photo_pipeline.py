@@ -0,0 +1,216 @@
+import asyncio, base64, binascii, hashlib, io, logging
+from urllib.parse import urlparse
+from PIL import Image, ImageOps, UnidentifiedImageError
+from nutrition_cache import NutritionCache
+from gemini_client import GeminiError
+from photo_storage import STORAGE_REF
+
+logger = logging.getLogger(__name__)
+
+# ملامح الجسم التي نطلبها من Gemini (إحداثيات من 0 إلى 1000 فلا تتأثر بتصغير الصورة)
+LANDMARK_KEYS = ("l_eye", "r_eye", "nose", "l_sh", "r_sh", "navel")
+LANDMARKS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        key: {"type": "ARRAY", "items": {"type": "NUMBER"}, "description": "[x, y] from 0 to 1000, omit if not visible"}
+        for key in LANDMARK_KEYS
+    },
+}
+
+
+def decode_photo(photo):
+    """photo_url كما يخزنه التطبيق: data URI أو base64 خام. يرجع None إذا كان رابطاً أو مرجع تخزين"""
+    if photo.startswith(("http://", "https://", STORAGE_REF)):
+        return None
+    if photo.startswith("data:") and "," in photo:
+        photo = photo.split(",", 1)[1]
+    try:
+        return base64.b64decode(photo, validate=False)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Photo is not valid base64: {e}")
+
+
+def downscale(raw, max_side=768, quality=85):
+    """تصغير الصورة إلى JPEG بحجم مناسب لـ Gemini (مع تصحيح اتجاه EXIF)"""
+    with Image.open(io.BytesIO(raw)) as img:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+        return out.getvalue()
+
+
+def make_variants(fileobj, sizes):
+    """نسخ JPEG مصغّرة {الاسم: BytesIO} من ملف الصورة الأصلي على القرص.
+
+    JPEGs are decoded straight at a reduced scale (draft mode), so a 12 MP
+    upload never has to be fully decoded just to produce a 1280 px copy.
+    """
+    fileobj.seek(0)
+    try:
+        img = Image.open(fileobj)
+    except UnidentifiedImageError:
+        raise ValueError("Not a supported image")
+    with img:
+        fmt = (img.format or "jpeg").lower()
+        largest = max(sizes.values())
+        img.draft("RGB", (largest, largest))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        variants = {}
+        # من الأكبر للأصغر، كل نسخة تُصغّر من السابقة
+        for name, side in sorted(sizes.items(), key=lambda kv: -kv[1]):
+            img.thumbnail((side, side), Image.LANCZOS)
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=82, optimize=True, progressive=True)
+            variants[name] = out
+    return fmt, variants
+
+
+def clean_landmarks(data):
+    """الإبقاء على النقاط الصالحة فقط: [x, y] داخل المجال 0..1000"""
+    points = {}
+    for key in LANDMARK_KEYS:
+        p = data.get(key) if isinstance(data, dict) else None
+        if (isinstance(p, list) and len(p) == 2 and all(isinstance(v, (int, float)) for v in p)
+                and all(0 <= v <= 1000 for v in p)):
+            points[key] = [float(p[0]), float(p[1])]
+    return points
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class PhotoPipeline:
+    """Landmarks for progress photos, detected once per image and reused.
+
+    Photos are keyed by the SHA-256 of their original bytes. Lookups go
+    through an in-process LRU, then the `photo_landmarks` table, and only
+    then to Gemini with a downscaled JPEG (one photo per request, so the
+    result is reusable for any pair).
+    """
+
+    def __init__(self, supabase, gemini, http, storage=None, max_side=768, cache_entries=512, allowed_hosts=()):
+        self.supabase = supabase
+        self.gemini = gemini
+        self.http = http
+        self.storage = storage
+        # الروابط في progress_photos يكتبها العميل: لا نطلب إلا من مضيفات التخزين المعروفة
+        self.allowed_hosts = {h.lower() for h in allowed_hosts if h}
+        self.max_side = max_side
+        self.cache = NutritionCache(None, max_entries=cache_entries, ttl_seconds=365 * 86400)
+        self._pending = {}
+
+    async def load(self, photo_url):
+        """البايتات الأصلية للصورة، سواء كانت مخزنة كـ base64 أو مرجع تخزين أو رابط"""
+        if self.storage and photo_url.startswith(STORAGE_REF):
+            local = self.storage.local_path(photo_url)
+            if local:
+                return await asyncio.to_thread(_read_file, local)
+            photo_url = self.storage.resolve(photo_url)
+            if photo_url.startswith("/"):
+                raise LookupError("Photo file is missing from storage")
+        raw = decode_photo(photo_url)
+        if raw is not None:
+            return raw
+        local = self.storage.local_path(photo_url) if self.storage else None
+        if local:
+            return await asyncio.to_thread(_read_file, local)
+        url = urlparse(photo_url)
+        if url.scheme not in ("http", "https") or (url.hostname or "").lower() not in self.allowed_hosts:
+            raise LookupError(f"Photo URL host is not allowed: {url.hostname}")
+        # بدون تتبع التحويلات: تحويل إلى مضيف آخر (أو عنوان داخلي) يُعامل كخطأ
+        res = await self.http.get(photo_url, timeout=15, follow_redirects=False)
+        res.raise_for_status()
+        return res.content
+
+    async def stored(self, photo_ids):
+        """النقاط المحفوظة مسبقاً لهذه الصور من جدول photo_landmarks: {photo_id: points}"""
+        if not photo_ids:
+            return {}
+        res = await self.supabase.table("photo_landmarks").select("photo_id, content_hash, landmarks").in_("photo_id", list(photo_ids)).execute()
+        found = {}
+        for row in res.data or []:
+            self.cache.set(row["content_hash"], {"points": row["landmarks"]})
+            found[row["photo_id"]] = row["landmarks"]
+        return found
+
+    async def landmarks_for_ids(self, photo_ids, user_id):
+        """نقاط صور progress_photos بالترتيب المطلوب؛ لا تُحمّل الصورة إذا كانت نقاطها محفوظة.
+        المعرّفات متسلسلة، فكل صورة لا يملكها user_id تُعامل كغير موجودة (LookupError)"""
+        owned, found = await asyncio.gather(
+            self.supabase.table("progress_photos").select("id").in_("id", list(set(photo_ids))).eq("user_id", user_id).execute(),
+            self.stored(photo_ids),
+        )
+        owned = {row["id"] for row in owned.data or []}
+        for pid in photo_ids:
+            if pid not in owned:
+                raise LookupError(f"Photo {pid} not found")
+        missing = [pid for pid in photo_ids if pid not in found]
+        if missing:
+            res = await self.supabase.table("progress_photos").select("id, photo_url, web_url, side").in_("id", missing).eq("user_id", user_id).execute()
+            rows = {row["id"]: row for row in res.data or []}
+            for pid in missing:
+                if pid not in rows:
+                    raise LookupError(f"Photo {pid} not found")
+
+            async def detect(row):
+                # النسخة المخصصة للويب تكفي لاكتشاف النقاط وأصغر بكثير من الأصل
+                raw = await self.load(row.get("web_url") or row["photo_url"])
+                found[row["id"]] = await self.landmarks(raw, row["side"], photo_id=row["id"])
+
+            await asyncio.gather(*(detect(rows[pid]) for pid in dict.fromkeys(missing)))
+        return [found[pid] for pid in photo_ids]
+
+    async def landmarks(self, raw, side, photo_id=None):
+        """نقاط الصورة: من الكاش إن وُجدت وإلا اكتشافها عبر Gemini (طلب واحد لكل صورة)"""
+        digest = hashlib.sha256(raw).hexdigest()
+        cached = self.cache.get(digest)
+        if cached is not None:
+            return cached["points"]
+        # صورتان متطابقتان في نفس الوقت تنتظران نفس الطلب
+        task = self._pending.get(digest)
+        if task is None:
+            task = asyncio.ensure_future(self._detect_and_store(digest, raw, side, photo_id))
+            self._pending[digest] = task
+        return await asyncio.shield(task)
+
+    async def _detect_and_store(self, digest, raw, side, photo_id):
+        try:
+            res = await self.supabase.table("photo_landmarks").select("landmarks, photo_id").eq("content_hash", digest).limit(1).execute()
+            if res.data:
+                points = res.data[0]["landmarks"]
+                if photo_id is not None and res.data[0].get("photo_id") is None:
+                    await self.supabase.table("photo_landmarks").update({"photo_id": photo_id}).eq("content_hash", digest).execute()
+            else:
+                points = await self._detect(raw, side)
+                row = {"content_hash": digest, "side": side, "landmarks": points}
+                if photo_id is not None:
+                    row["photo_id"] = photo_id
+                try:
+                    await self.supabase.table("photo_landmarks").upsert(row, on_conflict="content_hash").execute()
+                except Exception as e:
+                    logger.warning(f"Could not store photo landmarks: {e}")
+            self.cache.set(digest, {"points": points})
+            return points
+        finally:
+            self._pending.pop(digest, None)
+
+    async def _detect(self, raw, side):
+        small = await asyncio.to_thread(downscale, raw, self.max_side)
+        prompt = (
+            f"This is a {side} body progress photo. Detect the precise [x, y] coordinates for: "
+            "l_eye: Left Eye (or Ear if side), r_eye: Right Eye (or Head Center if side), nose: Nose, "
+            "l_sh: Left Shoulder, r_sh: Right Shoulder, navel: Navel. "
+            "Coordinates must be normalized from 0 to 1000 (where 0,0 is top-left)."
+        )
+        parts = [
+            {"text": prompt},
+            {"inline_data": {"mime_type": "image/jpeg", "data": base64.b64encode(small).decode()}},
+        ]
+        points = clean_landmarks(await self.gemini.generate_json(parts, LANDMARKS_SCHEMA, timeout=20))
+        if not points:
+            raise GeminiError("AI could not identify body parts", 200)
+        return points
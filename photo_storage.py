@@ -0,0 +1,119 @@
+import asyncio, logging, os, shutil
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# تخزين صور التقدم: مجلد محلي (يُقدَّم عبر /media) أو تخزين متوافق مع S3
+# قاعدة البيانات تحفظ مرجعاً نسبياً "storage:<key>" يُحوَّل إلى رابط عند القراءة،
+# فلا تنكسر الروابط عند تغيير النطاق أو البروكسي أو مكان التخزين
+# (":" ليست من حروف base64، فلا يختلط المرجع بالصور القديمة المخزنة كـ base64)
+STORAGE_REF = "storage:"
+
+
+class BaseStorage:
+    public_url = ""
+
+    def resolve(self, url):
+        """رابط عام لمرجع "storage:<key>"؛ الروابط الأخرى تُرجع كما هي"""
+        if url and url.startswith(STORAGE_REF):
+            return f"{self.public_url}/{url[len(STORAGE_REF):]}"
+        return url
+
+    def local_path(self, url):
+        return None
+
+
+class DatabaseStorage(BaseStorage):
+    """No file storage: uploads stay in progress_photos.photo_url as base64, as before uploads went to files.
+
+    Used when PHOTO_STORAGE is unset on a platform whose disk is wiped on
+    restart, so a default deploy never points rows at files that vanish.
+    """
+
+
+class LocalStorage(BaseStorage):
+    """Files under `root`, served by the app itself at `public_url`."""
+
+    def __init__(self, root="media", public_url="/media"):
+        self.root = os.path.abspath(root)
+        self.public_url = public_url.rstrip("/")
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def _write(self, key, fileobj):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fileobj.seek(0)
+        with open(path + ".part", "wb") as out:
+            shutil.copyfileobj(fileobj, out, 1024 * 1024)
+        os.replace(path + ".part", path)
+
+    async def put(self, key, fileobj, content_type="image/jpeg"):
+        await asyncio.to_thread(self._write, key, fileobj)
+        return f"{STORAGE_REF}{key}"
+
+    def local_path(self, url):
+        """المسار على القرص لرابط أو مرجع من هذا التخزين (لقراءة الصورة بدون طلب HTTP)"""
+        path = urlparse(self.resolve(url)).path
+        prefix = urlparse(self.public_url).path + "/"
+        if not path.startswith(prefix):
+            return None
+        try:
+            local = self._path(path[len(prefix):])
+        except ValueError:
+            return None
+        return local if os.path.exists(local) else None
+
+
+class S3Storage(BaseStorage):
+    """Any S3-compatible bucket (AWS, R2, MinIO, Supabase Storage's S3 API). Needs boto3."""
+
+    def __init__(self, bucket, public_url, endpoint_url=None, region=None):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("PHOTO_STORAGE=s3 needs boto3: pip install boto3")
+        self.bucket = bucket
+        self.public_url = public_url.rstrip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+
+    def _write(self, key, fileobj, content_type):
+        fileobj.seek(0)
+        self.client.upload_fileobj(
+            fileobj, self.bucket, key,
+            ExtraArgs={"ContentType": content_type, "CacheControl": "public, max-age=31536000, immutable"},
+        )
+
+    async def put(self, key, fileobj, content_type="image/jpeg"):
+        await asyncio.to_thread(self._write, key, fileobj, content_type)
+        return f"{STORAGE_REF}{key}"
+
+
+# متغيرات تضبطها منصات الحاويات (Heroku، Render، Cloud Run، Fly): قرصها يُمحى مع كل إعادة تشغيل
+EPHEMERAL_PLATFORMS = ("DYNO", "RENDER", "K_SERVICE", "FLY_APP_NAME")
+
+
+def storage_from_env():
+    """PHOTO_STORAGE=local (الافتراضي) أو s3 أو database؛ على منصة قرصها مؤقت يصبح الافتراضي database"""
+    kind = os.getenv("PHOTO_STORAGE", "local").lower()
+    if "PHOTO_STORAGE" not in os.environ and any(os.getenv(v) for v in EPHEMERAL_PLATFORMS):
+        logger.warning(
+            "PHOTO_STORAGE is not set and this platform wipes the local disk on every restart: progress photos "
+            "are kept in the database as base64. Set PHOTO_STORAGE=s3 (or local with a persistent disk) to store files."
+        )
+        kind = "database"
+    if kind == "database":
+        return DatabaseStorage()
+    if kind == "s3":
+        return S3Storage(
+            os.environ["S3_BUCKET"],
+            os.environ["S3_PUBLIC_URL"],
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            region=os.getenv("S3_REGION"),
+        )
+    return LocalStorage(os.getenv("PHOTO_STORAGE_DIR", "media"), os.getenv("PHOTO_PUBLIC_URL", "/media"))
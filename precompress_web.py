@@ -0,0 +1,75 @@
+"""Write .br and .gz copies of the Flutter web build for static_assets.py to serve.
+
+Usage:
+    python precompress_web.py                 # build/web
+    python precompress_web.py path/to/web --min-bytes 1024
+
+Brotli needs the brotli package (pip install brotli); without it only .gz
+files are written. A copy is kept only when it saves at least 10%. Run it
+after every `flutter build web`: copies older than their source are ignored
+by the server, and copies whose source is gone are deleted here.
+"""
+import argparse, gzip, os
+
+COMPRESSIBLE = {".js", ".mjs", ".css", ".html", ".json", ".wasm", ".svg", ".txt", ".map", ".otf", ".ttf", ".frag", ".symbols"}
+SUFFIXES = (".br", ".gz")
+
+
+def compressors(use_brotli=True):
+    out = {".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if use_brotli:
+        try:
+            import brotli
+        except ImportError:
+            print("brotli is not installed (pip install brotli): writing .gz only")
+        else:
+            out[".br"] = lambda data: brotli.compress(data, quality=11)
+    return out
+
+
+def precompress(root, min_bytes=1024, use_brotli=True):
+    codecs = compressors(use_brotli)
+    stats = {"files": 0, "written": 0, "removed": 0, "bytes_in": 0, "bytes_out": 0}
+    for folder, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(folder, name)
+            base, ext = os.path.splitext(path)
+            if ext in SUFFIXES:
+                if not os.path.exists(base):
+                    os.remove(path)
+                    stats["removed"] += 1
+                continue
+            if ext.lower() not in COMPRESSIBLE or os.path.getsize(path) < min_bytes:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            stats["files"] += 1
+            source = os.stat(path)
+            for suffix, compress in codecs.items():
+                packed = compress(data)
+                target = path + suffix
+                if len(packed) > len(data) * 0.9:
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                with open(target, "wb") as f:
+                    f.write(packed)
+                # نفس وقت تعديل الأصل: Last-Modified متسق والسيرفر يعرف أنها ليست قديمة
+                os.utime(target, ns=(source.st_atime_ns, source.st_mtime_ns))
+                stats["written"] += 1
+                stats["bytes_in"] += len(data)
+                stats["bytes_out"] += len(packed)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root", nargs="?", default="build/web")
+    parser.add_argument("--min-bytes", type=int, default=1024, help="skip smaller files")
+    parser.add_argument("--no-brotli", action="store_true")
+    args = parser.parse_args()
+    if not os.path.isdir(args.root):
+        raise SystemExit(f"{args.root} not found: run flutter build web first")
+    s = precompress(args.root, args.min_bytes, not args.no_brotli)
+    ratio = s["bytes_out"] / s["bytes_in"] if s["bytes_in"] else 0
+    print(f"{s['files']} files, {s['written']} compressed copies ({ratio:.1%} of original size), {s['removed']} stale copies removed")
@@ -0,0 +1,272 @@
+import asyncio, contextvars, logging, math, os, time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from gemini_client import GeminiError
+
+logger = logging.getLogger(__name__)
+
+# حدود الطلبات على المسارات التي تستدعي Gemini: دلو رموز (token bucket) لكل مستخدم ولكل IP،
+# وميزانية يومية لكل مستخدم (عدد الاستدعاءات والرموز التقديرية) تُخصم عند كل استدعاء فعلي لـ Gemini.
+# الطلب لا يُخصم من الدلاء إلا إذا احتاج Gemini فعلاً: التقديرات المحلية والمخزنة لا تُحسب،
+# حتى لا يحجب مستخدمون خلف نفس الـ NAT بعضهم بعضاً
+
+# صاحب الطلب الحالي (user_id أو ip:<address>) الذي تُخصم منه استدعاءات Gemini
+ai_subject = contextvars.ContextVar("ai_subject", default=None)
+# حالة حد الطلبات للطلب الحالي (المستخدم، IP، نتيجة الخصم)؛ قاموس مشترك بين مهام نفس الطلب
+ai_request = contextvars.ContextVar("ai_request", default=None)
+
+IMAGE_TOKENS = 258 # صورة حتى 768px تُحسب كبلاطة واحدة تقريباً
+OUTPUT_TOKENS = 250 # ردود JSON قصيرة بمخطط ثابت
+
+
+class BudgetExceeded(GeminiError):
+    """The daily AI budget of the current user is used up; Gemini was not called."""
+
+    def __init__(self, message):
+        super().__init__(message, 429)
+
+
+class RateLimited(GeminiError):
+    """The current request is over its user or IP rate; Gemini was not called."""
+
+    def __init__(self, wait):
+        self.retry_after = max(1, math.ceil(wait))
+        super().__init__(f"Too many requests, retry in {self.retry_after}s", 429)
+
+
+def estimate_tokens(parts):
+    """تقدير تقريبي لرموز الطلب والرد (4 أحرف للرمز)، يكفي للميزانية دون استدعاء countTokens"""
+    tokens = OUTPUT_TOKENS
+    for part in parts:
+        if "text" in part:
+            tokens += math.ceil(len(part["text"]) / 4)
+        elif "inline_data" in part or "inlineData" in part:
+            tokens += IMAGE_TOKENS
+    return tokens
+
+
+def budget_day():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def seconds_until_reset():
+    now = datetime.now(timezone.utc)
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return math.ceil((tomorrow - now).total_seconds())
+
+
+class MemoryLimits:
+    """Buckets and daily counters inside the process (one server process only)."""
+
+    def __init__(self, max_keys=50000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._usage = {}
+        self._day = None
+        self.errors = 0
+
+    async def take(self, key, rate, burst, cost=1):
+        """يخصم cost من الدلو ويرجع 0، أو عدد الثواني حتى يتوفر (بدون خصم)"""
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - last) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        if len(self._buckets) >= self.max_keys:
+            # الأقدم استخداماً (pop ثم إعادة الإدراج تجعل الترتيب حسب آخر استخدام)
+            self._buckets.pop(next(iter(self._buckets)))
+        self._buckets[key] = (tokens, now)
+        return wait
+
+    def _today(self):
+        day = budget_day()
+        if day != self._day:
+            self._day, self._usage = day, {}
+        return self._usage
+
+    async def add_usage(self, key, calls, tokens):
+        usage = self._today().setdefault(key, {"calls": 0, "tokens": 0})
+        usage["calls"] += calls
+        usage["tokens"] += tokens
+        return dict(usage)
+
+    async def usage(self, key):
+        return dict(self._today().get(key) or {"calls": 0, "tokens": 0})
+
+    async def aclose(self):
+        pass
+
+
+# الدلو كله في خطوة واحدة داخل Redis حتى لا يتسابق عاملان على نفس المفتاح
+TAKE_SCRIPT = """
+local rate, burst, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisLimits:
+    """Buckets and daily counters shared by every worker and instance (Redis, Valkey, KeyDB...).
+
+    If Redis is unreachable requests are let through and counted in
+    `errors`: a limiter outage should not take the API down with it.
+    """
+
+    def __init__(self, url, prefix="gym:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("REDIS_URL is set but the redis package is missing: pip install redis")
+        self.prefix = prefix
+        self.client = redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._take = self.client.register_script(TAKE_SCRIPT)
+        self.errors = 0
+
+    def _failed(self, op, e):
+        self.errors += 1
+        logger.warning(f"Redis {op} failed: {e}")
+
+    async def take(self, key, rate, burst, cost=1):
+        try:
+            return float(await self._take(keys=[self.prefix + key], args=[rate, burst, time.time(), cost]))
+        except Exception as e:
+            self._failed("rate limit", e)
+            return 0.0
+
+    async def add_usage(self, key, calls, tokens):
+        key = f"{self.prefix}{key}:{budget_day()}"
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.hincrby(key, "calls", calls)
+                pipe.hincrby(key, "tokens", tokens)
+                pipe.expire(key, 2 * 86400)
+                total_calls, total_tokens, _ = await pipe.execute()
+            return {"calls": total_calls, "tokens": total_tokens}
+        except Exception as e:
+            self._failed("budget", e)
+            return {"calls": 0, "tokens": 0}
+
+    async def usage(self, key):
+        try:
+            calls, tokens = await self.client.hmget(f"{self.prefix}{key}:{budget_day()}", "calls", "tokens")
+        except Exception as e:
+            self._failed("budget", e)
+            return {"calls": 0, "tokens": 0}
+        return {"calls": int(calls or 0), "tokens": int(tokens or 0)}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class RateLimiter:
+    """Per-user and per-IP token buckets plus a daily AI budget per user.
+
+    Rates are requests per minute with a burst allowance; a rate or budget
+    of 0 disables that check. With trust_ip=False the client address is
+    ignored (behind a proxy it is the proxy's address for everyone), so
+    there is no per-IP bucket and anonymous callers have no subject.
+    """
+
+    def __init__(self, backend, user_per_minute=20, user_burst=10, ip_per_minute=60, ip_burst=30,
+                 daily_calls=150, daily_tokens=150000, trust_ip=True):
+        self.backend = backend
+        self.trust_ip = trust_ip
+        self.user_limit = (user_per_minute / 60, user_burst)
+        self.ip_limit = (ip_per_minute / 60, ip_burst)
+        self.daily_calls = daily_calls
+        self.daily_tokens = daily_tokens
+        self.counters = Counter()
+
+    async def check(self, user_id=None, ip=None):
+        """0 إذا سُمح بالطلب، وإلا عدد الثواني قبل إعادة المحاولة (لترويسة Retry-After)"""
+        for kind, key, (rate, burst) in (("user", user_id, self.user_limit), ("ip", ip, self.ip_limit)):
+            if not key or rate <= 0:
+                continue
+            wait = await self.backend.take(f"rate:{kind}:{key}", rate, max(burst, 1))
+            if wait > 0:
+                self.counters[f"limited_{kind}"] += 1
+                return wait
+        self.counters["allowed"] += 1
+        return 0.0
+
+    def _over(self, usage):
+        return (self.daily_calls and usage["calls"] > self.daily_calls) or \
+            (self.daily_tokens and usage["tokens"] > self.daily_tokens)
+
+    async def over_budget(self, subject):
+        """هل استُنفدت ميزانية اليوم؟ (بدون خصم) — لاختيار التقدير المحلي قبل إرسال مهمة للخلفية"""
+        if not subject or not (self.daily_calls or self.daily_tokens):
+            return False
+        usage = await self.backend.usage(f"budget:{subject}")
+        return bool(self._over({"calls": usage["calls"] + 1, "tokens": usage["tokens"]}))
+
+    async def spend(self, subject, tokens):
+        """يخصم استدعاء Gemini واحداً من ميزانية اليوم، أو يرفع BudgetExceeded"""
+        if not subject or not (self.daily_calls or self.daily_tokens):
+            return
+        usage = await self.backend.add_usage(f"budget:{subject}", 1, tokens)
+        if self._over(usage):
+            self.counters["budget_exceeded"] += 1
+            raise BudgetExceeded(f"Daily AI budget reached ({self.daily_calls} calls / {self.daily_tokens} tokens)")
+        self.counters["ai_calls"] += 1
+        self.counters["ai_tokens"] += tokens
+
+    def start_request(self, user_id=None, ip=None):
+        """يسجل صاحب الطلب الحالي؛ الخصم من الدلاء يؤجَّل إلى أول استدعاء لـ Gemini (charge_request).
+        يرجع False إذا كانت الحدود مفعّلة ولا يُعرف صاحب الطلب (لا user_id ولا IP موثوق)"""
+        if not self.trust_ip:
+            ip = None
+        subject = user_id or (f"ip:{ip}" if ip else None)
+        ai_subject.set(subject)
+        ai_request.set({"user_id": user_id, "ip": ip, "wait": None, "lock": asyncio.Lock()})
+        return subject is not None or not (self.daily_calls or self.daily_tokens or self.user_limit[0] > 0)
+
+    async def charge_request(self):
+        """يخصم الطلب الحالي من دلاء المستخدم و IP مرة واحدة مهما تعددت استدعاءاته، أو يرفع RateLimited"""
+        state = ai_request.get()
+        if state is None:
+            return
+        async with state["lock"]:
+            if state["wait"] is None:
+                state["wait"] = await self.check(state["user_id"], state["ip"])
+        if state["wait"] > 0:
+            raise RateLimited(state["wait"])
+
+    async def admit_gemini_call(self, parts):
+        """admission hook لـ GeminiClient: حد الطلبات ثم الخصم من ميزانية صاحب الطلب الحالي"""
+        await self.charge_request()
+        await self.spend(ai_subject.get(), estimate_tokens(parts))
+
+    def stats(self):
+        return {**dict(self.counters), "backend_errors": self.backend.errors}
+
+    async def aclose(self):
+        await self.backend.aclose()
+
+
+def limiter_from_env():
+    """الحدود من متغيرات البيئة، مشتركة بين العمال عبر REDIS_URL إن وُجد.
+    عنوان العميل يُعتمد فقط إذا ضُبط FORWARDED_ALLOW_IPS (البروكسي الموثوق) أو RATE_LIMIT_TRUST_CLIENT_IP=1
+    (بدون بروكسي أمام التطبيق)؛ وإلا فهو عنوان البروكسي لكل المستخدمين ولا يصلح حداً أو ميزانية"""
+    url = os.getenv("RATE_LIMIT_REDIS_URL") or os.getenv("REDIS_URL")
+    trust_ip = bool(os.getenv("FORWARDED_ALLOW_IPS")) or os.getenv("RATE_LIMIT_TRUST_CLIENT_IP", "") in ("1", "true")
+    return RateLimiter(
+        RedisLimits(url) if url else MemoryLimits(),
+        user_per_minute=float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "20")),
+        user_burst=int(os.getenv("RATE_LIMIT_USER_BURST", "10")),
+        ip_per_minute=float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "60")),
+        ip_burst=int(os.getenv("RATE_LIMIT_IP_BURST", "30")),
+        daily_calls=int(os.getenv("AI_DAILY_CALLS", "150")),
+        daily_tokens=int(os.getenv("AI_DAILY_TOKENS", "150000")),
+        trust_ip=trust_ip,
+    )
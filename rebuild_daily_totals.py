@@ -0,0 +1,48 @@
+"""Backfill or repair the daily_totals rollup from the raw log tables.
+
+Usage:
+    python rebuild_daily_totals.py                 # every user
+    python rebuild_daily_totals.py --user-id <id>  # one user
+
+Needs SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY (rebuild_daily_totals is not
+executable with the anon key).
+
+With REDIS_URL set (the API's shared cache) the cached dashboards are
+invalidated afterwards. Without it the cache lives inside the API process:
+restart it, or wait CLOSED_DAY_TTL, to stop serving the old totals.
+"""
+import argparse, asyncio, os
+from dotenv import load_dotenv
+from supabase import acreate_client
+from cache_backend import ROLLUP_VERSION, backend_from_env
+
+
+async def rebuild(user_id=None):
+    client = await acreate_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE_KEY"))
+    res = await client.rpc("rebuild_daily_totals", {"p_user_id": user_id}).execute()
+    return res.data
+
+
+async def invalidate_dashboards():
+    """يرفع إصدار daily_totals في الكاش المشترك؛ False إذا لم يكن هناك REDIS_URL"""
+    if not os.getenv("REDIS_URL"):
+        return False
+    cache = backend_from_env()
+    try:
+        await cache.bump_version(ROLLUP_VERSION)
+    finally:
+        await cache.aclose()
+    return True
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user-id", default=None, help="rebuild a single user instead of everyone")
+    args = parser.parse_args()
+    rows = asyncio.run(rebuild(args.user_id))
+    print(f"daily_totals rebuilt: {rows} rows")
+    if asyncio.run(invalidate_dashboards()):
+        print("cached dashboards invalidated")
+    else:
+        print("REDIS_URL is not set: restart the API (or wait CLOSED_DAY_TTL) to drop cached dashboards")
@@ -31,6 +31,7 @@ CREATE TABLE IF NOT EXISTS public.meal_items (
     carbs FLOAT DEFAULT 0,
     fat FLOAT DEFAULT 0,
     weight_grams FLOAT DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'ready', -- 'estimating' while the AI estimate runs in the background, 'failed' if it gave up
     created_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now()) NOT NULL
 );
 
@@ -43,19 +44,19 @@ CREATE TABLE IF NOT EXISTS public.water_logs (
 );
 
 -- Sleep Logs Table
-CREATE TABLE public.sleep_logs (
-    id uuid NOT NULL DEFAULT uuid_generate_v4(),
+CREATE TABLE IF NOT EXISTS public.sleep_logs (
+    id uuid NOT NULL DEFAULT uuid_generate_v4() PRIMARY KEY,
     user_id uuid NOT NULL,
     hours numeric NOT NULL,
-    created_at timestamp without time zone DEFAULT now()
+    created_at timestamp without time zone DEFAULT now() NOT NULL
 );
 
 -- Steps Logs Table
-CREATE TABLE public.steps_logs (
-    id uuid NOT NULL DEFAULT uuid_generate_v4(),
+CREATE TABLE IF NOT EXISTS public.steps_logs (
+    id uuid NOT NULL DEFAULT uuid_generate_v4() PRIMARY KEY,
     user_id uuid NOT NULL,
     steps integer NOT NULL,
-    created_at timestamp without time zone DEFAULT now()
+    created_at timestamp without time zone DEFAULT now() NOT NULL
 );
 
 -- 5. Body Measurements Table
@@ -85,6 +86,294 @@ CREATE TABLE IF NOT EXISTS public.progress_photos (
     id BIGSERIAL PRIMARY KEY,
     user_id UUID REFERENCES public.profiles(id) ON DELETE CASCADE,
     photo_url TEXT NOT NULL,
+    thumb_url TEXT, -- 320 px JPEG made on upload (NULL for legacy base64 rows)
+    web_url TEXT, -- 1280 px JPEG made on upload
     side TEXT NOT NULL, -- 'front', 'side', 'back'
     created_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now()) NOT NULL
 );
+
+-- 7. Daily Totals (per-user, per-day rollup kept current by the triggers below)
+CREATE TABLE IF NOT EXISTS public.daily_totals (
+    user_id UUID NOT NULL,
+    day DATE NOT NULL,
+    cal FLOAT NOT NULL DEFAULT 0,
+    prot FLOAT NOT NULL DEFAULT 0,
+    carb FLOAT NOT NULL DEFAULT 0,
+    fat FLOAT NOT NULL DEFAULT 0,
+    water FLOAT NOT NULL DEFAULT 0,
+    sleep FLOAT NOT NULL DEFAULT 0,
+    steps FLOAT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+
+-- Adds (or subtracts, with negative deltas) to one day's totals
+CREATE OR REPLACE FUNCTION public.bump_daily_totals(
+    p_user_id UUID, p_day DATE,
+    d_cal FLOAT, d_prot FLOAT, d_carb FLOAT, d_fat FLOAT,
+    d_water FLOAT, d_sleep FLOAT, d_steps FLOAT
+) RETURNS void
+LANGUAGE sql SECURITY DEFINER SET search_path = public AS $$
+    INSERT INTO public.daily_totals AS t (user_id, day, cal, prot, carb, fat, water, sleep, steps)
+    VALUES (p_user_id, p_day, d_cal, d_prot, d_carb, d_fat, d_water, d_sleep, d_steps)
+    ON CONFLICT (user_id, day) DO UPDATE SET
+        cal = t.cal + EXCLUDED.cal,
+        prot = t.prot + EXCLUDED.prot,
+        carb = t.carb + EXCLUDED.carb,
+        fat = t.fat + EXCLUDED.fat,
+        water = t.water + EXCLUDED.water,
+        sleep = t.sleep + EXCLUDED.sleep,
+        steps = t.steps + EXCLUDED.steps;
+$$;
+
+CREATE OR REPLACE FUNCTION public.daily_totals_meal_items() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+DECLARE
+    m RECORD;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        -- If the parent meal is already gone (cascade delete) its trigger has settled the totals
+        SELECT user_id, (created_at AT TIME ZONE 'utc')::date AS day INTO m FROM public.meals WHERE id = OLD.meal_id;
+        IF FOUND AND m.user_id IS NOT NULL THEN
+            PERFORM public.bump_daily_totals(m.user_id, m.day,
+                -COALESCE(OLD.calories, 0), -COALESCE(OLD.protein, 0), -COALESCE(OLD.carbs, 0), -COALESCE(OLD.fat, 0), 0, 0, 0);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT user_id, (created_at AT TIME ZONE 'utc')::date AS day INTO m FROM public.meals WHERE id = NEW.meal_id;
+        IF FOUND AND m.user_id IS NOT NULL THEN
+            PERFORM public.bump_daily_totals(m.user_id, m.day,
+                COALESCE(NEW.calories, 0), COALESCE(NEW.protein, 0), COALESCE(NEW.carbs, 0), COALESCE(NEW.fat, 0), 0, 0, 0);
+        END IF;
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION public.daily_totals_meals() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+DECLARE
+    s RECORD;
+BEGIN
+    SELECT COALESCE(SUM(calories), 0) AS cal, COALESCE(SUM(protein), 0) AS prot,
+           COALESCE(SUM(carbs), 0) AS carb, COALESCE(SUM(fat), 0) AS fat
+    INTO s FROM public.meal_items WHERE meal_id = OLD.id;
+    IF OLD.user_id IS NOT NULL THEN
+        PERFORM public.bump_daily_totals(OLD.user_id, (OLD.created_at AT TIME ZONE 'utc')::date,
+            -s.cal, -s.prot, -s.carb, -s.fat, 0, 0, 0);
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.user_id IS NOT NULL THEN
+            PERFORM public.bump_daily_totals(NEW.user_id, (NEW.created_at AT TIME ZONE 'utc')::date,
+                s.cal, s.prot, s.carb, s.fat, 0, 0, 0);
+        END IF;
+        RETURN NEW;
+    END IF;
+    RETURN OLD;
+END $$;
+
+CREATE OR REPLACE FUNCTION public.daily_totals_water_logs() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.user_id IS NOT NULL THEN
+        PERFORM public.bump_daily_totals(OLD.user_id, (OLD.created_at AT TIME ZONE 'utc')::date, 0, 0, 0, 0, -OLD.amount_ml, 0, 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.user_id IS NOT NULL THEN
+        PERFORM public.bump_daily_totals(NEW.user_id, (NEW.created_at AT TIME ZONE 'utc')::date, 0, 0, 0, 0, NEW.amount_ml, 0, 0);
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION public.daily_totals_sleep_logs() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.created_at IS NOT NULL THEN
+        PERFORM public.bump_daily_totals(OLD.user_id, OLD.created_at::date, 0, 0, 0, 0, 0, -OLD.hours, 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.created_at IS NOT NULL THEN
+        PERFORM public.bump_daily_totals(NEW.user_id, NEW.created_at::date, 0, 0, 0, 0, 0, NEW.hours, 0);
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION public.daily_totals_steps_logs() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.created_at IS NOT NULL THEN
+        PERFORM public.bump_daily_totals(OLD.user_id, OLD.created_at::date, 0, 0, 0, 0, 0, 0, -OLD.steps);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.created_at IS NOT NULL THEN
+        PERFORM public.bump_daily_totals(NEW.user_id, NEW.created_at::date, 0, 0, 0, 0, 0, 0, NEW.steps);
+    END IF;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS daily_totals_meal_items ON public.meal_items;
+CREATE TRIGGER daily_totals_meal_items AFTER INSERT OR UPDATE OR DELETE ON public.meal_items
+    FOR EACH ROW EXECUTE FUNCTION public.daily_totals_meal_items();
+
+-- BEFORE DELETE so the meal's items are still visible when the totals are settled
+DROP TRIGGER IF EXISTS daily_totals_meals ON public.meals;
+CREATE TRIGGER daily_totals_meals BEFORE DELETE OR UPDATE OF user_id, created_at ON public.meals
+    FOR EACH ROW EXECUTE FUNCTION public.daily_totals_meals();
+
+DROP TRIGGER IF EXISTS daily_totals_water_logs ON public.water_logs;
+CREATE TRIGGER daily_totals_water_logs AFTER INSERT OR UPDATE OR DELETE ON public.water_logs
+    FOR EACH ROW EXECUTE FUNCTION public.daily_totals_water_logs();
+
+DROP TRIGGER IF EXISTS daily_totals_sleep_logs ON public.sleep_logs;
+CREATE TRIGGER daily_totals_sleep_logs AFTER INSERT OR UPDATE OR DELETE ON public.sleep_logs
+    FOR EACH ROW EXECUTE FUNCTION public.daily_totals_sleep_logs();
+
+DROP TRIGGER IF EXISTS daily_totals_steps_logs ON public.steps_logs;
+CREATE TRIGGER daily_totals_steps_logs AFTER INSERT OR UPDATE OR DELETE ON public.steps_logs
+    FOR EACH ROW EXECUTE FUNCTION public.daily_totals_steps_logs();
+
+-- Backfill / repair: recompute daily_totals from the raw logs (all users when p_user_id is NULL).
+-- Run with: python rebuild_daily_totals.py [--user-id <uuid>]
+CREATE OR REPLACE FUNCTION public.rebuild_daily_totals(p_user_id UUID DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    n INTEGER;
+BEGIN
+    DELETE FROM public.daily_totals WHERE p_user_id IS NULL OR user_id = p_user_id;
+    INSERT INTO public.daily_totals (user_id, day, cal, prot, carb, fat, water, sleep, steps)
+    SELECT user_id, day, SUM(cal), SUM(prot), SUM(carb), SUM(fat), SUM(water), SUM(sleep), SUM(steps)
+    FROM (
+        SELECT m.user_id, (m.created_at AT TIME ZONE 'utc')::date AS day,
+               COALESCE(mi.calories, 0) AS cal, COALESCE(mi.protein, 0) AS prot,
+               COALESCE(mi.carbs, 0) AS carb, COALESCE(mi.fat, 0) AS fat,
+               0 AS water, 0 AS sleep, 0 AS steps
+        FROM public.meals m JOIN public.meal_items mi ON mi.meal_id = m.id
+        UNION ALL
+        SELECT user_id, (created_at AT TIME ZONE 'utc')::date, 0, 0, 0, 0, amount_ml, 0, 0 FROM public.water_logs
+        UNION ALL
+        SELECT user_id, created_at::date, 0, 0, 0, 0, 0, hours, 0 FROM public.sleep_logs
+        UNION ALL
+        SELECT user_id, created_at::date, 0, 0, 0, 0, 0, 0, steps FROM public.steps_logs
+    ) src
+    WHERE src.user_id IS NOT NULL AND src.day IS NOT NULL AND (p_user_id IS NULL OR src.user_id = p_user_id)
+    GROUP BY user_id, day;
+    GET DIAGNOSTICS n = ROW_COUNT;
+    RETURN n;
+END $$;
+
+-- Only the server (service role) may write totals directly or rebuild them
+REVOKE EXECUTE ON FUNCTION public.bump_daily_totals(UUID, DATE, FLOAT, FLOAT, FLOAT, FLOAT, FLOAT, FLOAT, FLOAT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.rebuild_daily_totals(UUID) FROM PUBLIC, anon, authenticated;
+
+-- 8. Daily Stats Function (per-day totals for /get_stats in one round-trip)
+CREATE OR REPLACE FUNCTION public.get_daily_stats(p_user_id UUID, p_start DATE, p_end DATE)
+RETURNS TABLE (day DATE, calories FLOAT, water FLOAT, sleep FLOAT, steps FLOAT)
+LANGUAGE sql STABLE AS $$
+    SELECT d.day::date,
+           COALESCE(t.cal, 0),
+           COALESCE(t.water, 0),
+           COALESCE(t.sleep, 0),
+           COALESCE(t.steps, 0)
+    FROM generate_series(p_start, p_end, interval '1 day') AS d(day)
+    LEFT JOIN public.daily_totals t ON t.user_id = p_user_id AND t.day = d.day::date
+    ORDER BY d.day;
+$$;
+
+-- 9. Indexes (every read path filters by user_id + created_at range, meal_items by meal_id)
+-- Existing databases: apply migrations/001_log_indexes.sql instead.
+CREATE INDEX IF NOT EXISTS meals_user_created_idx ON public.meals (user_id, created_at);
+CREATE INDEX IF NOT EXISTS meal_items_meal_id_idx ON public.meal_items (meal_id);
+CREATE INDEX IF NOT EXISTS water_logs_user_created_idx ON public.water_logs (user_id, created_at);
+CREATE INDEX IF NOT EXISTS sleep_logs_user_created_idx ON public.sleep_logs (user_id, created_at);
+CREATE INDEX IF NOT EXISTS steps_logs_user_created_idx ON public.steps_logs (user_id, created_at);
+CREATE INDEX IF NOT EXISTS body_measurements_user_created_idx ON public.body_measurements (user_id, created_at DESC);
+-- Gallery pages are read newest-first by (created_at, id), optionally for one side
+CREATE INDEX IF NOT EXISTS progress_photos_user_created_id_idx ON public.progress_photos (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS progress_photos_user_side_created_id_idx ON public.progress_photos (user_id, side, created_at DESC, id DESC);
+
+-- 10. Photo Landmarks (detected once per image by /align_photos, keyed by a SHA-256 of the photo bytes)
+CREATE TABLE IF NOT EXISTS public.photo_landmarks (
+    content_hash TEXT PRIMARY KEY,
+    photo_id BIGINT REFERENCES public.progress_photos(id) ON DELETE CASCADE,
+    side TEXT,
+    landmarks JSONB NOT NULL, -- {"l_eye": [x, y], ...} normalized 0..1000
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+CREATE INDEX IF NOT EXISTS photo_landmarks_photo_id_idx ON public.photo_landmarks (photo_id);
+
+-- 11. Incremental Sync (/sync?since=cursor reads rows by updated_at, deletes from deleted_rows)
+-- updated_at on every table the app syncs (kept current by a BEFORE UPDATE trigger)
+ALTER TABLE public.meals ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.meal_items ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.water_logs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.sleep_logs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.steps_logs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.body_measurements ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE public.progress_photos ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION public.touch_updated_at() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END $$;
+
+-- Tombstones: one row per deleted record so clients can drop it from their local copy.
+-- Deleting a meal also removes its items locally (their own tombstones cannot
+-- be attributed once the meal row is gone).
+CREATE TABLE IF NOT EXISTS public.deleted_rows (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_id TEXT NOT NULL,
+    user_id UUID NOT NULL,
+    deleted_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION public.record_deleted_row() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+DECLARE
+    uid UUID;
+BEGIN
+    IF TG_TABLE_NAME = 'meal_items' THEN
+        SELECT user_id INTO uid FROM public.meals WHERE id = OLD.meal_id;
+    ELSE
+        uid := OLD.user_id;
+    END IF;
+    IF uid IS NOT NULL THEN
+        INSERT INTO public.deleted_rows (table_name, row_id, user_id) VALUES (TG_TABLE_NAME, OLD.id::text, uid);
+    END IF;
+    RETURN OLD;
+END $$;
+
+DO $$
+DECLARE t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['meals', 'meal_items', 'water_logs', 'sleep_logs', 'steps_logs', 'body_measurements', 'progress_photos'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS touch_updated_at ON public.%I', t);
+        EXECUTE format('CREATE TRIGGER touch_updated_at BEFORE UPDATE ON public.%I FOR EACH ROW EXECUTE FUNCTION public.touch_updated_at()', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS record_deleted_row ON public.%I', t);
+        EXECUTE format('CREATE TRIGGER record_deleted_row AFTER DELETE ON public.%I FOR EACH ROW EXECUTE FUNCTION public.record_deleted_row()', t);
+    END LOOP;
+END $$;
+
+-- Tombstones older than the sync retention (SYNC_RETENTION_DAYS, 30 by default)
+-- can go; clients that have not synced for that long get a "reset" and start over.
+CREATE OR REPLACE FUNCTION public.prune_deleted_rows(p_keep INTERVAL DEFAULT interval '30 days')
+RETURNS BIGINT LANGUAGE sql SECURITY DEFINER SET search_path = public AS $$
+    WITH gone AS (DELETE FROM public.deleted_rows WHERE deleted_at < now() - p_keep RETURNING 1)
+    SELECT count(*) FROM gone;
+$$;
+REVOKE EXECUTE ON FUNCTION public.prune_deleted_rows(INTERVAL) FROM PUBLIC, anon, authenticated;
+
+-- Every sync query walks (user_id, updated_at, id)
+CREATE INDEX IF NOT EXISTS meals_user_updated_idx ON public.meals (user_id, updated_at, id);
+CREATE INDEX IF NOT EXISTS meal_items_updated_idx ON public.meal_items (updated_at, id);
+CREATE INDEX IF NOT EXISTS water_logs_user_updated_idx ON public.water_logs (user_id, updated_at, id);
+CREATE INDEX IF NOT EXISTS sleep_logs_user_updated_idx ON public.sleep_logs (user_id, updated_at, id);
+CREATE INDEX IF NOT EXISTS steps_logs_user_updated_idx ON public.steps_logs (user_id, updated_at, id);
+CREATE INDEX IF NOT EXISTS body_measurements_user_updated_idx ON public.body_measurements (user_id, updated_at, id);
+CREATE INDEX IF NOT EXISTS progress_photos_user_updated_idx ON public.progress_photos (user_id, updated_at, id);
+CREATE INDEX IF NOT EXISTS deleted_rows_user_deleted_idx ON public.deleted_rows (user_id, deleted_at, id);
+
+-- 12. Wearable Import (/import_wearable upserts hourly/daily buckets per import source)
+-- source is NULL for rows logged by hand, so those never conflict with each other
+ALTER TABLE public.sleep_logs ADD COLUMN IF NOT EXISTS source TEXT;
+ALTER TABLE public.steps_logs ADD COLUMN IF NOT EXISTS source TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS sleep_logs_user_source_created_key ON public.sleep_logs (user_id, source, created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS steps_logs_user_source_created_key ON public.steps_logs (user_id, source, created_at);
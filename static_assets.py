@@ -0,0 +1,88 @@
+import mimetypes, os, re
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+# تقديم build/web: نسخ .br / .gz المضغوطة مسبقاً (precompress_web.py) وترويسات كاش حسب نوع الملف
+# الطلبات الجزئية (Range) يخدمها FileResponse نفسه على الملف الأصلي
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# ملفات تحدد أي نسخة من التطبيق تُحمّل: تُراجع مع كل زيارة (304 إن لم تتغير)
+ENTRY_FILES = {"index.html", "flutter_service_worker.js", "flutter.js", "version.json", "manifest.json"}
+# اسم فيه بصمة المحتوى (main.3f2a9c1d.js) أو رابط فيه ?v=
+HASHED_NAME = re.compile(r"[.-][0-9a-f]{8,}\.[^/]+$")
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def accepted_encodings(header):
+    """الترميزات التي يقبلها العميل (مع احترام q=0)"""
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        params = params.strip()
+        try:
+            if not params.startswith("q=") or float(params[2:]) > 0:
+                accepted.add(name.strip().lower())
+        except ValueError:
+            continue
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles يقدّم main.dart.js.br بدل main.dart.js إن وُجد وقبله المتصفح"""
+
+    def __init__(self, *args, max_age=3600, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_age = max_age
+        # full_path -> (mtime الأصل، {encoding: (مسار، stat)}) حتى لا نعيد stat لكل طلب
+        self._variants = {}
+
+    def cache_control(self, full_path, scope):
+        name = os.path.basename(full_path)
+        if name in ENTRY_FILES:
+            return REVALIDATE
+        if HASHED_NAME.search(name) or re.search(rb"(^|&)v=", scope.get("query_string", b"")):
+            return IMMUTABLE
+        return f"public, max-age={self.max_age}"
+
+    def variants(self, full_path, stat_result):
+        cached = self._variants.get(full_path)
+        if cached and cached[0] == stat_result.st_mtime:
+            return cached[1]
+        found = {}
+        for encoding, suffix in ENCODINGS:
+            try:
+                variant_stat = os.stat(f"{full_path}{suffix}")
+            except OSError:
+                continue
+            # نسخة أقدم من الأصل بقيت من بناء سابق: لا تُقدّم
+            if variant_stat.st_mtime >= stat_result.st_mtime:
+                found[encoding] = (f"{full_path}{suffix}", variant_stat)
+        self._variants[full_path] = (stat_result.st_mtime, found)
+        return found
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        headers = {"Cache-Control": self.cache_control(full_path, scope)}
+        variants = self.variants(str(full_path), stat_result)
+        response = None
+        if variants:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(request_headers.get("accept-encoding"))
+            # Range يُطبّق على الملف الأصلي: إزاحات البايتات لا معنى لها داخل الملف المضغوط
+            encoding = next((e for e, _ in ENCODINGS if e in accepted and e in variants), None)
+            if encoding and "range" not in request_headers:
+                path, variant_stat = variants[encoding]
+                response = FileResponse(
+                    path,
+                    status_code=status_code,
+                    stat_result=variant_stat,
+                    media_type=mimetypes.guess_type(str(full_path))[0] or "text/plain",
+                    headers={**headers, "Content-Encoding": encoding},
+                )
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
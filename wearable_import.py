@@ -0,0 +1,161 @@
+import csv, json, re
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+# استيراد بيانات الساعات الذكية (Health Connect / Apple Health) دفعة واحدة:
+# العينات تُجمع في خانات (ساعة أو يوم للخطوات، ليلة للنوم) ثم تُكتب بـ upsert،
+# فإعادة استيراد نفس الملف تعطي نفس الصفوف بدلاً من تكرارها
+STEP_TYPES = {"steps", "stepcount", "stepsrecord", "hkquantitytypeidentifierstepcount"}
+SLEEP_TYPES = {"sleep", "sleepsession", "sleepsessionrecord", "sleepanalysis", "hkcategorytypeidentifiersleepanalysis"}
+START_KEYS = ("start", "start_time", "starttime", "startdate", "from")
+END_KEYS = ("end", "end_time", "endtime", "enddate", "to")
+VALUE_KEYS = ("value", "count", "steps", "hours", "qty")
+# مراحل Apple Health التي لا تُحسب نوماً (InBed يغطي نفس فترة مراحل النوم)
+NOT_ASLEEP = ("inbed", "awake")
+
+
+def _norm(name):
+    return re.sub(r"[^a-z0-9_]", "", str(name).lower())
+
+
+def _field(record, keys):
+    for key in keys:
+        value = record.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def parse_time(value):
+    """وقت العينة كما تراه الساعة (التوقيت المحلي بدون المنطقة)، أو من epoch بالثواني/الميلي ثانية"""
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.isdigit()):
+        value = float(value)
+        if value > 1e11:
+            value /= 1000
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    text = str(value).strip()
+    # "2024-01-01 07:00:00 +0200" (تصدير Apple Health)
+    text = re.sub(r"\s+([+-]\d{2}):?(\d{2})$", r"\1:\2", text)
+    return datetime.fromisoformat(text.replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+class WearableBuckets:
+    """Running per-bucket sums for one import.
+
+    Steps samples are spread over the hour (or day) buckets they overlap,
+    proportionally to time; sleep is summed per night, keyed by the day
+    the user woke up. Memory is bounded by the number of buckets, not the
+    number of samples.
+    """
+
+    def __init__(self, bucket="hour"):
+        if bucket not in ("hour", "day"):
+            raise ValueError("bucket must be 'hour' or 'day'")
+        self.step = timedelta(hours=1) if bucket == "hour" else timedelta(days=1)
+        self.steps = defaultdict(float)
+        self.sleep = defaultdict(float)
+        self.samples = 0
+        self.skipped = 0
+
+    def _bucket_start(self, t):
+        if self.step == timedelta(hours=1):
+            return t.replace(minute=0, second=0, microsecond=0)
+        return t.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def add(self, record):
+        """عينة واحدة {type, start, end, value}؛ العينات غير المفهومة تُعدّ ولا توقف الاستيراد"""
+        try:
+            record = {_norm(k): v for k, v in record.items()}
+            kind = _norm(_field(record, ("type", "record_type", "kind")) or "")
+            start = _field(record, START_KEYS)
+            end = _field(record, END_KEYS)
+            value = _field(record, VALUE_KEYS)
+            if kind in STEP_TYPES:
+                self._add_steps(parse_time(start), parse_time(end or start), float(value))
+            elif kind in SLEEP_TYPES:
+                self._add_sleep(parse_time(start), parse_time(end) if end else None, value)
+            else:
+                raise ValueError(f"Unknown type {kind}")
+            self.samples += 1
+        except (TypeError, ValueError, AttributeError):
+            self.skipped += 1
+
+    def _add_steps(self, start, end, count):
+        if count < 0 or end < start:
+            raise ValueError("Invalid steps sample")
+        span = (end - start).total_seconds()
+        bucket = self._bucket_start(start)
+        if span == 0 or bucket + self.step >= end:
+            self.steps[bucket] += count
+            return
+        # عينة تمتد على أكثر من خانة: توزيع الخطوات حسب مدة التداخل
+        while bucket < end:
+            overlap = (min(end, bucket + self.step) - max(start, bucket)).total_seconds()
+            self.steps[bucket] += count * overlap / span
+            bucket += self.step
+
+    def _add_sleep(self, start, end, value):
+        if isinstance(value, str) and not re.fullmatch(r"[\d.]+", value):
+            if any(stage in _norm(value) for stage in NOT_ASLEEP):
+                return
+            value = None
+        if end is not None:
+            if end <= start:
+                raise ValueError("Invalid sleep sample")
+            hours = (end - start).total_seconds() / 3600
+            night = end
+        else:
+            hours = float(value)
+            night = start
+        if hours > 24:
+            raise ValueError("Sleep session is longer than a day")
+        self.sleep[night.replace(hour=0, minute=0, second=0, microsecond=0)] += hours
+
+    def rows(self, user_id, source):
+        """{table: [rows]} جاهزة لـ upsert على (user_id, source, created_at)"""
+        fmt = "%Y-%m-%d %H:%M:%S"
+        return {
+            "steps_logs": [
+                {"user_id": user_id, "source": source, "created_at": t.strftime(fmt), "steps": int(round(n))}
+                for t, n in sorted(self.steps.items())
+            ],
+            "sleep_logs": [
+                {"user_id": user_id, "source": source, "created_at": t.strftime(fmt), "hours": round(h, 2)}
+                for t, h in sorted(self.sleep.items())
+            ],
+        }
+
+    def days(self):
+        return sorted({t.strftime("%Y-%m-%d") for t in (*self.steps, *self.sleep)})
+
+
+async def iter_lines(chunks):
+    """أسطر نصية من تدفق بايتات (request.stream()) بدون تحميل الملف كاملاً"""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8-sig").rstrip("\r")
+
+
+async def iter_records(chunks, fmt):
+    """عينات من NDJSON (كائن JSON في كل سطر) أو CSV (السطر الأول أسماء الأعمدة)"""
+    header = None
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        if fmt == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = values
+                continue
+            yield dict(zip(header, values))
+        else:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+            yield record if isinstance(record, dict) else {}